@@ -0,0 +1,971 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import aiohttp
+from aiohttp import web
+from loguru import logger
+
+from main import (PAYMENT_KEY_MAPPING, SCHEMA_MIGRATIONS, MemoryControl, MemoryRect, MemoryWindowSource,
+                  MultiSourceMonitor, OrderRegistry, PaymentNotifier, SQLitePool, SyntheticEventSource,
+                  WeChatPaymentAPI, WeChatPaymentMonitor, extract_message_tokens, load_control_tree,
+                  migrate_database, normalize_token, open_db_connection, parse_payment_texts, save_control_tree)
+
+
+def build_payment_item(index: int, runtime_id: tuple = None) -> MemoryControl:
+    """构造一条与微信收款消息结构一致的列表项"""
+    fields = [
+        ("收款金额", f"￥{index % 100 + 1}.00"),
+        ("来自", f"用户{index}"),
+        ("付款方留言", f"ORDER{index:08d}"),
+        ("到账时间", f"2024-01-01 {index // 3600 % 24:02d}:{index // 60 % 60:02d}:{index % 60:02d}"),
+        ("备注", "收款成功"),
+    ]
+    pane = MemoryControl('PaneControl')
+    pane.append(MemoryControl('TextControl', '微信支付'))
+    for label, value in fields:
+        row = pane.append(MemoryControl('PaneControl'))
+        row.append(MemoryControl('TextControl', label))
+        row.append(MemoryControl('TextControl', value))
+    return MemoryControl('ListItemControl', '', [pane], rect=MemoryRect(0, index * 100, 400, index * 100 + 100),
+                         runtime_id=runtime_id)
+
+
+def build_payment_window(count: int, start: int = 0):
+    """构造包含 count 条收款消息（编号从 start 开始）的内存窗口"""
+    payment_list = MemoryControl('ListControl', '消息', [build_payment_item(i) for i in range(start, start + count)])
+    window = MemoryControl('WindowControl', '微信支付', [payment_list])
+    return window, payment_list
+
+
+def quiet_logger():
+    """只保留警告以上日志，避免日志输出影响测量"""
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+
+def create_monitor(payment_list_size: int, db_name: str = None):
+    """在内存控件树上创建监控实例"""
+    window, payment_list = build_payment_window(payment_list_size)
+    monitor = WeChatPaymentMonitor(db_name=db_name, wechat_window=window, payment_list=payment_list)
+    quiet_logger()
+    return monitor, payment_list
+
+
+def percentile(values, pct: float) -> float:
+    """计算百分位数"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def legacy_full_scan(monitor: WeChatPaymentMonitor, previous_records: list) -> list:
+    """旧版扫描：每次读取全部子控件并重建最后 NORMAL_RUN_LIMIT 条记录"""
+    list_items = [item for item in monitor.payment_list.GetChildren()
+                  if item.ControlTypeName == 'ListItemControl']
+    payments = [info for info in map(monitor.extract_payment_info, list_items[-monitor.normal_run_limit:]) if info]
+    new_payments = [p for p in payments if p not in previous_records]
+    previous_records[:] = payments
+    return new_payments
+
+
+def legacy_extract(control) -> dict:
+    """旧版提取：递归收集文本控件后线性查找标签，并重复读取名称"""
+    def collect(node):
+        text_controls = [node] if node.ControlTypeName == 'TextControl' else []
+        for child in node.GetChildren():
+            text_controls.extend(collect(child))
+        return text_controls
+
+    text_controls = collect(control)
+    controls_dict = {}
+    for i, text_control in enumerate(text_controls):
+        name = text_control.Name
+        if name in PAYMENT_KEY_MAPPING and i + 1 < len(text_controls):
+            next_control = text_controls[i + 1]
+            if next_control.ControlTypeName == 'TextControl':
+                controls_dict[PAYMENT_KEY_MAPPING[name]] = next_control.Name.replace("￥", "")
+    return controls_dict
+
+
+def _measure(func, rounds: int):
+    MemoryControl.call_count = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = time.perf_counter() - start
+    return elapsed / rounds * 1000, MemoryControl.call_count / rounds
+
+
+def bench_scan(sizes, rounds: int):
+    """对比全量扫描与增量扫描在空闲/有新消息时的耗时和调用次数"""
+    print(f"{'items':>8} {'mode':<12} {'idle ms':>10} {'idle calls':>11} {'new ms':>10} {'new calls':>10}")
+    for size in sizes:
+        monitor, payment_list = create_monitor(size)
+
+        previous_records = []
+        legacy_full_scan(monitor, previous_records)
+        idle = _measure(lambda: legacy_full_scan(monitor, previous_records), rounds)
+        counter = iter(range(size, size + rounds))
+        new = _measure(lambda: (payment_list.append(build_payment_item(next(counter))),
+                                legacy_full_scan(monitor, previous_records)), rounds)
+        print(f"{size:>8} {'full':<12} {idle[0]:>10.3f} {idle[1]:>11.0f} {new[0]:>10.3f} {new[1]:>10.0f}")
+
+        monitor, payment_list = create_monitor(size)
+        monitor.get_all_payment_records()
+        idle = _measure(monitor.get_all_payment_records, rounds)
+        counter = iter(range(size, size + rounds))
+        new = _measure(lambda: (payment_list.append(build_payment_item(next(counter))),
+                                monitor.get_all_payment_records()), rounds)
+        print(f"{size:>8} {'incremental':<12} {idle[0]:>10.3f} {idle[1]:>11.0f} {new[0]:>10.3f} {new[1]:>10.0f}")
+
+
+def bench_extract(sizes, rounds: int):
+    """对比旧版提取、单次遍历提取与纯解析（基于录制的节点序列）的耗时"""
+    print(f"{'items':>8} {'mode':<10} {'total ms':>10} {'us/item':>10} {'calls/item':>11}")
+    for size in sizes:
+        monitor, payment_list = create_monitor(size)
+        items = payment_list.GetChildren()
+        recorded = [list(monitor.iter_control_nodes(item)) for item in items]
+
+        modes = [
+            ('legacy', lambda: [legacy_extract(item) for item in items]),
+            ('walker', lambda: [monitor.extract_payment_info(item) for item in items]),
+            ('parse', lambda: [parse_payment_texts(nodes) for nodes in recorded]),
+        ]
+        for mode, func in modes:
+            elapsed, calls = _measure(func, rounds)
+            print(f"{size:>8} {mode:<10} {elapsed:>10.3f} {elapsed * 1000 / size:>10.2f} {calls / size:>11.1f}")
+
+
+def _pipeline_stages(window, payment_list, rounds: int, db_name: str) -> list:
+    """在控件树上依次测量提取、扫描和入库各阶段，返回 [(阶段, 毫秒, 条数, 调用次数)]"""
+    monitor = WeChatPaymentMonitor(db_name=db_name, wechat_window=window, payment_list=payment_list,
+                                   install_handlers=False)
+    items = [item for item in payment_list.GetChildren() if item.ControlTypeName == 'ListItemControl']
+    size = len(items)
+    results = []
+
+    elapsed, calls = _measure(lambda: [monitor.extract_payment_info(item) for item in items], rounds)
+    results.append(('extract', elapsed, size, calls))
+
+    # 首次扫描（不含滚动加载）：清空已处理记录后读取全部列表项
+    normal_run_limit = monitor.normal_run_limit
+    monitor.normal_run_limit = size
+
+    def first_scan():
+        monitor.scanner.reset()
+        return monitor.get_all_payment_records()
+
+    elapsed, calls = _measure(first_scan, rounds)
+    results.append(('scan-first', elapsed, size, calls))
+    monitor.normal_run_limit = normal_run_limit
+
+    monitor.get_all_payment_records()
+    elapsed, calls = _measure(monitor.get_all_payment_records, rounds)
+    results.append(('scan-idle', elapsed, 0, calls))
+
+    # 新消息使用独立的运行时ID前缀，避免与录制文件中的ID冲突
+    counter = iter(range(10 ** 6, 10 ** 6 + rounds))
+
+    def new_message():
+        index = next(counter)
+        payment_list.append(build_payment_item(index, runtime_id=(7, index)))
+        return monitor.get_all_payment_records()
+
+    elapsed, calls = _measure(new_message, rounds)
+    results.append(('scan-new', elapsed, 1, calls))
+
+    # 完整入库路径：首次扫描得到的全部支付记录写入空数据库
+    async def ingest(payments):
+        notifier = PaymentNotifier('', '', db_name=db_name)
+        return await notifier.process_new_payments(payments)
+
+    monitor.normal_run_limit = size + rounds
+    monitor.scanner.reset()
+    MemoryControl.call_count = 0
+    start = time.perf_counter()
+    payments = monitor.get_all_payment_records()
+    scanned = time.perf_counter()
+    asyncio.run(ingest(payments))
+    done = time.perf_counter()
+    results.append(('ingest', (done - scanned) * 1000, len(payments), 0))
+    results.append(('pipeline', (done - start) * 1000, len(payments), MemoryControl.call_count))
+    return results
+
+
+def bench_pipeline(sizes, rounds: int, latency: float, replay: str = None, json_path: str = None):
+    """扫描流水线基准：在回放的控件树上测量提取、扫描（首次/空闲/有新消息）和完整入库路径
+
+    未指定录制文件时按 sizes 生成内存控件树，并经过录制/回放往返以使用同一回放后端。
+    latency 为每次控件接口调用的模拟耗时（秒）。
+    """
+    quiet_logger()
+    print(f"{'items':>7} {'stage':<11} {'ms':>10} {'us/item':>9} {'calls':>10}")
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        if replay:
+            cases = [replay]
+        else:
+            cases = []
+            for size in sizes:
+                path = os.path.join(tmp, f'list-{size}.json.gz')
+                save_control_tree(build_payment_window(size)[1], path)
+                cases.append(path)
+
+        for index, path in enumerate(cases):
+            payment_list = load_control_tree(path)
+            window = MemoryControl('WindowControl', '微信支付', [payment_list])
+            file_bytes = os.path.getsize(path)
+            db_name = os.path.join(tmp, f'bench-{index}.db')
+            MemoryControl.call_latency = latency
+            try:
+                results = _pipeline_stages(window, payment_list, rounds, db_name)
+            finally:
+                MemoryControl.call_latency = 0.0
+            SQLitePool.get(db_name).close()
+
+            items = results[0][2]
+            print(f"{items:>7} {'file KB':<11} {file_bytes / 1024:>10.1f}")
+            for stage, elapsed, count, calls in results:
+                per_item = elapsed * 1000 / count if count else 0.0
+                print(f"{items:>7} {stage:<11} {elapsed:>10.3f} {per_item:>9.2f} {calls:>10.0f}")
+                report.append({'items': items, 'stage': stage, 'ms': elapsed, 'us_per_item': per_item,
+                               'calls': calls, 'latency_us': latency * 1e6, 'file_bytes': file_bytes})
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+async def _detection_latency(mode: str, count: int, gap: float, check_interval: float, db_name: str):
+    """测量从消息出现在列表到写入数据库的延迟"""
+    monitor, payment_list = create_monitor(10, db_name)
+    monitor.check_interval = check_interval
+    notifier = PaymentNotifier('', '', db_name=db_name)
+
+    appeared = {}
+    latencies = []
+    finished = asyncio.Event()
+
+    def on_insert(payment_data):
+        latencies.append(time.perf_counter() - appeared[payment_data['message']])
+        if len(latencies) == count:
+            finished.set()
+
+    notifier.add_payment_listener(on_insert)
+    source = SyntheticEventSource()
+    if mode == 'event':
+        monitor.start_event_source(source)
+    monitor.get_all_payment_records()
+
+    async def scan_loop():
+        while monitor.running:
+            for payment in monitor.get_all_payment_records():
+                await notifier.ingest_queue.put(payment)
+            await monitor.wait_for_change()
+
+    tasks = [asyncio.create_task(notifier.ingest_worker()), asyncio.create_task(scan_loop())]
+    for i in range(count):
+        await asyncio.sleep(random.uniform(0, 2 * gap))
+        item = build_payment_item(1000 + i)
+        appeared[f"ORDER{1000 + i:08d}"] = time.perf_counter()
+        payment_list.append(item)
+        source.fire()
+    await asyncio.wait_for(finished.wait(), timeout=count * gap + check_interval * 4 + 10)
+
+    monitor.running = False
+    monitor.stop_event_source()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return latencies
+
+
+def bench_events(count: int, gap: float, check_interval: float):
+    """对比固定间隔轮询与事件驱动模式的检测到入库延迟"""
+    print(f"{'mode':<8} {'count':>6} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for mode in ('poll', 'event'):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_name = os.path.join(tmp, 'bench.db')
+            latencies = asyncio.run(_detection_latency(mode, count, gap, check_interval, db_name))
+        print(f"{mode:<8} {len(latencies):>6} {percentile(latencies, 50) * 1000:>10.1f} "
+              f"{percentile(latencies, 99) * 1000:>10.1f} {max(latencies) * 1000:>10.1f}")
+
+
+async def _multi_source_ingest(sources: int, count: int, gap: float, db_name: str):
+    """sources 个模拟窗口（各自的历史记录不同）同时收到相同的收款消息，测量检测到入库延迟"""
+    windows = [build_payment_window(10, start=index * 10000) for index in range(sources)]
+    events = [SyntheticEventSource() for _ in range(sources)]
+    monitor = MultiSourceMonitor(
+        lambda: [MemoryWindowSource(f"wx{index}", window, payment_list, event_source)
+                 for index, ((window, payment_list), event_source) in enumerate(zip(windows, events))],
+        db_name=db_name, install_handlers=False)
+    notifier = PaymentNotifier('', '', db_name=db_name)
+
+    appeared = {}
+    latencies = []
+    finished = asyncio.Event()
+
+    def on_insert(payment_data):
+        started = appeared.get((payment_data['source'], payment_data['message']))
+        if started is None:
+            return
+        latencies.append(time.perf_counter() - started)
+        if len(latencies) == sources * count:
+            finished.set()
+
+    notifier.add_payment_listener(on_insert)
+    ingest_task = asyncio.create_task(notifier.ingest_worker())
+    monitor.start(asyncio.get_running_loop(), notifier.ingest_queue)
+    await asyncio.sleep(0.5)
+
+    start = time.perf_counter()
+    for i in range(count):
+        await asyncio.sleep(random.uniform(0, 2 * gap))
+        for index, ((_, payment_list), event_source) in enumerate(zip(windows, events)):
+            appeared[(f"wx{index}", f"ORDER{1000 + i:08d}")] = time.perf_counter()
+            payment_list.append(build_payment_item(1000 + i))
+            event_source.fire()
+    try:
+        await asyncio.wait_for(finished.wait(), timeout=count * gap * 2 + 10)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+
+    await asyncio.to_thread(monitor.stop)
+    ingest_task.cancel()
+    await asyncio.gather(ingest_task, return_exceptions=True)
+    with notifier.db.connection() as conn:
+        per_source = dict(conn.execute("SELECT source, COUNT(*) FROM payments GROUP BY source").fetchall())
+    return latencies, elapsed, per_source
+
+
+def bench_sources(source_counts, count: int, gap: float):
+    """多窗口模式：多个模拟来源并行扫描，共用入库队列和数据库"""
+    quiet_logger()
+    os.environ['MONITOR_MODE'] = 'event'
+    print(f"{'sources':>7} {'stored':>7} {'min/source':>10} {'per sec':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for sources in source_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_name = os.path.join(tmp, 'bench.db')
+            latencies, elapsed, per_source = asyncio.run(_multi_source_ingest(sources, count, gap, db_name))
+            SQLitePool.get(db_name).close()
+        stored = sum(per_source.values())
+        print(f"{sources:>7} {stored:>7} {min(per_source.values(), default=0):>10} {len(latencies) / elapsed:>8.0f} "
+              f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 99) * 1000:>8.1f}")
+
+
+def _db_worker(operation, connection, count: int):
+    for i in range(count):
+        with connection() as conn:
+            operation(conn, i)
+
+
+def bench_db(count: int, threads: int, rows: int):
+    """对比每次调用新建连接与连接池的查询/写入吞吐"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        PaymentNotifier('', '', db_name=db_name)
+        pool = SQLitePool.get(db_name)
+        with pool.connection() as conn:
+            conn.executemany(
+                "INSERT INTO payments (amount, sender, message, timestamp, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(f"{i % 100}.00", f"用户{i}", f"ORDER{i:08d}", "2024-01-01 00:00:00", "2024-01-01 00:00:00")
+                 for i in range(rows)])
+            conn.commit()
+
+        def select(conn, i):
+            conn.execute("SELECT * FROM payments WHERE id = ?", (i % rows + 1,)).fetchone()
+
+        def update(conn, i):
+            conn.execute("UPDATE payments SET notify_time = ? WHERE id = ?", (str(i), i % rows + 1))
+            conn.commit()
+
+        @contextmanager
+        def connect_per_call():
+            conn = sqlite3.connect(db_name)
+            conn.row_factory = sqlite3.Row
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+        print(f"{'mode':<10} {'op':<8} {'threads':>7} {'ops/s':>10}")
+        for op_name, operation in (('select', select), ('update', update)):
+            for mode, connection in (('connect', connect_per_call), ('pool', pool.connection)):
+                per_thread = count // threads
+                workers = [threading.Thread(target=_db_worker, args=(operation, connection, per_thread))
+                           for _ in range(threads)]
+                start = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+                print(f"{mode:<10} {op_name:<8} {threads:>7} {per_thread * threads / elapsed:>10.0f}")
+        pool.close()
+
+
+async def start_stub_server(latency: float = 0, port: int = 0):
+    """启动本地通知接收桩服务，返回 (runner, url, 已收到的请求计数)"""
+    received = {'count': 0, 'items': 0, 'times': [], 'fail': False}
+
+    async def handle(request):
+        await request.read()
+        received['count'] += 1
+        received['times'].append(time.perf_counter())
+        if latency:
+            await asyncio.sleep(latency)
+        if received['fail']:
+            # 模拟接收端故障
+            return web.Response(status=503)
+        if request.content_type == 'application/json':
+            # 批量通知：逐项确认
+            items = await request.json()
+            received['items'] += len(items)
+            return web.json_response(['success'] * len(items))
+        received['items'] += 1
+        return web.Response(text='success')
+
+    app = web.Application()
+    app.router.add_post('/notify', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}/notify", received
+
+
+def seed_pending_payments(db_name: str, count: int):
+    """写入 count 条待通知的支付记录"""
+    PaymentNotifier('', '', db_name=db_name)
+    with SQLitePool.get(db_name).connection() as conn:
+        conn.executemany(
+            "INSERT INTO payments (amount, sender, message, timestamp, created_at, notify_status, notify_retry_count) "
+            "VALUES (?, ?, ?, ?, ?, 0, 0)",
+            [(f"{i % 100 + 1}.00", f"用户{i}", f"ORDER{i:08d}", "2024-01-01 00:00:00", "2024-01-01 00:00:00")
+             for i in range(count)])
+        conn.execute("INSERT INTO deliveries (payment_id, target) SELECT id, 'default' FROM payments")
+        conn.commit()
+
+
+async def _notify_throughput(db_name: str, count: int, concurrency: int, latency: float, timeout: float,
+                             batch_items: int = 0):
+    runner, url, received = await start_stub_server(latency)
+    notifier = PaymentNotifier(url, 'bench-key', db_name=db_name, concurrency=concurrency)
+    if batch_items:
+        notifier.targets['default'].batch_mode = True
+        notifier.targets['default'].batch_max_items = batch_items
+
+    def delivered() -> int:
+        with notifier.db.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM payments WHERE notify_status = 1").fetchone()[0]
+
+    start = time.perf_counter()
+    loader_task, workers = await notifier.start()
+    done = 0
+    while time.perf_counter() - start < timeout:
+        await asyncio.sleep(0.2)
+        done = await asyncio.to_thread(delivered)
+        if done >= count:
+            break
+    elapsed = time.perf_counter() - start
+    latency_stats = notifier.dispatch_latency_stats()
+    latency_stats.update(notifier.connection_stats())
+    await notifier.stop(loader_task, workers)
+    await runner.cleanup()
+    return done, received['count'], elapsed, latency_stats
+
+
+def bench_notify(count: int, concurrency_levels, latency: float, timeout: float, batch_sizes=(0,)):
+    """待通知记录的投递吞吐（本地桩服务，模拟接收端延迟）；batch 为 0 表示逐条通知"""
+    quiet_logger()
+    print(f"{'batch':>5} {'concurrency':>11} {'delivered':>10} {'requests':>9} {'seconds':>8} {'per sec':>9} "
+          f"{'queue p50 ms':>13} {'queue p99 ms':>13} {'new conns':>10} {'reused':>8} {'connect ms':>11}")
+    for batch_items in batch_sizes:
+        for concurrency in concurrency_levels:
+            with tempfile.TemporaryDirectory() as tmp:
+                db_name = os.path.join(tmp, 'bench.db')
+                seed_pending_payments(db_name, count)
+                done, requests, elapsed, stats = asyncio.run(
+                    _notify_throughput(db_name, count, concurrency, latency, timeout, batch_items))
+                SQLitePool.get(db_name).close()
+            print(f"{batch_items:>5} {concurrency:>11} {done:>10} {requests:>9} {elapsed:>8.2f} {done / elapsed:>9.0f} "
+                  f"{stats['p50']:>13.1f} {stats['p99']:>13.1f} {stats['new_connections']:>10} "
+                  f"{stats['reused_connections']:>8} {stats['avg_connect_ms']:>11.2f}")
+
+
+async def _fresh_notify_latency(db_name: str, count: int, gap: float):
+    runner, url, received = await start_stub_server()
+    notifier = PaymentNotifier(url, 'bench-key', db_name=db_name)
+    loader_task, workers = await notifier.start()
+    await asyncio.sleep(0.2)
+
+    ingested_at = []
+    for i in range(count):
+        info = {'amount': f"{i % 100 + 1}.00", 'sender': f"用户{i}", 'message': f"ORDER{i:08d}",
+                'timestamp': f"2024-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}", 'remark': "收款成功"}
+        ingested_at.append(time.perf_counter())
+        await notifier.process_new_payments([info])
+        await asyncio.sleep(gap)
+    deadline = time.perf_counter() + 5
+    while received['count'] < count and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+    end_to_end = [(done - start) * 1000 for start, done in zip(ingested_at, received['times'])]
+    stats = notifier.dispatch_latency_stats()
+    await notifier.stop(loader_task, workers)
+    await runner.cleanup()
+    return end_to_end, stats
+
+
+def bench_notify_latency(count: int, gap: float):
+    """新支付从入库到通知请求到达接收端的延迟"""
+    quiet_logger()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        end_to_end, stats = asyncio.run(_fresh_notify_latency(db_name, count, gap))
+        SQLitePool.get(db_name).close()
+    print(f"{'stage':<14} {'count':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    print(f"{'queue wait':<14} {stats['count']:>6} {stats['p50']:>8.1f} {stats['p99']:>8.1f}")
+    if end_to_end:
+        print(f"{'ingest -> POST':<14} {len(end_to_end):>6} {percentile(end_to_end, 50):>8.1f} "
+              f"{percentile(end_to_end, 99):>8.1f}")
+
+
+async def _notify_outage(db_name: str, count: int, outage: float, breaker: bool, timeout: float):
+    runner, url, received = await start_stub_server(0.01)
+    received['fail'] = True
+    notifier = PaymentNotifier(url, 'bench-key', db_name=db_name)
+    # 缩短重试间隔和熔断恢复时间，使故障期间覆盖多次重试
+    notifier.retry_intervals = [0] + [1] * notifier.max_retry
+    circuit_breaker = notifier.targets['default'].circuit_breaker
+    circuit_breaker.reset_timeout = 1
+    if not breaker:
+        circuit_breaker.failure_threshold = float('inf')
+
+    def progress():
+        with notifier.db.connection() as conn:
+            return conn.execute("SELECT SUM(notify_status = 1), MAX(notify_retry_count) FROM payments").fetchone()
+
+    start = time.perf_counter()
+    loader_task, workers = await notifier.start()
+    await asyncio.sleep(outage)
+    failed_requests = received['count']
+    received['fail'] = False
+    recovered_at = time.perf_counter()
+    delivered, max_retry = 0, 0
+    while time.perf_counter() - start < timeout:
+        await asyncio.sleep(0.1)
+        delivered, max_retry = await asyncio.to_thread(progress)
+        if delivered >= count:
+            break
+    drain = time.perf_counter() - recovered_at
+    await notifier.stop(loader_task, workers)
+    await runner.cleanup()
+    return failed_requests, max_retry or 0, delivered or 0, drain
+
+
+def bench_notify_outage(count: int, outage: float, timeout: float):
+    """接收端故障期间的请求数、消耗的重试次数，以及恢复后全部送达的耗时（熔断开启 vs 关闭）"""
+    quiet_logger()
+    print(f"{'breaker':<8} {'requests during outage':>23} {'max retries used':>17} {'delivered':>10} {'drain s':>8}")
+    for breaker in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_name = os.path.join(tmp, 'bench.db')
+            seed_pending_payments(db_name, count)
+            failed_requests, max_retry, delivered, drain = asyncio.run(
+                _notify_outage(db_name, count, outage, breaker, timeout))
+            SQLitePool.get(db_name).close()
+        print(f"{'on' if breaker else 'off':<8} {failed_requests:>23} {max_retry:>17} {delivered:>10} {drain:>8.2f}")
+
+
+async def _notify_fanout(db_name: str, count: int, slow_latency: float, timeout: float):
+    fast_runner, fast_url, fast_received = await start_stub_server()
+    slow_runner, slow_url, slow_received = await start_stub_server(slow_latency)
+    notifier = PaymentNotifier('', '', db_name=db_name, targets=[
+        {'name': 'fast', 'url': fast_url, 'key': 'bench-key', 'concurrency': 5},
+        {'name': 'slow', 'url': slow_url, 'key': 'bench-key', 'concurrency': 5},
+    ])
+    loader_task, workers = await notifier.start()
+    await asyncio.sleep(0.2)
+
+    start = time.perf_counter()
+    payments = [{'amount': f"{i % 100 + 1}.00", 'sender': f"用户{i}", 'message': f"ORDER{i:08d}",
+                 'timestamp': f"2024-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}", 'remark': "收款成功"}
+                for i in range(count)]
+    await notifier.process_new_payments(payments)
+    while fast_received['count'] < count and time.perf_counter() - start < timeout:
+        await asyncio.sleep(0.01)
+    fast_elapsed = time.perf_counter() - start
+    slow_done = slow_received['count']
+
+    await notifier.stop(loader_task, workers)
+    await fast_runner.cleanup()
+    await slow_runner.cleanup()
+    return fast_received['count'], fast_elapsed, slow_done
+
+
+def bench_notify_fanout(count: int, slow_latency: float, timeout: float):
+    """多通知目标：慢目标不影响快目标的送达耗时"""
+    quiet_logger()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        fast_done, fast_elapsed, slow_done = asyncio.run(_notify_fanout(db_name, count, slow_latency, timeout))
+        SQLitePool.get(db_name).close()
+    print(f"{'target':<6} {'delivered':>10} {'seconds':>8}")
+    print(f"{'fast':<6} {fast_done:>10} {fast_elapsed:>8.2f}")
+    print(f"{'slow':<6} {slow_done:>10} {'-':>8}  (同一时刻已收到的请求数，响应延迟 {slow_latency}s)")
+
+
+LEGACY_QUERIES = {
+    'check': ("SELECT * FROM payments WHERE timestamp BETWEEN ? AND ? AND message LIKE ?",
+              lambda t: (t['window_start'], t['window_end'], f"%{t['message']}%")),
+    'pending': ("SELECT amount, sender, message, timestamp, remark, notify_retry_count, notify_time FROM payments "
+                "WHERE (notify_status = 0 OR notify_status = 2) AND notify_retry_count < 7 "
+                "AND (next_retry_time IS NULL OR datetime(next_retry_time) <= datetime(?)) "
+                "ORDER BY created_at ASC LIMIT 20",
+                lambda t: (t['now'],)),
+    'list': ("SELECT * FROM payments WHERE 1=1 ORDER BY timestamp DESC LIMIT 20 OFFSET 0", lambda t: ()),
+    'count': ("SELECT COUNT(*) FROM payments WHERE timestamp >= ? AND timestamp <= ? AND sender LIKE ?",
+              lambda t: (t['day_start'], t['day_end'], '%用户1%')),
+}
+
+INDEXED_QUERIES = {
+    'check': ("SELECT * FROM payments WHERE ts_epoch BETWEEN ? AND ? AND message LIKE ?",
+              lambda t: (t['window_start_epoch'], t['window_end_epoch'], f"%{t['message']}%")),
+    'pending': ("SELECT amount, sender, message, timestamp, remark, notify_retry_count, notify_time FROM payments "
+                "WHERE notify_status IN (0, 2) AND next_retry_epoch <= ? AND notify_retry_count < 7 "
+                "ORDER BY next_retry_epoch ASC LIMIT 20",
+                lambda t: (t['now_epoch'],)),
+    'list': ("SELECT * FROM payments WHERE 1=1 ORDER BY ts_epoch DESC, id DESC LIMIT 20 OFFSET 0", lambda t: ()),
+    'count': ("SELECT COUNT(*) FROM payments WHERE ts_epoch >= ? AND ts_epoch <= ? AND sender LIKE ?",
+              lambda t: (t['day_start_epoch'], t['day_end_epoch'], '%用户1%')),
+}
+
+
+def _payment_rows(count: int, base_epoch: int):
+    """生成测试数据：每分钟一笔，约1%待通知"""
+    for i in range(count):
+        epoch = base_epoch + i * 60
+        text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(epoch))
+        status = 0 if i % 100 == 0 else 1
+        yield (f"{i % 100 + 1}.00", f"用户{i % 5000}", f"ORDER{i:08d}", text, text, status,
+               text if status else None, (i % 100 + 1) * 100, epoch, epoch, epoch if status else 0)
+
+
+def build_schema_db(db_name: str, count: int, indexed: bool):
+    """创建旧版表结构或迁移后的表结构并写入 count 条记录"""
+    conn = open_db_connection(db_name)
+    if indexed:
+        migrate_database(conn)
+    else:
+        SCHEMA_MIGRATIONS[0](conn)
+        for column in ('amount_cents', 'ts_epoch', 'created_epoch', 'next_retry_epoch'):
+            conn.execute(f"ALTER TABLE payments ADD COLUMN {column} INTEGER")
+    conn.executemany(
+        "INSERT INTO payments (amount, sender, message, timestamp, created_at, notify_status, next_retry_time, "
+        "amount_cents, ts_epoch, created_epoch, next_retry_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        _payment_rows(count, int(time.time()) - count * 60))
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn
+
+
+def bench_schema(sizes, rounds: int):
+    """旧版表结构与迁移后（整数列 + 索引）的各查询耗时"""
+    quiet_logger()
+    print(f"{'rows':>9} {'query':<8} {'legacy ms':>10} {'indexed ms':>11}")
+    for size in sizes:
+        now_epoch = int(time.time())
+        middle = now_epoch - size * 30
+        fmt = lambda epoch: time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(epoch))
+        params = {
+            'window_start': fmt(middle), 'window_end': fmt(middle + 600),
+            'window_start_epoch': middle, 'window_end_epoch': middle + 600,
+            'message': f"ORDER{size // 2:08d}",
+            'now': fmt(now_epoch), 'now_epoch': now_epoch,
+            'day_start': fmt(middle), 'day_end': fmt(middle + 86400),
+            'day_start_epoch': middle, 'day_end_epoch': middle + 86400,
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            results = {}
+            for indexed, queries in ((False, LEGACY_QUERIES), (True, INDEXED_QUERIES)):
+                conn = build_schema_db(os.path.join(tmp, f"bench-{indexed}.db"), size, indexed)
+                for name, (sql, make_params) in queries.items():
+                    args = make_params(params)
+                    start = time.perf_counter()
+                    for _ in range(rounds):
+                        conn.execute(sql, args).fetchall()
+                    results.setdefault(name, []).append((time.perf_counter() - start) / rounds * 1000)
+                conn.close()
+        for name, (legacy, indexed) in results.items():
+            print(f"{size:>9} {name:<8} {legacy:>10.3f} {indexed:>11.3f}")
+
+
+def bench_tokens(sizes, rounds: int):
+    """留言子串匹配（LIKE）与精确匹配词索引查找的耗时"""
+    quiet_logger()
+    print(f"{'rows':>9} {'window':<7} {'like ms':>9} {'token ms':>9}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = build_schema_db(os.path.join(tmp, 'bench.db'), size, indexed=True)
+            conn.executemany(
+                "INSERT OR IGNORE INTO payment_tokens (token, payment_id) VALUES (?, ?)",
+                ((token, row['id']) for row in conn.execute("SELECT id, message FROM payments").fetchall()
+                 for token in extract_message_tokens(row['message'])))
+            conn.commit()
+            conn.execute("ANALYZE")
+
+            now_epoch = int(time.time())
+            target = size // 2
+            target_epoch = now_epoch - (size - target) * 60
+            message = f"ORDER{target:08d}"
+            for window_name, window in (('10min', 600), ('1day', 86400), ('all', size * 60)):
+                start_epoch = target_epoch - window // 2
+                cases = (
+                    ("SELECT * FROM payments WHERE ts_epoch BETWEEN ? AND ? AND message LIKE ?",
+                     (start_epoch, start_epoch + window, f"%{message}%")),
+                    ("SELECT payments.* FROM payment_tokens JOIN payments ON payments.id = payment_tokens.payment_id "
+                     "WHERE payment_tokens.token = ? AND payments.ts_epoch BETWEEN ? AND ?",
+                     (normalize_token(message), start_epoch, start_epoch + window)),
+                )
+                timings = []
+                for sql, args in cases:
+                    assert conn.execute(sql, args).fetchone() is not None
+                    start = time.perf_counter()
+                    for _ in range(rounds):
+                        conn.execute(sql, args).fetchone()
+                    timings.append((time.perf_counter() - start) / rounds * 1000)
+                print(f"{size:>9} {window_name:<7} {timings[0]:>9.3f} {timings[1]:>9.3f}")
+            conn.close()
+
+
+def bench_orders(sizes, payments: int):
+    """订单登记表：不同待支付订单数下的入库匹配与状态查询耗时"""
+    quiet_logger()
+    print(f"{'open orders':>11} {'create us':>10} {'match us':>9} {'get us':>7} {'matched':>8}")
+    for size in sizes:
+        registry = OrderRegistry(default_ttl=3600, max_open=size + payments)
+        start = time.perf_counter()
+        for i in range(size):
+            registry.create(f"{i % 500 + 1}.00", f"ORDER{i:08d}", order_id=f"o{i}")
+        create_us = (time.perf_counter() - start) / size * 1e6
+
+        paid_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        stream = [{'amount': f"{i % 500 + 1}.00", 'sender': f"用户{i}", 'message': f"订单 ORDER{i:08d} 谢谢",
+                   'timestamp': paid_at, 'remark': "收款成功"}
+                  for i in random.sample(range(size), min(payments, size))]
+        start = time.perf_counter()
+        matched = sum(1 for payment in stream if registry.match(payment) is not None)
+        match_us = (time.perf_counter() - start) / len(stream) * 1e6
+
+        start = time.perf_counter()
+        for i in range(payments):
+            registry.get(f"o{i % size}")
+        get_us = (time.perf_counter() - start) / payments * 1e6
+        print(f"{size:>11} {create_us:>10.2f} {match_us:>9.2f} {get_us:>7.2f} {matched:>8}")
+
+
+def _serve_api(db_name: str, port: int, threads: int):
+    """子进程中运行 API 服务，避免与压测客户端争用 GIL"""
+    quiet_logger()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    os.environ['API_SERVER_THREADS'] = str(threads)
+    api = WeChatPaymentAPI(db_name)
+    api.run('127.0.0.1', port)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _poll_api(base_url: str, concurrency: int, duration: float, list_every: int):
+    """concurrency 个客户端持续轮询支付检查接口，每 list_every 次夹带一次列表查询"""
+    latencies = []
+    errors = 0
+    create_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - 300))
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        deadline = time.perf_counter() + duration
+
+        async def poller(index: int):
+            nonlocal errors
+            sent = 0
+            while time.perf_counter() < deadline:
+                sent += 1
+                if list_every and sent % list_every == 0:
+                    url = f"{base_url}/api/payment/list"
+                    params = {'page': 1, 'page_size': 50}
+                else:
+                    url = f"{base_url}/api/payment/check"
+                    params = {'create_time': create_time, 'message': f"ORDER{index:08d}"}
+                start = time.perf_counter()
+                try:
+                    async with session.get(url, params=params) as response:
+                        await response.read()
+                        if response.status >= 500:
+                            errors += 1
+                            continue
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        await asyncio.gather(*(poller(i) for i in range(concurrency)))
+    return latencies, errors
+
+
+def bench_api_load(concurrency_levels, modes, duration: float, rows: int, list_every: int):
+    """并发轮询下的 API 吞吐与延迟；mode 为请求线程池大小，0 表示每个连接一个线程"""
+    quiet_logger()
+    print(f"{'threads':>7} {'pollers':>8} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        build_schema_db(db_name, rows, indexed=True).close()
+        for threads in modes:
+            port = _free_port()
+            server = multiprocessing.Process(target=_serve_api, args=(db_name, port, threads), daemon=True)
+            server.start()
+            base_url = f"http://127.0.0.1:{port}"
+            for _ in range(100):
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            try:
+                for concurrency in concurrency_levels:
+                    latencies, errors = asyncio.run(_poll_api(base_url, concurrency, duration, list_every))
+                    print(f"{threads:>7} {concurrency:>8} {len(latencies):>9} {errors:>7} "
+                          f"{len(latencies) / duration:>8.0f} {percentile(latencies, 50):>8.1f} "
+                          f"{percentile(latencies, 99):>8.1f}")
+            finally:
+                server.terminate()
+                server.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="微信支付监控基准测试")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scan_parser = subparsers.add_parser('scan', help="消息列表扫描")
+    scan_parser.add_argument('--sizes', default='10,1000,10000', help="列表项数量，逗号分隔")
+    scan_parser.add_argument('--rounds', type=int, default=50, help="每项测试轮数")
+
+    extract_parser = subparsers.add_parser('extract', help="支付信息提取")
+    extract_parser.add_argument('--sizes', default='10,1000,10000', help="列表项数量，逗号分隔")
+    extract_parser.add_argument('--rounds', type=int, default=5, help="每项测试轮数")
+
+    events_parser = subparsers.add_parser('events', help="检测到入库延迟（轮询 vs 事件驱动）")
+    events_parser.add_argument('--count', type=int, default=50, help="模拟的收款消息数量")
+    events_parser.add_argument('--gap', type=float, default=0.2, help="消息平均间隔（秒）")
+    events_parser.add_argument('--check-interval', type=float, default=1, help="轮询模式扫描间隔（秒）")
+
+    db_parser = subparsers.add_parser('db', help="数据库连接：每次新建 vs 连接池")
+    db_parser.add_argument('--count', type=int, default=20000, help="操作次数")
+    db_parser.add_argument('--threads', type=int, default=4, help="并发线程数")
+    db_parser.add_argument('--rows', type=int, default=10000, help="表中预置行数")
+
+    notify_parser = subparsers.add_parser('notify', help="通知投递吞吐（本地桩服务）")
+    notify_parser.add_argument('--count', type=int, default=10000, help="待通知记录数")
+    notify_parser.add_argument('--concurrency', default='10,50,100', help="通知并发数，逗号分隔")
+    notify_parser.add_argument('--latency', type=float, default=0.05, help="桩服务响应延迟（秒）")
+    notify_parser.add_argument('--timeout', type=float, default=120, help="每轮最长运行时间（秒）")
+    notify_parser.add_argument('--batch', default='0', help="批量通知条数，逗号分隔，0 表示逐条通知")
+
+    latency_parser = subparsers.add_parser('notify-latency', help="新支付通知延迟（入库到接收端）")
+    latency_parser.add_argument('--count', type=int, default=50, help="模拟的新支付数量")
+    latency_parser.add_argument('--gap', type=float, default=0.1, help="新支付间隔（秒）")
+
+    outage_parser = subparsers.add_parser('notify-outage', help="接收端故障期间的通知行为（熔断开启 vs 关闭）")
+    outage_parser.add_argument('--count', type=int, default=200, help="待通知记录数")
+    outage_parser.add_argument('--outage', type=float, default=5, help="接收端故障持续时间（秒）")
+    outage_parser.add_argument('--timeout', type=float, default=60, help="恢复后最长等待时间（秒）")
+
+    fanout_parser = subparsers.add_parser('notify-fanout', help="多通知目标：慢目标对快目标的影响")
+    fanout_parser.add_argument('--count', type=int, default=200, help="新支付数量")
+    fanout_parser.add_argument('--slow-latency', type=float, default=2, help="慢目标响应延迟（秒）")
+    fanout_parser.add_argument('--timeout', type=float, default=30, help="最长等待时间（秒）")
+
+    schema_parser = subparsers.add_parser('schema', help="表结构与索引：旧版 vs 迁移后")
+    schema_parser.add_argument('--sizes', default='10000,100000,1000000', help="表行数，逗号分隔")
+    schema_parser.add_argument('--rounds', type=int, default=20, help="每个查询执行次数")
+
+    tokens_parser = subparsers.add_parser('tokens', help="留言查找：LIKE vs 精确匹配词索引")
+    tokens_parser.add_argument('--sizes', default='100000,1000000', help="表行数，逗号分隔")
+    tokens_parser.add_argument('--rounds', type=int, default=50, help="每个查询执行次数")
+
+    pipeline_parser = subparsers.add_parser('pipeline', help="扫描流水线：提取、扫描和入库（录制/回放控件树）")
+    pipeline_parser.add_argument('--sizes', default='10,1000,10000', help="列表项数量，逗号分隔")
+    pipeline_parser.add_argument('--rounds', type=int, default=3, help="每个阶段的测量轮数")
+    pipeline_parser.add_argument('--latency', type=float, default=0, help="每次控件接口调用的模拟耗时（微秒）")
+    pipeline_parser.add_argument('--replay', help="回放 python main.py record-list 录制的文件（忽略 --sizes）")
+    pipeline_parser.add_argument('--json', help="结果另存为JSON文件，便于CI比较")
+
+    sources_parser = subparsers.add_parser('sources', help="多窗口模式：并行扫描多个模拟来源")
+    sources_parser.add_argument('--sources', default='1,4,16', help="来源（窗口）数量，逗号分隔")
+    sources_parser.add_argument('--count', type=int, default=100, help="每个来源的新支付数量")
+    sources_parser.add_argument('--gap', type=float, default=0.02, help="新支付平均间隔（秒）")
+
+    orders_parser = subparsers.add_parser('orders', help="订单登记表：入库匹配与状态查询")
+    orders_parser.add_argument('--sizes', default='1000,10000,100000', help="待支付订单数，逗号分隔")
+    orders_parser.add_argument('--payments', type=int, default=10000, help="模拟的新支付数量")
+
+    api_parser = subparsers.add_parser('api-load', help="API 并发轮询：每连接一个线程 vs 固定线程池")
+    api_parser.add_argument('--concurrency', default='50,200,1000', help="并发轮询客户端数，逗号分隔")
+    api_parser.add_argument('--threads', default='0,32', help="请求线程池大小，逗号分隔，0 表示每个连接一个线程")
+    api_parser.add_argument('--duration', type=float, default=10, help="每轮压测时长（秒）")
+    api_parser.add_argument('--rows', type=int, default=100000, help="表中预置行数")
+    api_parser.add_argument('--list-every', type=int, default=20, help="每 N 次请求夹带一次列表查询，0 表示不夹带")
+
+    args = parser.parse_args()
+    if args.command == 'scan':
+        bench_scan([int(size) for size in args.sizes.split(',')], args.rounds)
+    elif args.command == 'extract':
+        bench_extract([int(size) for size in args.sizes.split(',')], args.rounds)
+    elif args.command == 'events':
+        bench_events(args.count, args.gap, args.check_interval)
+    elif args.command == 'db':
+        bench_db(args.count, args.threads, args.rows)
+    elif args.command == 'schema':
+        bench_schema([int(size) for size in args.sizes.split(',')], args.rounds)
+    elif args.command == 'tokens':
+        bench_tokens([int(size) for size in args.sizes.split(',')], args.rounds)
+    elif args.command == 'notify':
+        bench_notify(args.count, [int(c) for c in args.concurrency.split(',')], args.latency, args.timeout,
+                     [int(size) for size in args.batch.split(',')])
+    elif args.command == 'notify-outage':
+        bench_notify_outage(args.count, args.outage, args.timeout)
+    elif args.command == 'notify-fanout':
+        bench_notify_fanout(args.count, args.slow_latency, args.timeout)
+    elif args.command == 'notify-latency':
+        bench_notify_latency(args.count, args.gap)
+    elif args.command == 'pipeline':
+        bench_pipeline([int(size) for size in args.sizes.split(',')], args.rounds, args.latency / 1e6,
+                       args.replay, args.json)
+    elif args.command == 'sources':
+        bench_sources([int(count) for count in args.sources.split(',')], args.count, args.gap)
+    elif args.command == 'orders':
+        bench_orders([int(size) for size in args.sizes.split(',')], args.payments)
+    elif args.command == 'api-load':
+        bench_api_load([int(c) for c in args.concurrency.split(',')], [int(t) for t in args.threads.split(',')],
+                       args.duration, args.rows, args.list_every)
+
+
+if __name__ == '__main__':
+    main()
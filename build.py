@@ -23,7 +23,6 @@ def build_exe():
         'win32api',
         'win32con',
         'win32gui',
-        'psutil',
         'aiohttp',
         'asyncio',
         'loguru',
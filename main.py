@@ -1,25 +1,45 @@
-import uiautomation as automation
+from __future__ import annotations
+
+import argparse
+import csv
+import gzip
+import io
 import json
 import os
+import re
 import time
 import sqlite3
-import win32api
-import win32con
-import win32gui
 import hashlib
 import aiohttp
 import asyncio
 import signal
 import sys
-from typing import Dict, List, Optional, Tuple
+import heapq
+import itertools
+import threading
+import queue
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
 from urllib.parse import urlencode, urlparse
 from loguru import logger
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import psutil
 from dotenv import load_dotenv
 
+try:
+    import uiautomation as automation
+    import win32api
+    import win32con
+    import win32gui
+except ImportError:
+    # 非Windows环境（如使用内存控件树做测试/基准）下不可用
+    automation = win32api = win32con = win32gui = None
+
 def get_application_path():
     """获取应用程序路径"""
     if getattr(sys, 'frozen', False):
@@ -40,19 +60,1350 @@ if os.path.exists(env_path):
 else:
     logger.warning(f"未找到环境变量配置文件: {env_path}")
 
+def resolve_db_path(db_name: str = None) -> str:
+    """获取数据库文件的绝对路径（相对路径基于应用程序目录）"""
+    db_name = db_name or os.getenv('DB_NAME', 'wxpayments.db')
+    if not os.path.isabs(db_name):
+        db_name = os.path.join(get_application_path(), db_name)
+    return db_name
+
+
+def open_db_connection(db_name: str, busy_timeout: float = 5, cached_statements: int = 256,
+                       isolation_level: Optional[str] = '') -> sqlite3.Connection:
+    """打开数据库连接：WAL、synchronous=NORMAL、忙等待超时，可跨线程使用"""
+    conn = sqlite3.connect(
+        db_name,
+        timeout=busy_timeout,
+        check_same_thread=False,
+        cached_statements=cached_statements,
+        isolation_level=isolation_level
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={int(busy_timeout * 1000)}')
+    return conn
+
+
+# 单窗口模式下支付记录的来源标识
+DEFAULT_SOURCE = 'default'
+
+# 留言分词的分隔符（空白和常见中英文标点，保留 - 和 _ 以免拆开订单号）
+_TOKEN_SEPARATORS = re.compile(r'[\s,，。.!！?？:：;；、/\\|()（）\[\]【】<>《》"\'“”‘’#@&*+=~`^$%]+')
+_ASCII_TOKEN = re.compile(r'[0-9a-z_-]{2,}')
+
+
+def normalize_token(text: str) -> str:
+    """规范化留言/订单号：去除首尾空白并统一大小写"""
+    return (text or '').strip().casefold()
+
+
+def extract_message_tokens(message: str) -> set:
+    """提取留言中的精确匹配词：完整留言、按标点/空白切分的片段，以及中英混排中的字母数字串"""
+    normalized = normalize_token(message)
+    if not normalized:
+        return set()
+    tokens = {token for token in _TOKEN_SEPARATORS.split(normalized) if token}
+    tokens.update(_ASCII_TOKEN.findall(normalized))
+    tokens.add(normalized)
+    return tokens
+
+
+def payment_key(payment_data: Dict[str, str]) -> Tuple[str, str, str, str]:
+    """支付记录去重键，与 payments 表的唯一约束一致"""
+    return (payment_data.get('source') or DEFAULT_SOURCE, payment_data['amount'], payment_data['sender'],
+            payment_data['timestamp'])
+
+
+def parse_amount_cents(amount: str) -> Optional[int]:
+    """金额文本转换为整数分，无法解析时返回 None"""
+    try:
+        return int((Decimal(str(amount).replace('￥', '').replace(',', '').strip()) * 100).to_integral_value())
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def parse_timestamp_epoch(timestamp: str) -> Optional[int]:
+    """本地时间文本（%Y-%m-%d %H:%M:%S）转换为时间戳，无法解析时返回 None"""
+    try:
+        return int(datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """单调递增计数器"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge:
+    """当前值，也可以注册在输出时计算取值的函数"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Tuple, float] = {}
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def set_function(self, function):
+        """function() 返回 [(标签字典, 取值)]，输出时调用"""
+        self._function = function
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        if self._function is not None:
+            try:
+                for labels, value in self._function():
+                    values[tuple(sorted(labels.items()))] = value
+            except Exception as e:
+                logger.error(f"计算指标 {self.name} 时出错: {str(e)}")
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """分桶直方图（累计桶计数、总和与次数）"""
+
+    type_name = 'histogram'
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # {标签: [各桶计数, 总和, 次数]}
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """统计代码块耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，按 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000)
+
+SCAN_SECONDS = METRICS.histogram('wechatpay_scan_seconds', '消息列表扫描与提取耗时（秒）')
+SCAN_ITEMS = METRICS.histogram('wechatpay_scan_items_walked', '每次扫描遍历的列表项数', _COUNT_BUCKETS)
+SCAN_COM_CALLS = METRICS.histogram('wechatpay_scan_com_calls', '每次扫描的控件接口调用次数', _COUNT_BUCKETS)
+EXTRACT_FAILURES = METRICS.counter('wechatpay_extract_failures_total', '列表项支付信息提取失败次数')
+INGEST_SECONDS = METRICS.histogram('wechatpay_ingest_seconds', '一批支付记录入库耗时（秒）')
+PAYMENTS_INGESTED = METRICS.counter('wechatpay_payments_ingested_total', '入库的支付记录数（result=new/duplicate）')
+QUEUE_DEPTH = METRICS.gauge('wechatpay_queue_depth', '队列长度（ingest 入库队列、notify 通知队列、scheduled 等待重试）')
+NOTIFY_SECONDS = METRICS.histogram('wechatpay_notify_seconds', '通知请求耗时（秒），按目标和结果区分')
+NOTIFY_ATTEMPTS = METRICS.counter('wechatpay_notify_attempts_total', '通知请求次数，按第几次尝试区分（attempt>1 为重试）')
+API_SECONDS = METRICS.histogram('wechatpay_api_request_seconds', 'API请求耗时（秒），按路由区分')
+ORDERS_TOTAL = METRICS.counter('wechatpay_orders_total', '订单数，按结果区分（created/paid/expired/cancelled）')
+SQLITE_SECONDS = METRICS.histogram(
+    'wechatpay_sqlite_seconds',
+    'SQLite操作耗时（秒）：executor_read/executor_write 为执行器任务，executor_commit 为批量提交，pool 为连接池连接占用'
+)
+
+class ServiceHealth:
+    """服务健康快照
+
+    各组件在状态变化时写入（扫描完成、窗口检查、通知送达），查询时返回预先生成的快照，
+    不遍历系统进程也不访问数据库。快照在状态变化后或超过 refresh 秒时重新生成。
+    扫描和窗口状态按来源（微信窗口）分别记录。存活（live）要求每个来源的扫描循环仍在推进；
+    就绪（ready）还要求各来源窗口可用、最近扫描成功且队列没有积压。
+    """
+
+    def __init__(self, stall_seconds: float = None, scan_max_age: float = None, queue_max: int = None,
+                 refresh: float = 1.0):
+        self.stall_seconds = stall_seconds or float(os.getenv('HEALTH_STALL_SECONDS', '120'))
+        self.scan_max_age = scan_max_age or float(os.getenv('HEALTH_SCAN_MAX_AGE', '90'))
+        self.queue_max = queue_max or int(os.getenv('HEALTH_QUEUE_MAX', '1000'))
+        self.refresh = refresh
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._sources: Dict[str, Dict] = {}
+        self._last_delivery_at: Dict[str, float] = {}
+        self._queue_source = None
+        self._snapshot = None
+        self._snapshot_at = 0.0
+
+    def _source(self, source: str) -> Dict:
+        """来源的状态记录（需持有锁）"""
+        state = self._sources.get(source)
+        if state is None:
+            state = self._sources[source] = {
+                'last_scan_at': None, 'last_scan_seconds': None, 'last_scan_items': None,
+                'last_error': None, 'last_error_at': None,
+                'windows_ok': None, 'windows_error': None, 'windows_checked_at': None
+            }
+        return state
+
+    def set_queue_source(self, function):
+        """function() 返回 [(标签字典, 队列长度)]，生成快照时调用"""
+        self._queue_source = function
+
+    def record_scan(self, seconds: float, items: int, source: str = DEFAULT_SOURCE):
+        """记录一次成功的扫描"""
+        with self._lock:
+            state = self._source(source)
+            state['last_scan_at'] = time.time()
+            state['last_scan_seconds'] = seconds
+            state['last_scan_items'] = items
+            self._snapshot = None
+
+    def record_scan_error(self, error: str, source: str = DEFAULT_SOURCE):
+        """记录一次失败的扫描"""
+        with self._lock:
+            state = self._source(source)
+            state['last_error'] = error
+            state['last_error_at'] = time.time()
+            self._snapshot = None
+
+    def record_windows(self, ok: bool, error: str = None, source: str = DEFAULT_SOURCE):
+        """记录窗口与支付列表检查结果"""
+        with self._lock:
+            state = self._source(source)
+            state['windows_ok'] = ok
+            state['windows_error'] = error
+            state['windows_checked_at'] = time.time()
+            self._snapshot = None
+
+    def record_delivery(self, target: str):
+        """记录通知目标的一次成功送达"""
+        with self._lock:
+            self._last_delivery_at[target] = time.time()
+            self._snapshot = None
+
+    def snapshot(self) -> Dict:
+        """当前健康快照"""
+        now = time.time()
+        with self._lock:
+            if self._snapshot is None or now - self._snapshot_at >= self.refresh:
+                self._snapshot = self._build(now)
+                self._snapshot_at = now
+            return self._snapshot
+
+    def _build(self, now: float) -> Dict:
+        fmt = lambda epoch: datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S') if epoch else None
+        age = lambda epoch: round(now - epoch, 3) if epoch else None
+
+        queues = []
+        if self._queue_source is not None:
+            try:
+                queues = [dict(labels, depth=depth) for labels, depth in self._queue_source()]
+            except Exception as e:
+                logger.error(f"读取队列长度时出错: {str(e)}")
+
+        reasons = []
+        sources = {}
+        # 扫描循环的心跳：最近一次扫描（无论成败），尚未扫描时从启动时间算起；取推进最慢的来源
+        heartbeat = None
+        for name, state in sorted(self._sources.items()):
+            beat = max(filter(None, (state['last_scan_at'], state['last_error_at'])), default=self.started_at)
+            heartbeat = beat if heartbeat is None else min(heartbeat, beat)
+            suffix = '' if name == DEFAULT_SOURCE else f':{name}'
+            if now - beat > self.stall_seconds:
+                reasons.append(f'scan_stalled{suffix}')
+            if not state['windows_ok']:
+                reasons.append(f'windows_unavailable{suffix}')
+            if state['last_scan_at'] is None or now - state['last_scan_at'] > self.scan_max_age:
+                reasons.append(f'scan_stale{suffix}')
+            sources[name] = {
+                'scan': {
+                    'last_success': fmt(state['last_scan_at']),
+                    'age': age(state['last_scan_at']),
+                    'duration': state['last_scan_seconds'],
+                    'items_walked': state['last_scan_items'],
+                    'last_error': state['last_error'],
+                    'last_error_at': fmt(state['last_error_at'])
+                },
+                'windows': {
+                    'ok': state['windows_ok'],
+                    'error': state['windows_error'],
+                    'checked_at': fmt(state['windows_checked_at'])
+                }
+            }
+        if heartbeat is None:
+            # 尚未有来源完成窗口检查或扫描
+            heartbeat = self.started_at
+            reasons.extend(['windows_unavailable', 'scan_stale'])
+        live = now - heartbeat <= self.stall_seconds
+        if not live and not any(reason.startswith('scan_stalled') for reason in reasons):
+            reasons.append('scan_stalled')
+        for queue_info in queues:
+            if queue_info['queue'] != 'scheduled' and queue_info['depth'] >= self.queue_max:
+                name = queue_info['queue'] + (f":{queue_info['target']}" if queue_info['target'] else '')
+                reasons.append(f'queue_backlog:{name}')
+
+        return {
+            'live': live,
+            'ready': not reasons,
+            'reasons': reasons,
+            'uptime': round(now - self.started_at, 3),
+            'heartbeat_age': age(heartbeat),
+            'sources': sources,
+            'notify': {
+                'queues': queues,
+                'last_delivery': {target: fmt(epoch) for target, epoch in self._last_delivery_at.items()}
+            }
+        }
+
+
+HEALTH = ServiceHealth()
+
+
+# 端到端追踪的阶段（按发生顺序）：界面检测到、入库、通知出队、发出请求、收到确认
+TRACE_STAGES = ('detected', 'stored', 'dequeued', 'sent', 'acked')
+# 报告中的区间：名称 -> (起始阶段, 结束阶段)
+TRACE_SEGMENTS = {
+    'store': ('detected', 'stored'),
+    'queue': ('stored', 'dequeued'),
+    'dispatch': ('dequeued', 'sent'),
+    'webhook': ('sent', 'acked'),
+    'total': ('detected', 'acked'),
+}
+
+
+def encode_trace(trace: Optional[Dict[str, float]]) -> Optional[str]:
+    """压缩追踪时间戳：检测时间（毫秒时间戳）后跟各阶段相对检测时间的毫秒数，缺失的阶段留空
+
+    例如 "1729245600123,3,4,4,15"；没有检测时间时返回 None。
+    """
+    if not trace or 'detected' not in trace:
+        return None
+    base = trace['detected']
+    fields = [str(int(base * 1000))]
+    for stage in TRACE_STAGES[1:]:
+        fields.append(str(round((trace[stage] - base) * 1000)) if stage in trace else '')
+    return ','.join(fields)
+
+
+def decode_trace(text: str) -> Dict[str, float]:
+    """还原 encode_trace 的结果为 {阶段: 时间戳（秒）}"""
+    fields = text.split(',')
+    base = int(fields[0]) / 1000
+    trace = {'detected': base}
+    for stage, field in zip(TRACE_STAGES[1:], fields[1:]):
+        if field:
+            trace[stage] = base + int(field) / 1000
+    return trace
+
+
+def summarize_traces(traces: Iterable[str]) -> Dict[str, Dict[str, float]]:
+    """按区间统计追踪耗时的分位数（毫秒）"""
+    samples = {name: [] for name in TRACE_SEGMENTS}
+    for text in traces:
+        try:
+            trace = decode_trace(text)
+        except (ValueError, IndexError):
+            continue
+        for name, (start, end) in TRACE_SEGMENTS.items():
+            if start in trace and end in trace:
+                samples[name].append((trace[end] - trace[start]) * 1000)
+
+    def pick(values: List[float], pct: float) -> float:
+        return values[min(len(values) - 1, max(0, int(len(values) * pct / 100 + 0.5) - 1))]
+
+    report = {}
+    for name, values in samples.items():
+        values.sort()
+        report[name] = {
+            'count': len(values),
+            'p50': pick(values, 50) if values else 0.0,
+            'p90': pick(values, 90) if values else 0.0,
+            'p99': pick(values, 99) if values else 0.0,
+            'max': values[-1] if values else 0.0,
+        }
+    return report
+
+
+def load_trace_report(conn: sqlite3.Connection, since_epoch: int, target: str = None) -> Dict[str, Dict[str, float]]:
+    """统计 since_epoch 之后入库的投递记录的端到端耗时"""
+    query = 'SELECT trace FROM deliveries WHERE created_epoch >= ? AND trace IS NOT NULL'
+    params = [since_epoch]
+    if target:
+        query += ' AND target = ?'
+        params.append(target)
+    return summarize_traces(row[0] for row in conn.execute(query, params))
+
+
+
+def _migrate_v1(conn: sqlite3.Connection):
+    """初始表结构"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        amount TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        message TEXT,
+        timestamp TEXT NOT NULL,
+        remark TEXT,
+        created_at TEXT NOT NULL,
+        notify_status INTEGER DEFAULT 0,
+        notify_retry_count INTEGER DEFAULT 0,
+        notify_url TEXT,
+        notify_response TEXT,
+        notify_time TEXT,
+        next_retry_time TEXT,
+        UNIQUE(amount, sender, timestamp)
+    )
+    ''')
+
+
+def _migrate_v2(conn: sqlite3.Connection):
+    """整数金额（分）、时间戳列及查询索引"""
+    conn.execute('ALTER TABLE payments ADD COLUMN amount_cents INTEGER')
+    conn.execute('ALTER TABLE payments ADD COLUMN ts_epoch INTEGER')
+    conn.execute('ALTER TABLE payments ADD COLUMN created_epoch INTEGER')
+    conn.execute('ALTER TABLE payments ADD COLUMN next_retry_epoch INTEGER')
+
+    conn.execute('''
+    UPDATE payments SET
+        amount_cents = CAST(ROUND(CAST(REPLACE(amount, ',', '') AS REAL) * 100) AS INTEGER),
+        ts_epoch = CAST(strftime('%s', timestamp, 'utc') AS INTEGER),
+        created_epoch = CAST(strftime('%s', created_at, 'utc') AS INTEGER),
+        next_retry_epoch = COALESCE(CAST(strftime('%s', next_retry_time, 'utc') AS INTEGER), 0)
+    ''')
+
+    # 按到账时间查询/排序，附带付款人和留言以便在索引中完成过滤和计数
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_ts ON payments(ts_epoch, sender, message)')
+    # 待通知记录（部分索引，只包含未通知和通知失败的记录）
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments(next_retry_epoch)
+    WHERE notify_status IN (0, 2)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_created ON payments(created_epoch)')
+
+
+def _migrate_v3(conn: sqlite3.Connection):
+    """按 (到账时间, id) 游标分页的索引"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_ts_id ON payments(ts_epoch, id)')
+
+
+def _migrate_v4(conn: sqlite3.Connection):
+    """留言精确匹配词索引表，并为已有记录补齐"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS payment_tokens (
+        token TEXT NOT NULL,
+        payment_id INTEGER NOT NULL,
+        PRIMARY KEY (token, payment_id)
+    ) WITHOUT ROWID
+    ''')
+    rows = conn.execute('SELECT id, message FROM payments WHERE message IS NOT NULL AND message != \'\'')
+    conn.executemany(
+        'INSERT OR IGNORE INTO payment_tokens (token, payment_id) VALUES (?, ?)',
+        ((token, row['id']) for row in rows for token in extract_message_tokens(row['message']))
+    )
+
+
+def _migrate_v5(conn: sqlite3.Connection):
+    """通知投递表：每条支付对每个通知目标一行，旧版的通知状态迁移为 default 目标"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS deliveries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        payment_id INTEGER NOT NULL,
+        target TEXT NOT NULL,
+        status INTEGER DEFAULT 0,
+        retry_count INTEGER DEFAULT 0,
+        next_retry_epoch INTEGER DEFAULT 0,
+        response TEXT,
+        notify_time TEXT,
+        created_epoch INTEGER,
+        UNIQUE(payment_id, target)
+    )
+    ''')
+    # 按目标加载待通知记录（部分索引，只包含未通知和通知失败的记录）
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_deliveries_pending ON deliveries(target, next_retry_epoch)
+    WHERE status IN (0, 2)
+    ''')
+    conn.execute('''
+    INSERT OR IGNORE INTO deliveries (
+        payment_id, target, status, retry_count, next_retry_epoch, response, notify_time, created_epoch
+    )
+    SELECT id, 'default', notify_status, notify_retry_count, next_retry_epoch, notify_response, notify_time, created_epoch
+    FROM payments
+    ''')
+
+
+def _migrate_v6(conn: sqlite3.Connection):
+    """投递记录的端到端追踪时间（压缩格式见 encode_trace）"""
+    conn.execute('ALTER TABLE deliveries ADD COLUMN trace TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_deliveries_created ON deliveries(created_epoch)')
+
+
+def _migrate_v7(conn: sqlite3.Connection):
+    """支付记录来源（微信窗口/账号），去重键加入来源
+
+    SQLite 无法修改表级唯一约束，按新结构重建 payments 表并保留原 id，投递记录和匹配词索引无需改动。
+    """
+    conn.execute('''
+    CREATE TABLE payments_v7 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        amount TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        message TEXT,
+        timestamp TEXT NOT NULL,
+        remark TEXT,
+        created_at TEXT NOT NULL,
+        notify_status INTEGER DEFAULT 0,
+        notify_retry_count INTEGER DEFAULT 0,
+        notify_url TEXT,
+        notify_response TEXT,
+        notify_time TEXT,
+        next_retry_time TEXT,
+        amount_cents INTEGER,
+        ts_epoch INTEGER,
+        created_epoch INTEGER,
+        next_retry_epoch INTEGER,
+        source TEXT NOT NULL DEFAULT 'default',
+        UNIQUE(source, amount, sender, timestamp)
+    )
+    ''')
+    columns = ('id, amount, sender, message, timestamp, remark, created_at, notify_status, notify_retry_count, '
+               'notify_url, notify_response, notify_time, next_retry_time, amount_cents, ts_epoch, created_epoch, '
+               'next_retry_epoch')
+    conn.execute(f'INSERT INTO payments_v7 ({columns}) SELECT {columns} FROM payments')
+    conn.execute('DROP TABLE payments')
+    conn.execute('ALTER TABLE payments_v7 RENAME TO payments')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_ts ON payments(ts_epoch, sender, message)')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments(next_retry_epoch)
+    WHERE notify_status IN (0, 2)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_created ON payments(created_epoch)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_ts_id ON payments(ts_epoch, id)')
+
+
+# 数据库结构迁移，按顺序执行，当前版本记录在 PRAGMA user_version
+SCHEMA_MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+]
+
+
+def migrate_database(conn: sqlite3.Connection):
+    """执行未完成的数据库结构迁移，每个版本在单独的事务中完成"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target, migrate in enumerate(SCHEMA_MIGRATIONS, 1):
+        if version >= target:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            migrate(conn)
+            conn.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"数据库结构已升级到版本 {target}")
+
+
+class SQLitePool:
+    """SQLite连接池
+
+    连接长期复用并可跨线程使用，开启 WAL、synchronous=NORMAL 和忙等待超时，
+    每个连接缓存预编译语句。同一数据库文件在进程内共享一个连接池（见 SQLitePool.get）。
+    """
+
+    _pools: Dict[str, 'SQLitePool'] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, db_name: str, size: int = None, busy_timeout: float = None, cached_statements: int = 256):
+        self.db_name = db_name
+        self.size = size or int(os.getenv('DB_POOL_SIZE', '5'))
+        self.busy_timeout = busy_timeout if busy_timeout is not None else float(os.getenv('DB_BUSY_TIMEOUT', '5'))
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, db_name: str) -> 'SQLitePool':
+        """获取数据库文件对应的共享连接池"""
+        db_name = resolve_db_path(db_name)
+        with cls._pools_lock:
+            pool = cls._pools.get(db_name)
+            if pool is None:
+                pool = cls._pools[db_name] = cls(db_name)
+            return pool
+
+    def _connect(self) -> sqlite3.Connection:
+        return open_db_connection(self.db_name, self.busy_timeout, self.cached_statements)
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=self.busy_timeout)
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接，退出时归还；未提交的事务会被回滚"""
+        conn = self._acquire()
+        started = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            finally:
+                self._idle.put(conn)
+                SQLITE_SECONDS.observe(time.perf_counter() - started, op='pool')
+
+    def close(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class DatabaseExecutor:
+    """单写线程数据库执行器
+
+    后台线程独占一个连接，按提交顺序执行数据库操作，协程通过 write()/read() 等待结果，
+    不在事件循环中做阻塞的数据库I/O。batch_window 内到达的写操作合并到同一个事务提交，
+    每个操作使用独立的保存点，单个操作失败不影响同批的其他操作。
+    操作函数的签名为 func(conn, *args)，不需要也不应自行提交。
+    """
+
+    def __init__(self, db_name: str, batch_window: float = None, max_batch: int = 500):
+        self.db_name = db_name
+        self.batch_window = batch_window if batch_window is not None else float(os.getenv('DB_BATCH_WINDOW_MS', '5')) / 1000
+        self.max_batch = max_batch
+        self._requests = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动执行线程"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-executor', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """处理完已提交的操作后停止执行线程"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread:
+            self._requests.put(None)
+            thread.join(timeout)
+
+    def _submit(self, write: bool, func, args, flush: bool = False) -> asyncio.Future:
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._requests.put((write, func, args, loop, future, flush))
+        return future
+
+    async def write(self, func, *args):
+        """执行写操作（与同一时间窗口内的其他写操作合并提交）"""
+        return await self._submit(True, func, args)
+
+    async def write_now(self, func, *args):
+        """执行写操作并立即提交（不等待批量窗口，只合并已在排队的写操作），用于延迟敏感的写入"""
+        return await self._submit(True, func, args, flush=True)
+
+    async def read(self, func, *args):
+        """执行读操作"""
+        return await self._submit(False, func, args)
+
+    def _collect_batch(self, first) -> Tuple[list, bool]:
+        """收集时间窗口内到达的后续操作，返回 (批次, 是否收到停止信号)"""
+        batch = [first]
+        if not first[0]:
+            return batch, False
+        deadline = time.monotonic() + (0 if first[5] else self.batch_window)
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._requests.get(timeout=remaining) if remaining > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    @staticmethod
+    def _resolve(loop, future, result=None, error: Exception = None):
+        def callback():
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        try:
+            loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _execute_batch(self, conn: sqlite3.Connection, batch: list):
+        outcomes = []
+        try:
+            conn.execute('BEGIN')
+            for write, func, args, loop, future, _ in batch:
+                conn.execute('SAVEPOINT job')
+                started = time.perf_counter()
+                try:
+                    outcomes.append((loop, future, func(conn, *args), None))
+                    conn.execute('RELEASE job')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    outcomes.append((loop, future, None, e))
+                SQLITE_SECONDS.observe(time.perf_counter() - started, op='executor_write' if write else 'executor_read')
+            with SQLITE_SECONDS.time(op='executor_commit'):
+                conn.execute('COMMIT')
+        except Exception as e:
+            logger.error(f"数据库批量提交失败: {str(e)}")
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            outcomes = [(loop, future, None, e) for _, _, _, loop, future, _ in batch]
+
+        for loop, future, result, error in outcomes:
+            self._resolve(loop, future, result, error)
+
+    def _run(self):
+        conn = open_db_connection(self.db_name, isolation_level=None)
+        try:
+            stopping = False
+            while not stopping:
+                job = self._requests.get()
+                if job is None:
+                    break
+                batch, stopping = self._collect_batch(job)
+                self._execute_batch(conn, batch)
+        finally:
+            conn.close()
+
+
+class PaymentWaiter:
+    """等待支付结果的长轮询请求"""
+
+    def __init__(self, start_time: str, end_time: str, message: str = None, wechat_id: str = None,
+                 match: str = 'like'):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.message = message
+        self.wechat_id = wechat_id
+        self.match = match
+        self.event = threading.Event()
+        self.payment = None
+
+    @property
+    def index_key(self) -> Optional[Tuple[str, str]]:
+        """在等待者索引中的键"""
+        if self.message:
+            if self.match == 'token':
+                return 'token', normalize_token(self.message)
+            return 'message', self.message
+        if self.wechat_id:
+            return 'sender', self.wechat_id
+        return None
+
+    def matches(self, payment_data: Dict[str, str]) -> bool:
+        """判断支付记录是否满足等待条件（与 check_payment 的查询条件一致）"""
+        if not self.start_time <= payment_data['timestamp'] <= self.end_time:
+            return False
+        if self.message:
+            message = payment_data.get('message') or ''
+            if self.match == 'token':
+                if normalize_token(self.message) not in extract_message_tokens(message):
+                    return False
+            elif self.message not in message:
+                return False
+        if self.wechat_id and self.wechat_id not in payment_data['sender']:
+            return False
+        return True
+
+
+class PaymentWaiters:
+    """按留言词/留言/付款人索引的等待者集合，新支付入库时只唤醒匹配的等待者
+
+    所有等待者都按精确键索引：留言词等待者的键为规范化的匹配词；子串匹配的留言和付款人等待者
+    以原文为键，新支付入库时枚举其留言/付款人中不超过最长键长度的子串逐个查找，
+    耗时只与留言长度有关，与等待者数量无关。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict[str, set]] = {'token': {}, 'message': {}, 'sender': {}}
+        # 子串索引中各长度的键数量，最长键的长度决定入库时需要枚举的子串长度
+        self._key_lengths: Dict[str, Dict[int, int]] = {'message': {}, 'sender': {}}
+        self._unfiltered = set()
+
+    def register(self, start_time: datetime, end_time: datetime,
+                 message: str = None, wechat_id: str = None, match: str = 'like') -> PaymentWaiter:
+        """注册等待者"""
+        waiter = PaymentWaiter(
+            start_time.strftime('%Y-%m-%d %H:%M:%S'),
+            end_time.strftime('%Y-%m-%d %H:%M:%S'),
+            message,
+            wechat_id,
+            match
+        )
+        key = waiter.index_key
+        with self._lock:
+            if key is None:
+                self._unfiltered.add(waiter)
+            else:
+                index = self._index[key[0]]
+                if key[1] not in index and key[0] in self._key_lengths:
+                    lengths = self._key_lengths[key[0]]
+                    lengths[len(key[1])] = lengths.get(len(key[1]), 0) + 1
+                index.setdefault(key[1], set()).add(waiter)
+        return waiter
+
+    def unregister(self, waiter: PaymentWaiter):
+        """移除等待者"""
+        key = waiter.index_key
+        with self._lock:
+            if key is None:
+                self._unfiltered.discard(waiter)
+                return
+            index = self._index[key[0]]
+            bucket = index.get(key[1])
+            if bucket is not None:
+                bucket.discard(waiter)
+                if not bucket:
+                    del index[key[1]]
+                    if key[0] in self._key_lengths:
+                        lengths = self._key_lengths[key[0]]
+                        lengths[len(key[1])] -= 1
+                        if not lengths[len(key[1])]:
+                            del lengths[len(key[1])]
+
+    @staticmethod
+    def _substrings(text: str, max_len: int) -> set:
+        """text 中长度不超过 max_len 的全部非空子串"""
+        return {text[start:end] for start in range(len(text))
+                for end in range(start + 1, min(start + max_len, len(text)) + 1)}
+
+    def publish(self, payment_data: Dict[str, str]):
+        """新支付入库时唤醒匹配的等待者"""
+        message = payment_data.get('message') or ''
+        sender = payment_data['sender']
+        with self._lock:
+            candidates = list(self._unfiltered)
+            token_index = self._index['token']
+            for token in extract_message_tokens(message):
+                candidates.extend(token_index.get(token, ()))
+            for kind, text in (('message', message), ('sender', sender)):
+                index = self._index[kind]
+                if not index:
+                    continue
+                for key in self._substrings(text, max(self._key_lengths[kind])):
+                    candidates.extend(index.get(key, ()))
+
+        for waiter in candidates:
+            if not waiter.event.is_set() and waiter.matches(payment_data):
+                waiter.payment = payment_data
+                waiter.event.set()
+
+    def release_all(self):
+        """服务关闭时唤醒全部等待者，长轮询请求按未支付返回"""
+        with self._lock:
+            waiters = list(self._unfiltered)
+            for index in self._index.values():
+                for bucket in index.values():
+                    waiters.extend(bucket)
+        for waiter in waiters:
+            waiter.event.set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._unfiltered) + sum(
+                len(bucket) for index in self._index.values() for bucket in index.values())
+
+
+class RecentPaymentCache:
+    """最近支付记录的内存缓存
+
+    按到账时间分钟分桶，并按留言精确匹配词建立索引。complete_since 之后到账的
+    支付记录全部在缓存中，查询窗口完全落在此范围内时可直接由内存给出结论（包括未找到）。
+    超过 horizon 的分桶或记录数超过 max_items 时从最旧的分桶开始淘汰。
+    """
+
+    def __init__(self, horizon: int = None, max_items: int = None):
+        self.horizon = horizon or int(os.getenv('RECENT_CACHE_MINUTES', '30')) * 60
+        self.max_items = max_items or int(os.getenv('RECENT_CACHE_MAX_ITEMS', '100000'))
+        self._lock = threading.Lock()
+        self._buckets: Dict[int, list] = {}
+        self._by_token: Dict[str, list] = {}
+        self._keys = set()
+        self._size = 0
+        # 预热前不覆盖任何时间范围
+        self.complete_since = float('inf')
+        self.hits = 0
+        self.misses = 0
+
+    def warm(self, db: 'SQLitePool'):
+        """从数据库加载 horizon 内的支付记录，之后该时间范围由缓存负责
+
+        加载期间持有锁，与此同时入库的记录要么已在查询结果中，要么在预热完成后通过 add() 加入。
+        """
+        since = int(time.time()) - self.horizon
+        with self._lock:
+            try:
+                with db.connection() as conn:
+                    rows = conn.execute('''
+                    SELECT amount, sender, message, timestamp, remark, source FROM payments WHERE ts_epoch >= ?
+                    ''', (since,)).fetchall()
+            except Exception as e:
+                logger.warning(f"预热最近支付缓存失败: {str(e)}")
+                return
+            self.complete_since = since
+            for row in rows:
+                self._add(dict(row))
+            self._evict()
+
+    def add(self, payment_data: Dict[str, str]):
+        """加入新入库的支付记录"""
+        with self._lock:
+            self._add(payment_data)
+            self._evict()
+
+    def _add(self, payment_data: Dict[str, str]):
+        ts_epoch = parse_timestamp_epoch(payment_data['timestamp'])
+        key = payment_key(payment_data)
+        # 预热前（complete_since 为无穷大）不接收，预热时会从数据库读到这些记录
+        if ts_epoch is None or ts_epoch < self.complete_since or key in self._keys:
+            return
+        entry = (ts_epoch, key, extract_message_tokens(payment_data.get('message')), dict(payment_data))
+        self._keys.add(key)
+        self._buckets.setdefault(ts_epoch // 60, []).append(entry)
+        for token in entry[2]:
+            self._by_token.setdefault(token, []).append(entry)
+        self._size += 1
+
+    def _evict(self):
+        cutoff = int(time.time()) - self.horizon
+        while self._buckets:
+            oldest = min(self._buckets)
+            if oldest * 60 + 60 > cutoff and self._size <= self.max_items:
+                break
+            for entry in self._buckets.pop(oldest):
+                self._keys.discard(entry[1])
+                for token in entry[2]:
+                    self._remove_from(self._by_token, token, entry)
+                self._size -= 1
+            self.complete_since = max(self.complete_since, oldest * 60 + 60)
+        if not self._buckets and self.complete_since != float('inf'):
+            self.complete_since = max(self.complete_since, cutoff)
+
+    @staticmethod
+    def _remove_from(index: Dict[str, list], key: str, entry):
+        entries = index.get(key)
+        if entries is not None:
+            entries.remove(entry)
+            if not entries:
+                del index[key]
+
+    def lookup(self, start_epoch: int, end_epoch: int, message: str = None,
+               wechat_id: str = None, match: str = 'like') -> Tuple[bool, Optional[Dict[str, str]]]:
+        """在缓存中查找，返回 (是否由缓存负责该时间窗口, 匹配的支付记录)"""
+        with self._lock:
+            if start_epoch < self.complete_since:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+
+            if message and match == 'token':
+                candidates = self._by_token.get(normalize_token(message), ())
+            else:
+                candidates = [entry for minute in range(start_epoch // 60, end_epoch // 60 + 1)
+                              for entry in self._buckets.get(minute, ())]
+
+            for ts_epoch, _, _, payment_data in sorted(candidates, key=lambda entry: entry[0]):
+                if not start_epoch <= ts_epoch <= end_epoch:
+                    continue
+                if message and match != 'token' and message not in (payment_data.get('message') or ''):
+                    continue
+                if wechat_id and wechat_id not in payment_data['sender']:
+                    continue
+                return True, payment_data
+            return True, None
+
+    def stats(self) -> Dict[str, int]:
+        """命中统计"""
+        with self._lock:
+            return {
+                'size': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'complete_since': None if self.complete_since == float('inf') else int(self.complete_since)
+            }
+
+
+class Order:
+    """待支付订单"""
+
+    __slots__ = ('order_id', 'amount', 'amount_cents', 'token', 'status', 'created_at', 'expires_at',
+                 'closed_at', 'payment', 'event', 'seq')
+
+    def __init__(self, order_id: str, amount: str, amount_cents: int, token: Optional[str], created_at: float,
+                 expires_at: float, seq: int = 0):
+        self.order_id = order_id
+        self.seq = seq
+        self.amount = amount
+        self.amount_cents = amount_cents
+        self.token = token
+        self.status = 'pending'
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.closed_at = None
+        self.payment = None
+        self.event = threading.Event()
+
+    @property
+    def index_key(self) -> Tuple[int, Optional[str]]:
+        return self.amount_cents, self.token
+
+    def to_dict(self) -> Dict:
+        fmt = lambda epoch: datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S') if epoch else None
+        return {
+            'order_id': self.order_id,
+            'amount': self.amount,
+            'token': self.token,
+            'status': self.status,
+            'created_at': fmt(self.created_at),
+            'expires_at': fmt(self.expires_at),
+            'paid_at': fmt(self.closed_at) if self.status == 'paid' else None,
+            'payment': self.payment
+        }
+
+
+class OrderRegistry:
+    """待支付订单登记表
+
+    订单按 (金额分, 留言词) 建立哈希索引，新支付入库时按金额和留言中的匹配词直接查找，
+    留言词能匹配的订单优先，多个都能匹配时取最早创建的一个；未指定留言词的订单只按金额匹配，
+    仅在没有留言词订单匹配时使用。
+    支付时间早于订单创建时间（允许 match_slack 秒误差）的记录不会匹配，避免历史支付误关单。
+    到期时间用最小堆维护，过期订单在访问时惰性清理，已结束的订单保留 retention 秒供查询。
+    """
+
+    def __init__(self, default_ttl: int = None, max_open: int = None, retention: int = None,
+                 match_slack: int = None):
+        self.default_ttl = default_ttl or int(os.getenv('ORDER_TTL', '900'))
+        self.max_open = max_open or int(os.getenv('ORDER_MAX_OPEN', '100000'))
+        self.retention = retention or int(os.getenv('ORDER_RETENTION', '3600'))
+        self.match_slack = int(os.getenv('ORDER_MATCH_SLACK', '60')) if match_slack is None else match_slack
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._orders: Dict[str, Order] = {}
+        self._index: Dict[Tuple[int, Optional[str]], deque] = {}
+        # (截止时间, 订单号)：待支付订单的截止时间为过期时间，已结束订单为清除时间
+        self._deadlines: List[Tuple[float, str]] = []
+        self._open = 0
+
+    def __len__(self) -> int:
+        return self._open
+
+    def create(self, amount: str, token: str = None, ttl: int = None, order_id: str = None) -> Order:
+        """登记待支付订单，金额无法解析、订单号重复或待支付订单过多时抛出 ValueError"""
+        amount_cents = parse_amount_cents(amount)
+        if amount_cents is None or amount_cents <= 0:
+            raise ValueError('金额格式错误')
+        token = normalize_token(token) or None
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            self._expire(now)
+            if order_id is None:
+                order_id = hashlib.md5(f"{amount}|{token}|{now}|{len(self._orders)}".encode()).hexdigest()[:16]
+            if order_id in self._orders:
+                raise ValueError(f'订单号已存在: {order_id}')
+            if self._open >= self.max_open:
+                raise ValueError('待支付订单数已达上限')
+            order = Order(order_id, f"{amount_cents / 100:.2f}", amount_cents, token, now, now + ttl,
+                          next(self._seq))
+            self._orders[order_id] = order
+            self._index.setdefault(order.index_key, deque()).append(order)
+            heapq.heappush(self._deadlines, (order.expires_at, order_id))
+            self._open += 1
+        ORDERS_TOTAL.inc(result='created')
+        return order
+
+    def get(self, order_id: str) -> Optional[Order]:
+        """查询订单"""
+        with self._lock:
+            self._expire(time.time())
+            return self._orders.get(order_id)
+
+    def cancel(self, order_id: str) -> Optional[Order]:
+        """取消待支付订单，已结束的订单保持原状态"""
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is not None and order.status == 'pending':
+                self._close(order, 'cancelled', time.time())
+        return order
+
+    def match(self, payment_data: Dict[str, str]) -> Optional[Order]:
+        """新支付入库时匹配待支付订单并标记为已支付"""
+        amount_cents = parse_amount_cents(payment_data.get('amount'))
+        paid_at = parse_timestamp_epoch(payment_data.get('timestamp'))
+        if amount_cents is None or paid_at is None:
+            return None
+        token_keys = [(amount_cents, token) for token in extract_message_tokens(payment_data.get('message'))]
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            # 同一键下的订单按创建顺序排列，队首即该键最早创建的订单；只按金额匹配的订单排在留言词订单之后
+            order = None
+            for keys in (token_keys, [(amount_cents, None)]):
+                candidates = [self._index[key][0] for key in keys if self._index.get(key)]
+                candidates = [order for order in candidates if paid_at >= order.created_at - self.match_slack]
+                if candidates:
+                    order = min(candidates, key=lambda order: order.seq)
+                    break
+            if order is None:
+                return None
+            order.payment = {
+                'source': payment_data.get('source', DEFAULT_SOURCE),
+                'amount': payment_data['amount'],
+                'sender': payment_data['sender'],
+                'timestamp': payment_data['timestamp'],
+                'message': payment_data.get('message'),
+                'remark': payment_data.get('remark')
+            }
+            self._close(order, 'paid', now)
+            return order
+
+    def _close(self, order: Order, status: str, now: float):
+        """结束订单：移出索引并安排清除时间（需持有锁）"""
+        bucket = self._index.get(order.index_key)
+        if bucket is not None:
+            bucket.remove(order)
+            if not bucket:
+                del self._index[order.index_key]
+        order.status = status
+        order.closed_at = now
+        self._open -= 1
+        heapq.heappush(self._deadlines, (now + self.retention, order.order_id))
+        order.event.set()
+        ORDERS_TOTAL.inc(result=status)
+
+    def _expire(self, now: float):
+        """处理已到截止时间的订单（需持有锁）"""
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, order_id = heapq.heappop(self._deadlines)
+            order = self._orders.get(order_id)
+            if order is None:
+                continue
+            if order.status == 'pending':
+                if order.expires_at == deadline:
+                    self._close(order, 'expired', now)
+            elif order.closed_at + self.retention <= now:
+                del self._orders[order_id]
+
+    def release_all(self):
+        """服务关闭时唤醒全部等待订单结果的请求"""
+        with self._lock:
+            for order in self._orders.values():
+                order.event.set()
+
+
+try:
+    from werkzeug.serving import BaseWSGIServer
+except ImportError:  # pragma: no cover - werkzeug 随 flask 安装
+    BaseWSGIServer = None
+
+
+if BaseWSGIServer is not None:
+    class PooledWSGIServer(BaseWSGIServer):
+        """固定大小线程池处理请求的 WSGI 服务
+
+        werkzeug 的 threaded 模式每个连接新建一个线程，连接数激增时线程数不受控制；
+        这里改为由线程池处理，超出线程数的连接在池队列中排队，监听积压由 backlog 控制。
+        """
+
+        multithread = True
+        daemon_threads = True
+
+        def __init__(self, host: str, port: int, app, threads: int, backlog: int = 1024):
+            # 监听积压需在 bind/listen 之前设置
+            self.request_queue_size = backlog
+            self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='api-worker')
+            super().__init__(host, port, app)
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self._process_request_thread, request, client_address)
+
+        def _process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+        def server_close(self):
+            super().server_close()
+            self.executor.shutdown(wait=False)
+
+
 class WeChatPaymentAPI:
     """微信支付API类"""
+
+    # 列表接口单页最大条数
+    MAX_PAGE_SIZE = 1000
     
     def __init__(self, db_name: str = None):
         # 从环境变量获取配置，如果环境变量不存在则使用默认值
-        self.db_name = db_name or os.getenv('DB_NAME', 'wxpayments.db')
-        # 确保数据库文件路径是绝对路径
-        if not os.path.isabs(self.db_name):
-            self.db_name = os.path.join(get_application_path(), self.db_name)
+        self.db_name = resolve_db_path(db_name)
+        self.db = SQLitePool.get(self.db_name)
+        # 留言匹配方式：token 精确匹配词（索引点查），like 子串匹配
+        self.message_match = os.getenv('API_MESSAGE_MATCH', 'like')
+        # 长轮询最长等待时间（秒）
+        self.max_wait_timeout = int(os.getenv('API_WAIT_TIMEOUT_MAX', '60'))
+        # 等待支付结果的请求索引
+        self.waiters = PaymentWaiters()
+        # 列表总数缓存 {(查询条件, 参数): (总数, 过期时间)}
+        self.count_cache_ttl = float(os.getenv('API_COUNT_CACHE_TTL', '10'))
+        self._count_cache = {}
+        self.export_batch_size = 500
+        # 最近支付记录缓存，支付检查优先由内存回答
+        self.recent_cache = RecentPaymentCache()
+        self.recent_cache.warm(self.db)
+        # 待支付订单登记表，新支付入库时直接匹配
+        self.orders = OrderRegistry()
         self.app = Flask(__name__)
         self._setup_cors()
         self._setup_routes()
+        self._setup_metrics()
         self.server = None
+        # 处理中的请求数，关闭服务时等待其归零
+        self._inflight = 0
+        self._inflight_cond = threading.Condition()
+        # 请求线程池大小，0 表示每个连接一个线程（werkzeug threaded 模式）
+        self.server_threads = int(os.getenv('API_SERVER_THREADS', '0'))
+        self.server_backlog = int(os.getenv('API_SERVER_BACKLOG', '1024'))
+        self.shutdown_timeout = float(os.getenv('API_SHUTDOWN_TIMEOUT', '10'))
         
     def _setup_cors(self):
         """配置CORS"""
@@ -69,64 +1420,183 @@ class WeChatPaymentAPI:
     def _setup_routes(self):
         """设置路由"""
         self.app.route('/api/payment/check', methods=['GET'])(self.check_payment)
+        self.app.route('/api/payment/wait', methods=['GET'])(self.wait_payment)
         self.app.route('/api/payment/list', methods=['GET'])(self.get_payment_list)
+        self.app.route('/api/payment/export', methods=['GET'])(self.export_payments)
+        self.app.route('/api/payment/cache', methods=['GET'])(self.get_cache_stats)
+        self.app.route('/api/order', methods=['POST'])(self.create_order)
+        self.app.route('/api/order/<order_id>', methods=['GET'])(self.get_order)
+        self.app.route('/api/order/<order_id>/cancel', methods=['POST'])(self.cancel_order)
+        self.app.route('/api/trace/report', methods=['GET'])(self.get_trace_report)
         self.app.route('/api/service/status', methods=['GET'])(self.check_service_status)
+        self.app.route('/api/health/live', methods=['GET'])(self.health_live)
+        self.app.route('/api/health/ready', methods=['GET'])(self.health_ready)
+        self.app.route('/metrics', methods=['GET'])(self.get_metrics)
         
-    def get_db_connection(self):
-        """获取数据库连接"""
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row
-        return conn
+    def _setup_metrics(self):
+        """按路由统计API请求耗时"""
+        @self.app.before_request
+        def start_timer():
+            g.request_started = time.perf_counter()
+            with self._inflight_cond:
+                self._inflight += 1
+            g.request_tracked = True
+
+        @self.app.teardown_request
+        def finish_request(exc):
+            # 流式导出在响应体发送完毕后才触发 teardown
+            if g.pop('request_tracked', False):
+                with self._inflight_cond:
+                    self._inflight -= 1
+                    if self._inflight == 0:
+                        self._inflight_cond.notify_all()
+
+        @self.app.after_request
+        def observe_latency(response):
+            started = getattr(g, 'request_started', None)
+            if started is not None:
+                route = request.url_rule.rule if request.url_rule else 'unmatched'
+                API_SECONDS.observe(time.perf_counter() - started, route=route, status=response.status_code)
+            return response
+
+    def get_metrics(self):
+        """Prometheus 文本格式的运行指标"""
+        return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
         
+    def find_payment(self, start_time: datetime, end_time: datetime, message: str = None,
+                     wechat_id: str = None, match: str = 'like') -> Optional[Dict[str, str]]:
+        """查询时间窗口内匹配的支付记录
+
+        match 为 token 时留言按精确匹配词查找（索引点查），为 like 时按子串匹配。
+        时间窗口在最近支付缓存的覆盖范围内时直接由内存回答，否则查询数据库。
+        """
+        covered, payment_data = self.recent_cache.lookup(
+            int(start_time.timestamp()), int(end_time.timestamp()), message, wechat_id, match)
+        if covered:
+            return payment_data
+
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+
+            if message and match == 'token':
+                query = '''
+                SELECT payments.* FROM payment_tokens
+                JOIN payments ON payments.id = payment_tokens.payment_id
+                WHERE payment_tokens.token = ? AND payments.ts_epoch BETWEEN ? AND ?
+                '''
+                params = [normalize_token(message), int(start_time.timestamp()), int(end_time.timestamp())]
+            else:
+                query = '''
+                SELECT * FROM payments 
+                WHERE ts_epoch BETWEEN ? AND ?
+                '''
+                params = [int(start_time.timestamp()), int(end_time.timestamp())]
+                if message:
+                    query += ' AND message LIKE ?'
+                    params.append(f'%{message}%')
+
+            if wechat_id:
+                query += ' AND sender LIKE ?'
+                params.append(f'%{wechat_id}%')
+
+            cursor.execute(query, params)
+            result = cursor.fetchone()
+            return dict(result) if result else None
+
+    def _payment_found_response(self, payment_data: Dict[str, str]):
+        """构造支付成功响应"""
+        return jsonify({
+            'code': 200,
+            'message': '支付成功',
+            'data': {
+                'amount': payment_data['amount'],
+                'sender': payment_data['sender'],
+                'timestamp': payment_data['timestamp'],
+                'message': payment_data['message'],
+                'remark': payment_data['remark'],
+                'source': payment_data.get('source', DEFAULT_SOURCE)
+            }
+        })
+
     def check_payment(self):
         """检查支付状态API"""
         try:
             create_time = request.args.get('create_time')
             message = request.args.get('message')
             wechat_id = request.args.get('wechat_id')
+            match = request.args.get('match', self.message_match)
 
             if not create_time:
                 return jsonify({
                     'code': 400,
                     'message': '缺少必要参数 create_time'
                 }), 400
+            if match not in ('token', 'like'):
+                return jsonify({
+                    'code': 400,
+                    'message': '参数格式错误 match'
+                }), 400
 
             create_time = datetime.strptime(create_time, '%Y-%m-%d %H:%M:%S')
             end_time = create_time + timedelta(minutes=10)
 
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
+            payment_data = self.find_payment(create_time, end_time, message, wechat_id, match)
+            if payment_data:
+                return self._payment_found_response(payment_data)
+            else:
+                return jsonify({
+                    'code': 404,
+                    'message': '未找到支付记录'
+                })
 
-            query = '''
-            SELECT * FROM payments 
-            WHERE timestamp BETWEEN ? AND ?
-            '''
-            params = [create_time.strftime('%Y-%m-%d %H:%M:%S'), 
-                     end_time.strftime('%Y-%m-%d %H:%M:%S')]
+        except Exception as e:
+            return jsonify({
+                'code': 500,
+                'message': f'服务器错误: {str(e)}'
+            }), 500
 
-            if message:
-                query += ' AND message LIKE ?'
-                params.append(f'%{message}%')
-            if wechat_id:
-                query += ' AND sender LIKE ?'
-                params.append(f'%{wechat_id}%')
+    def wait_payment(self):
+        """等待支付结果API（长轮询）
 
-            cursor.execute(query, params)
-            result = cursor.fetchone()
+        先查询数据库，未找到时挂起请求，直到有匹配的新支付记录入库或超时。
+        """
+        waiter = None
+        try:
+            create_time = request.args.get('create_time')
+            message = request.args.get('message')
+            wechat_id = request.args.get('wechat_id')
+            match = request.args.get('match', self.message_match)
 
-            if result:
-                payment_data = dict(result)
+            if not create_time:
                 return jsonify({
-                    'code': 200,
-                    'message': '支付成功',
-                    'data': {
-                        'amount': payment_data['amount'],
-                        'sender': payment_data['sender'],
-                        'timestamp': payment_data['timestamp'],
-                        'message': payment_data['message'],
-                        'remark': payment_data['remark']
-                    }
-                })
+                    'code': 400,
+                    'message': '缺少必要参数 create_time'
+                }), 400
+            if match not in ('token', 'like'):
+                return jsonify({
+                    'code': 400,
+                    'message': '参数格式错误 match'
+                }), 400
+
+            try:
+                timeout = self._wait_timeout(30)
+            except ValueError:
+                return jsonify({
+                    'code': 400,
+                    'message': '参数格式错误 timeout'
+                }), 400
+
+            create_time = datetime.strptime(create_time, '%Y-%m-%d %H:%M:%S')
+            end_time = create_time + timedelta(minutes=10)
+
+            # 先注册再查询，避免查询与入库之间的竞态
+            waiter = self.waiters.register(create_time, end_time, message, wechat_id, match)
+            payment_data = self.find_payment(create_time, end_time, message, wechat_id, match)
+            if not payment_data and waiter.event.wait(timeout):
+                payment_data = waiter.payment
+
+            if payment_data:
+                return self._payment_found_response(payment_data)
             else:
                 return jsonify({
                     'code': 404,
@@ -139,52 +1609,222 @@ class WeChatPaymentAPI:
                 'message': f'服务器错误: {str(e)}'
             }), 500
         finally:
-            conn.close()
+            if waiter:
+                self.waiters.unregister(waiter)
             
+    def _list_filters(self, args) -> Tuple[str, list]:
+        """根据请求参数构造支付记录列表的查询条件"""
+        where = 'WHERE 1=1'
+        params = []
+
+        wechat_id = args.get('wechat_id')
+        message = args.get('message')
+        start_time = args.get('start_time')
+        end_time = args.get('end_time')
+        source = args.get('source')
+
+        if source:
+            where += ' AND source = ?'
+            params.append(source)
+        if wechat_id:
+            where += ' AND sender LIKE ?'
+            params.append(f'%{wechat_id}%')
+        if message:
+            where += ' AND message LIKE ?'
+            params.append(f'%{message}%')
+        if start_time:
+            where += ' AND ts_epoch >= ?'
+            params.append(parse_timestamp_epoch(start_time))
+        if end_time:
+            where += ' AND ts_epoch <= ?'
+            params.append(parse_timestamp_epoch(end_time))
+        return where, params
+
+    @staticmethod
+    def _parse_cursor(value: str) -> Tuple[int, int]:
+        """解析分页游标（格式：<ts_epoch>,<id>）"""
+        ts_epoch, payment_id = value.split(',')
+        return int(ts_epoch), int(payment_id)
+
+    def _fetch_page(self, conn: sqlite3.Connection, where: str, params: list, page_size: int,
+                    after: Tuple[int, int] = None, offset: int = 0) -> list:
+        """按到账时间倒序取一页记录，after 为上一页最后一条的 (ts_epoch, id)"""
+        query = f'SELECT * FROM payments {where}'
+        params = list(params)
+        if after:
+            query += ' AND (ts_epoch, id) < (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY ts_epoch DESC, id DESC LIMIT ?'
+        params.append(page_size)
+        if offset:
+            query += ' OFFSET ?'
+            params.append(offset)
+        return conn.execute(query, params).fetchall()
+
+    def _count_payments(self, conn: sqlite3.Connection, where: str, params: list) -> int:
+        """统计记录总数（结果缓存 count_cache_ttl 秒，有新支付入库时清空）"""
+        key = (where, tuple(params))
+        cached = self._count_cache.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        total = conn.execute(f'SELECT COUNT(*) as total FROM payments {where}', params).fetchone()['total']
+        if len(self._count_cache) >= 1000:
+            self._count_cache.clear()
+        self._count_cache[key] = (total, time.monotonic() + self.count_cache_ttl)
+        return total
+
+    def on_new_payment(self, payment_data: Dict[str, str]):
+        """新支付入库回调：加入最近支付缓存、唤醒长轮询请求并使计数缓存失效
+
+        首次扫描补录的历史记录（backfill）不参与订单匹配。
+        """
+        backfill = payment_data.get('backfill')
+        if backfill:
+            payment_data = {key: value for key, value in payment_data.items() if key != 'backfill'}
+        self.recent_cache.add(payment_data)
+        self._count_cache.clear()
+        self.waiters.publish(payment_data)
+        if backfill:
+            return
+        order = self.orders.match(payment_data)
+        if order is not None:
+            logger.info(f"订单 {order.order_id} 已支付: {payment_data['amount']} 来自 {payment_data['sender']}")
+
+    def create_order(self):
+        """登记待支付订单API
+
+        请求体 JSON：amount 金额（必填）、token 留言匹配词、ttl 有效秒数、order_id 订单号（默认自动生成）。
+        """
+        try:
+            body = request.get_json(silent=True) or {}
+            amount = body.get('amount')
+            if amount is None:
+                return jsonify({
+                    'code': 400,
+                    'message': '缺少必要参数 amount'
+                }), 400
+            ttl = body.get('ttl')
+            if ttl is not None:
+                ttl = int(ttl)
+                if ttl <= 0:
+                    raise ValueError('ttl 必须为正整数')
+            order_id = body.get('order_id')
+            order = self.orders.create(str(amount), body.get('token'), ttl,
+                                       str(order_id) if order_id is not None else None)
+            return jsonify({
+                'code': 200,
+                'message': '订单已登记',
+                'data': order.to_dict()
+            })
+        except ValueError as e:
+            return jsonify({
+                'code': 400,
+                'message': f'参数格式错误: {str(e)}'
+            }), 400
+        except Exception as e:
+            logger.error(f"登记订单失败: {str(e)}")
+            return jsonify({
+                'code': 500,
+                'message': f'服务器错误: {str(e)}'
+            }), 500
+
+    def _wait_timeout(self, default: float) -> float:
+        """读取长轮询等待秒数参数并限制在 [0, max_wait_timeout]，不是有限数值时抛出 ValueError"""
+        timeout = float(request.args.get('timeout', default))
+        if timeout != timeout or timeout in (float('inf'), float('-inf')):
+            raise ValueError(f'无效的等待时间: {timeout}')
+        return min(max(timeout, 0), self.max_wait_timeout)
+
+    def get_order(self, order_id: str):
+        """查询订单状态API，timeout 大于 0 时等待订单支付或过期（长轮询），不访问数据库"""
+        try:
+            timeout = self._wait_timeout(0)
+        except ValueError:
+            return jsonify({
+                'code': 400,
+                'message': '参数格式错误 timeout'
+            }), 400
+        order = self.orders.get(order_id)
+        if order is None:
+            return jsonify({
+                'code': 404,
+                'message': '订单不存在'
+            }), 404
+        if order.status == 'pending' and timeout > 0:
+            # 等待到过期时间为止，过期由下一次 get 惰性处理
+            order.event.wait(min(timeout, max(order.expires_at - time.time(), 0)))
+            order = self.orders.get(order_id) or order
+        return jsonify({
+            'code': 200,
+            'message': '支付成功' if order.status == 'paid' else '订单状态',
+            'data': order.to_dict()
+        })
+
+    def cancel_order(self, order_id: str):
+        """取消待支付订单API"""
+        order = self.orders.cancel(order_id)
+        if order is None:
+            return jsonify({
+                'code': 404,
+                'message': '订单不存在'
+            }), 404
+        return jsonify({
+            'code': 200,
+            'message': '订单已取消' if order.status == 'cancelled' else '订单已结束',
+            'data': order.to_dict()
+        })
+
     def get_payment_list(self):
-        """获取支付记录列表API"""
-        try:
-            wechat_id = request.args.get('wechat_id')
-            message = request.args.get('message')
-            start_time = request.args.get('start_time')
-            end_time = request.args.get('end_time')
-            page = int(request.args.get('page', 1))
-            page_size = int(request.args.get('page_size', 20))
+        """获取支付记录列表API
 
-            offset = (page - 1) * page_size
+        支持两种分页方式：page/page_size 页码分页；after=<ts_epoch>,<id> 游标分页（按索引定位，
+        不随页数变慢），下一页游标由返回的 next_cursor 给出。with_total=0 时不统计总数。
+        """
+        try:
+            try:
+                page = int(request.args.get('page', 1))
+            except ValueError:
+                page = 0
+            if page < 1:
+                return jsonify({
+                    'code': 400,
+                    'message': '参数格式错误 page'
+                }), 400
+            try:
+                page_size = int(request.args.get('page_size', 20))
+            except ValueError:
+                page_size = 0
+            if not 1 <= page_size <= self.MAX_PAGE_SIZE:
+                return jsonify({
+                    'code': 400,
+                    'message': f'参数格式错误 page_size（1-{self.MAX_PAGE_SIZE}）'
+                }), 400
+            after = request.args.get('after')
 
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
+            for name in ('start_time', 'end_time'):
+                value = request.args.get(name)
+                if value and parse_timestamp_epoch(value) is None:
+                    return jsonify({
+                        'code': 400,
+                        'message': f'参数格式错误 {name}'
+                    }), 400
 
-            query = 'SELECT * FROM payments WHERE 1=1'
-            count_query = 'SELECT COUNT(*) as total FROM payments WHERE 1=1'
-            params = []
+            try:
+                cursor_key = self._parse_cursor(after) if after else None
+            except ValueError:
+                return jsonify({
+                    'code': 400,
+                    'message': '参数格式错误 after'
+                }), 400
 
-            if wechat_id:
-                query += ' AND sender LIKE ?'
-                count_query += ' AND sender LIKE ?'
-                params.append(f'%{wechat_id}%')
-            if message:
-                query += ' AND message LIKE ?'
-                count_query += ' AND message LIKE ?'
-                params.append(f'%{message}%')
-            if start_time:
-                query += ' AND timestamp >= ?'
-                count_query += ' AND timestamp >= ?'
-                params.append(start_time)
-            if end_time:
-                query += ' AND timestamp <= ?'
-                count_query += ' AND timestamp <= ?'
-                params.append(end_time)
-
-            query += ' ORDER BY timestamp DESC LIMIT ? OFFSET ?'
-            params.extend([page_size, offset])
-
-            cursor.execute(count_query, params[:-2])
-            total = cursor.fetchone()['total']
+            # 页码分页默认返回总数（兼容旧版），游标分页默认不统计
+            with_total = request.args.get('with_total', '0' if after else '1') != '0'
+            where, params = self._list_filters(request.args)
+            offset = 0 if after else (page - 1) * page_size
 
-            cursor.execute(query, params)
-            results = cursor.fetchall()
+            with self.db.connection() as conn:
+                total = self._count_payments(conn, where, params) if with_total else None
+                results = self._fetch_page(conn, where, params, page_size, cursor_key, offset)
 
             payments = []
             for row in results:
@@ -194,18 +1834,27 @@ class WeChatPaymentAPI:
                     'sender': payment['sender'],
                     'timestamp': payment['timestamp'],
                     'message': payment['message'],
+                    'source': payment['source'],
                     'notify_status': payment['notify_status']
                 })
 
+            next_cursor = None
+            if len(results) == page_size:
+                next_cursor = f"{results[-1]['ts_epoch']},{results[-1]['id']}"
+
+            data = {
+                'total': total,
+                'page_size': page_size,
+                'next_cursor': next_cursor,
+                'list': payments
+            }
+            if not after:
+                data['page'] = page
+
             return jsonify({
                 'code': 200,
                 'message': 'success',
-                'data': {
-                    'total': total,
-                    'page': page,
-                    'page_size': page_size,
-                    'list': payments
-                }
+                'data': data
             })
 
         except Exception as e:
@@ -213,35 +1862,134 @@ class WeChatPaymentAPI:
                 'code': 500,
                 'message': f'服务器错误: {str(e)}'
             }), 500
-        finally:
-            conn.close()
+
+    def export_payments(self):
+        """导出支付记录API（流式输出，format=ndjson 或 csv）
+
+        按游标分批读取，每批读取后归还数据库连接，不会把全部记录加载到内存。
+        """
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            return jsonify({
+                'code': 400,
+                'message': '参数格式错误 format'
+            }), 400
+        for name in ('start_time', 'end_time'):
+            value = request.args.get(name)
+            if value and parse_timestamp_epoch(value) is None:
+                return jsonify({
+                    'code': 400,
+                    'message': f'参数格式错误 {name}'
+                }), 400
+
+        where, params = self._list_filters(request.args)
+        columns = ['id', 'amount', 'sender', 'timestamp', 'message', 'remark', 'source', 'notify_status']
+
+        def generate():
+            if export_format == 'csv':
+                yield ','.join(columns) + '\n'
+            after = None
+            while True:
+                with self.db.connection() as conn:
+                    rows = self._fetch_page(conn, where, params, self.export_batch_size, after)
+                if not rows:
+                    break
+                if export_format == 'csv':
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    writer.writerows([row[column] for column in columns] for row in rows)
+                    yield buffer.getvalue()
+                else:
+                    yield ''.join(
+                        json.dumps({column: row[column] for column in columns}, ensure_ascii=False) + '\n'
+                        for row in rows)
+                if len(rows) < self.export_batch_size:
+                    break
+                after = (rows[-1]['ts_epoch'], rows[-1]['id'])
+
+        mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+        response = Response(stream_with_context(generate()), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=payments.{export_format}'
+        return response
             
-    def check_service_status(self):
-        """检查微信支付监控服务状态"""
+    def get_cache_stats(self):
+        """最近支付缓存统计API"""
+        return jsonify({
+            'code': 200,
+            'message': 'success',
+            'data': self.recent_cache.stats()
+        })
+
+    def get_trace_report(self):
+        """端到端延迟报告API：最近 minutes 分钟（默认60）入库的支付从检测到收到通知确认的各阶段耗时分位数"""
         try:
-            # 检查当前进程
-            current_pid = os.getpid()
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                if proc.info['pid'] == current_pid:
-                    return jsonify({
-                        'code': 200,
-                        'message': '服务进程存在',
-                        'data': {
-                            'status': 'process_exists',
-                            'pid': current_pid
-                        }
-                    })
+            minutes = request.args.get('minutes', '60')
+            target = request.args.get('target') or None
+            try:
+                minutes = int(minutes)
+            except ValueError:
+                return jsonify({
+                    'code': 400,
+                    'message': '参数格式错误 minutes'
+                }), 400
+
+            since_epoch = int(time.time()) - minutes * 60
+            with self.db.connection() as conn:
+                report = load_trace_report(conn, since_epoch, target)
+
+            return jsonify({
+                'code': 200,
+                'message': 'success',
+                'data': {
+                    'minutes': minutes,
+                    'target': target,
+                    'segments': report
+                }
+            })
+
         except Exception as e:
-            logger.error(f"检查服务状态时出错: {str(e)}")
-            pass
+            logger.error(f"获取延迟报告时出错: {str(e)}")
+            return jsonify({
+                'code': 500,
+                'message': f'服务器错误: {str(e)}'
+            }), 500
+
+    def check_service_status(self):
+        """检查微信支付监控服务状态（读取健康快照）"""
+        snapshot = HEALTH.snapshot()
+        if not snapshot['live']:
+            return jsonify({
+                'code': 503,
+                'message': '服务无响应',
+                'data': dict(snapshot, status='stalled')
+            })
+        return jsonify({
+            'code': 200,
+            'message': '服务运行中' if snapshot['ready'] else '服务运行中，部分功能不可用',
+            'data': dict(snapshot, status='running' if snapshot['ready'] else 'degraded')
+        })
 
+    def health_live(self):
+        """存活检查：扫描循环仍在推进时返回 200，否则返回 503"""
+        snapshot = HEALTH.snapshot()
         return jsonify({
-            'code': 404,
-            'message': '服务未运行',
+            'code': 200 if snapshot['live'] else 503,
+            'message': '存活' if snapshot['live'] else '扫描循环无响应',
             'data': {
-                'status': 'stopped'
+                'live': snapshot['live'],
+                'uptime': snapshot['uptime'],
+                'heartbeat_age': snapshot['heartbeat_age']
             }
-        })
+        }), 200 if snapshot['live'] else 503
+
+    def health_ready(self):
+        """就绪检查：窗口可用、最近扫描成功且队列无积压时返回 200，否则返回 503 及原因"""
+        snapshot = HEALTH.snapshot()
+        return jsonify({
+            'code': 200 if snapshot['ready'] else 503,
+            'message': '就绪' if snapshot['ready'] else '未就绪',
+            'data': snapshot
+        }), 200 if snapshot['ready'] else 503
         
     def run(self, host: str = None, port: int = None, debug: bool = None):
         """运行API服务"""
@@ -249,39 +1997,492 @@ class WeChatPaymentAPI:
         port = port or int(os.getenv('API_PORT', '5000'))
         debug = debug if debug is not None else os.getenv('API_DEBUG', 'false').lower() == 'true'
         
-        from werkzeug.serving import make_server
-        self.server = make_server(host, port, self.app)
+        self.server = self.create_server(host, port)
         self.server.serve_forever()
+
+    def create_server(self, host: str, port: int):
+        """创建 WSGI 服务：配置了线程数时使用固定线程池，否则每个连接一个线程"""
+        if self.server_threads > 0:
+            logger.info(f"API服务使用线程池模式: {self.server_threads} 线程，backlog {self.server_backlog}")
+            return PooledWSGIServer(host, port, self.app, self.server_threads, self.server_backlog)
+        from werkzeug.serving import make_server
+        # 长轮询请求会挂起，需使用多线程服务
+        return make_server(host, port, self.app, threaded=True)
         
-    def shutdown(self):
-        """关闭API服务"""
-        if self.server:
-            self.server.shutdown()
+    def shutdown(self, timeout: float = None):
+        """关闭API服务
+
+        先停止接受新连接，再唤醒挂起的长轮询请求，等待处理中的请求完成（最多 timeout 秒）后关闭监听。
+        """
+        if not self.server:
+            return
+        timeout = self.shutdown_timeout if timeout is None else timeout
+        self.server.shutdown()
+        self.waiters.release_all()
+        self.orders.release_all()
+        deadline = time.monotonic() + timeout
+        with self._inflight_cond:
+            while self._inflight > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"API服务关闭超时，仍有 {self._inflight} 个请求未完成")
+                    break
+                self._inflight_cond.wait(remaining)
+        self.server.server_close()
+        self.server = None
+
+# 支付消息中的标签与字段对应关系
+PAYMENT_KEY_MAPPING = {
+    "收款金额": "amount",
+    "来自": "sender",
+    "付款方留言": "message",
+    "到账时间": "timestamp",
+    "备注": "remark"
+}
+
+
+def parse_payment_texts(nodes: Iterable[Tuple[str, Optional[str]]]) -> Optional[Dict[str, str]]:
+    """从 (控件类型, 名称) 序列中解析支付信息
+
+    标签文本之后的下一个文本即为对应字段的值，所有标签都解析完成后立即停止读取。
+    """
+    controls_dict = {}
+    pending_key = None
+
+    for control_type, name in nodes:
+        if control_type != 'TextControl':
+            continue
+        if pending_key is not None:
+            controls_dict[pending_key] = name.replace("￥", "") if pending_key == "amount" else name
+            if len(controls_dict) == len(PAYMENT_KEY_MAPPING):
+                break
+        pending_key = PAYMENT_KEY_MAPPING.get(name)
+
+    if all(key in controls_dict for key in ["amount", "sender", "timestamp"]):
+        return controls_dict
+    return None
+
+
+class MemoryRect:
+    """内存控件的矩形区域，与 uiautomation.Rect 属性一致"""
+
+    def __init__(self, left: int = 0, top: int = 0, right: int = 0, bottom: int = 0):
+        self.left = left
+        self.top = top
+        self.right = right
+        self.bottom = bottom
+
+    @property
+    def width(self) -> int:
+        return self.right - self.left
+
+    @property
+    def height(self) -> int:
+        return self.bottom - self.top
+
+
+class MemoryControl:
+    """内存中的控件树节点
+
+    实现监控用到的 uiautomation 控件接口（GetChildren、ControlTypeName、Name、
+    BoundingRectangle 等），用于在非Windows环境下测试和基准测试扫描逻辑。
+    call_count 统计所有接口调用次数，用来估算真实环境下的COM调用开销；
+    call_latency 大于 0 时每次调用休眠相应秒数，模拟跨进程COM调用的耗时（休眠期间释放GIL，与COM调用一致）。
+    """
+
+    call_count = 0
+    call_latency = 0.0
+    _next_runtime_id = 1
+
+    def __init__(self, control_type: str, name: str = '', children: List['MemoryControl'] = None,
+                 rect: MemoryRect = None, runtime_id: Tuple[int, ...] = None):
+        self._control_type = control_type
+        self._name = name
+        self._rect = rect or MemoryRect()
+        if runtime_id is None:
+            runtime_id = (42, MemoryControl._next_runtime_id)
+            MemoryControl._next_runtime_id += 1
+        self._runtime_id = runtime_id
+        self._parent = None
+        # 在父控件子列表中的位置（缓存，列表变化后按需重新查找）
+        self._position = 0
+        self._children = []
+        for child in children or []:
+            self.append(child)
+
+    def append(self, child: 'MemoryControl') -> 'MemoryControl':
+        """追加子控件"""
+        child._parent = self
+        child._position = len(self._children)
+        self._children.append(child)
+        return child
+
+    def remove(self, child: 'MemoryControl'):
+        """移除子控件"""
+        self._children.remove(child)
+        child._parent = None
+
+    def _charge(self, calls: int):
+        """记录接口调用次数并模拟调用耗时"""
+        MemoryControl.call_count += calls
+        if self.call_latency:
+            time.sleep(self.call_latency * calls)
+
+    @property
+    def ControlTypeName(self) -> str:
+        self._charge(1)
+        return self._control_type
+
+    @property
+    def Name(self) -> str:
+        self._charge(1)
+        return self._name
+
+    @property
+    def BoundingRectangle(self) -> MemoryRect:
+        self._charge(1)
+        return self._rect
+
+    def Exists(self, *args, **kwargs) -> bool:
+        self._charge(1)
+        return True
+
+    def GetRuntimeId(self) -> List[int]:
+        self._charge(1)
+        return list(self._runtime_id)
+
+    def GetChildren(self) -> List['MemoryControl']:
+        # 真实环境中逐个遍历兄弟节点，每个子控件都是一次调用
+        self._charge(1 + len(self._children))
+        return list(self._children)
+
+    def GetFirstChildControl(self) -> Optional['MemoryControl']:
+        self._charge(1)
+        return self._children[0] if self._children else None
+
+    def GetLastChildControl(self) -> Optional['MemoryControl']:
+        self._charge(1)
+        return self._children[-1] if self._children else None
+
+    def _sibling(self, offset: int) -> Optional['MemoryControl']:
+        self._charge(1)
+        if self._parent is None:
+            return None
+        siblings = self._parent._children
+        if not (self._position < len(siblings) and siblings[self._position] is self):
+            self._position = siblings.index(self)
+        index = self._position + offset
+        if 0 <= index < len(siblings):
+            return siblings[index]
+        return None
+
+    def GetNextSiblingControl(self) -> Optional['MemoryControl']:
+        return self._sibling(1)
+
+    def GetPreviousSiblingControl(self) -> Optional['MemoryControl']:
+        return self._sibling(-1)
+
+
+# 控件树录制文件的格式版本
+CONTROL_TREE_VERSION = 1
+
+
+def dump_control_tree(control) -> Dict:
+    """把控件子树序列化为紧凑结构
+
+    只使用扫描用到的控件接口（ControlTypeName、Name、BoundingRectangle、GetRuntimeId、GetChildren），
+    真实窗口和内存控件树都可以录制。控件类型按 types 表编号，每个节点为
+    [类型编号, 名称, 子节点列表, 矩形, 运行时ID]，末尾为空的字段省略。
+    """
+    types: List[str] = []
+    type_index: Dict[str, int] = {}
+
+    def encode(node) -> list:
+        control_type = node.ControlTypeName
+        if control_type not in type_index:
+            type_index[control_type] = len(types)
+            types.append(control_type)
+        rect = node.BoundingRectangle
+        try:
+            runtime_id = list(node.GetRuntimeId() or ())
+        except Exception:
+            runtime_id = []
+        fields = [
+            type_index[control_type],
+            node.Name or '',
+            [encode(child) for child in node.GetChildren()],
+            [rect.left, rect.top, rect.right, rect.bottom] if rect and (rect.right or rect.bottom) else [],
+            runtime_id
+        ]
+        while len(fields) > 2 and not fields[-1]:
+            fields.pop()
+        return fields
+
+    root = encode(control)
+    return {'version': CONTROL_TREE_VERSION, 'types': types, 'root': root}
+
+
+def build_control_tree(data: Dict) -> MemoryControl:
+    """由 dump_control_tree 的结果重建内存控件树"""
+    if data.get('version') != CONTROL_TREE_VERSION:
+        raise ValueError(f"不支持的控件树版本: {data.get('version')}")
+    types = data['types']
+
+    def decode(fields: list) -> MemoryControl:
+        children = fields[2] if len(fields) > 2 else []
+        rect = fields[3] if len(fields) > 3 and fields[3] else None
+        runtime_id = tuple(fields[4]) if len(fields) > 4 and fields[4] else None
+        return MemoryControl(types[fields[0]], fields[1], [decode(child) for child in children],
+                             rect=MemoryRect(*rect) if rect else None, runtime_id=runtime_id)
+
+    return decode(data['root'])
+
+
+def save_control_tree(control, path: str) -> int:
+    """录制控件子树到文件（.gz 结尾时压缩），返回文件字节数"""
+    payload = json.dumps(dump_control_tree(control), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wb') as f:
+        f.write(payload)
+    return os.path.getsize(path)
+
+
+def load_control_tree(path: str) -> MemoryControl:
+    """从录制文件重建内存控件树，调用耗时由 MemoryControl.call_latency 控制"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return build_control_tree(json.loads(f.read().decode('utf-8')))
+
+
+class IncrementalListScanner:
+    """消息列表增量扫描器
+
+    从列表末尾向前遍历，遇到已处理过的列表项（按指纹判断）即停止，
+    没有新消息时只需读取最后一个子控件及其指纹。
+    取不到运行时ID时指纹改用列表项在列表中的序号 + 名称，同名的列表项不会被当作已处理。
+    """
+
+    def __init__(self, history_size: int = 2000):
+        self.history_size = history_size
+        self._seen = set()
+        self._order = deque()
+        # 最近一次扫描遍历的列表项数和控件接口调用次数
+        self.last_items_walked = 0
+        self.last_calls = 0
+        # 最近一次扫描是否因达到 limit 而跳过了更早的新列表项
+        self.last_truncated = False
+
+    def reset(self):
+        """清空已处理记录"""
+        self._seen.clear()
+        self._order.clear()
+
+    @staticmethod
+    def fingerprint(item) -> Tuple:
+        """列表项指纹：运行时ID + 名称（取不到运行时ID时为空元组）"""
+        try:
+            runtime_id = tuple(item.GetRuntimeId() or ())
+        except Exception:
+            runtime_id = ()
+        return runtime_id, item.Name
+
+    def _remember(self, fingerprint: Tuple):
+        self._seen.add(fingerprint)
+        self._order.append(fingerprint)
+        while len(self._order) > self.history_size:
+            self._seen.discard(self._order.popleft())
+
+    def scan(self, list_control, limit: int) -> List:
+        """返回新出现的列表项（按列表顺序），最多 limit 项"""
+        new_items = []
+        walked = 0
+        calls = 1
+        child_count = None
+
+        def item_fingerprint(item, position_from_end: int) -> Tuple:
+            nonlocal calls, child_count
+            # 运行时ID + 名称
+            calls += 2
+            fingerprint = self.fingerprint(item)
+            if fingerprint[0]:
+                return fingerprint
+            # 取不到运行时ID：按子控件总数换算列表项从头开始的序号（每次扫描最多统计一次）
+            if child_count is None:
+                child_count = len(list_control.GetChildren())
+                calls += 1 + child_count
+            return ('index', child_count - position_from_end), fingerprint[1]
+
+        item = list_control.GetLastChildControl()
+        while item is not None and len(new_items) < limit:
+            walked += 1
+            calls += 1
+            if item.ControlTypeName == 'ListItemControl':
+                fingerprint = item_fingerprint(item, walked)
+                if fingerprint in self._seen:
+                    item = None
+                    break
+                new_items.append((fingerprint, item))
+            calls += 1
+            item = item.GetPreviousSiblingControl()
+
+        # 达到 limit 后检查前面是否还有未处理的列表项
+        truncated = False
+        position = walked
+        while item is not None:
+            position += 1
+            calls += 1
+            if item.ControlTypeName == 'ListItemControl':
+                truncated = item_fingerprint(item, position) not in self._seen
+                break
+            calls += 1
+            item = item.GetPreviousSiblingControl()
+        self.last_items_walked = walked
+        self.last_calls = calls
+        self.last_truncated = truncated
+
+        new_items.reverse()
+        for fingerprint, _ in new_items:
+            self._remember(fingerprint)
+        return [item for _, item in new_items]
+
+
+class ListChangeEventSource(ABC):
+    """消息列表变化事件源
+
+    start(callback) 开始订阅，列表结构变化时以变化类型调用 callback（可能在其他线程中调用）。
+    """
+
+    @abstractmethod
+    def start(self, callback):
+        """开始订阅列表变化事件"""
+
+    def stop(self):
+        pass
+
+
+class SyntheticEventSource(ListChangeEventSource):
+    """手动触发的事件源，用于测试和基准测试"""
+
+    def __init__(self):
+        self._callback = None
+
+    def start(self, callback):
+        self._callback = callback
+
+    def stop(self):
+        self._callback = None
+
+    def fire(self, change_type: int = 0):
+        """触发一次列表变化事件"""
+        if self._callback:
+            self._callback(change_type)
+
+
+class UIAutomationEventSource(ListChangeEventSource):
+    """通过 UI Automation StructureChanged 事件订阅"消息"列表的变化
+
+    在独立线程中初始化COM、重新定位列表控件并注册事件处理器，
+    线程内循环处理窗口消息，以便STA下的COM回调能够送达。
+    """
+
+    # TreeScope_Element | TreeScope_Children
+    TREE_SCOPE = 1 | 2
+
+    def __init__(self, window_handle: int):
+        self.window_handle = window_handle
+        self._callback = None
+        self._running = False
+        self._thread = None
+
+    def start(self, callback):
+        self._callback = callback
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='uia-events', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        import comtypes
+
+        with automation.UIAutomationInitializerInThread():
+            try:
+                client = automation._AutomationClient.instance()
+                window = automation.ControlFromHandle(self.window_handle)
+                list_control = window.ListControl(searchDepth=10, Name="消息")
+                if not list_control.Exists(0):
+                    raise RuntimeError("支付消息列表不存在")
+
+                callback = self._callback
+
+                class StructureChangedHandler(comtypes.COMObject):
+                    _com_interfaces_ = [client.UIAutomationCore.IUIAutomationStructureChangedEventHandler]
+
+                    def HandleStructureChangedEvent(self, sender, change_type, runtime_id):
+                        callback(change_type)
+                        return 0
+
+                handler = StructureChangedHandler()
+                client.IUIAutomation.AddStructureChangedEventHandler(
+                    list_control.Element, self.TREE_SCOPE, None, handler)
+            except Exception as e:
+                logger.warning(f"订阅列表变化事件失败，仅使用兜底轮询: {str(e)}")
+                return
+
+            logger.info("已订阅支付消息列表变化事件")
+            try:
+                while self._running:
+                    win32gui.PumpWaitingMessages()
+                    time.sleep(0.05)
+            finally:
+                try:
+                    client.IUIAutomation.RemoveStructureChangedEventHandler(list_control.Element, handler)
+                except Exception as e:
+                    logger.error(f"取消列表变化事件订阅时出错: {str(e)}")
+
 
 class WeChatPaymentMonitor:
     """微信支付监控类"""
     
-    def __init__(self, db_name: str = None):
+    def __init__(self, db_name: str = None, wechat_window=None, payment_list=None,
+                 source_id: str = DEFAULT_SOURCE, install_handlers: bool = True):
         # 从环境变量获取配置，如果环境变量不存在则使用默认值
-        self.db_name = db_name or os.getenv('DB_NAME', 'wxpayments.db')
+        self.db_name = resolve_db_path(db_name)
+        # 支付记录来源标识（多窗口模式下区分微信窗口/账号）
+        self.source_id = source_id
         self.max_scroll_count = int(os.getenv('MAX_SCROLL_COUNT', '50'))
         self.first_run_limit = int(os.getenv('FIRST_RUN_LIMIT', '1000'))
         self.normal_run_limit = int(os.getenv('NORMAL_RUN_LIMIT', '10'))
         self.scroll_wheel_value = int(os.getenv('SCROLL_WHEEL_VALUE', '2000'))
         self.scroll_interval = float(os.getenv('SCROLL_INTERVAL', '0.1'))
         self.check_interval = int(os.getenv('CHECK_INTERVAL', '5'))
+        # 监控模式：poll 定时轮询；event 列表变化事件驱动，按 SAFETY_CHECK_INTERVAL 兜底轮询
+        self.monitor_mode = os.getenv('MONITOR_MODE', 'poll').lower()
+        self.safety_check_interval = int(os.getenv('SAFETY_CHECK_INTERVAL', '30'))
+        self.event_source = None
+        self._change_events = None
         # 运行标志
         self.running = True
-        # 窗口引用
-        self.wechat_window = self.get_wechat_window()
-        self.payment_list = self.get_payment_list()
-        
-        # 配置日志
-        self._setup_logger()
-        # 注册信号处理器
-        self._setup_signal_handlers()
+        # 窗口引用（可传入内存控件树替代真实窗口）
+        self.wechat_window = wechat_window or self.get_wechat_window()
+        self.payment_list = payment_list or self.get_payment_list()
+        # 增量扫描器，只读取新出现的列表项
+        self.scanner = IncrementalListScanner()
+        # 提取支付信息时的控件接口调用次数（用于扫描指标）
+        self.extract_calls = 0
+        
+        # 多窗口模式下的扫描线程由主线程统一配置日志和信号处理
+        if install_handlers:
+            # 配置日志
+            self._setup_logger()
+            # 注册信号处理器
+            self._setup_signal_handlers()
             
-    def _setup_logger(self):
+    @staticmethod
+    def _setup_logger():
         """配置日志"""
         logger.remove()
         logger.add(
@@ -362,57 +2563,75 @@ class WeChatPaymentMonitor:
         """检查窗口状态"""
         if not self.wechat_window or not self.wechat_window.Exists():
             logger.error("微信支付消息窗口已关闭")
+            HEALTH.record_windows(False, "微信支付消息窗口已关闭", source=self.source_id)
             self.running = False
             return False
             
         if not self.payment_list or not self.payment_list.Exists():
             logger.error("支付消息列表已关闭")
+            HEALTH.record_windows(False, "支付消息列表已关闭", source=self.source_id)
             self.running = False
             return False
             
+        HEALTH.record_windows(True, source=self.source_id)
         return True
 
-    def get_all_text_controls(self, control: automation.Control) -> List[automation.Control]:
-        """递归获取所有文本控件"""
-        text_controls = []
-        
-        if control.ControlTypeName == 'TextControl':
-            text_controls.append(control)
-        
-        for child in control.GetChildren():
-            text_controls.extend(self.get_all_text_controls(child))
-        
-        return text_controls
-        
+    def start_event_source(self, event_source: ListChangeEventSource = None):
+        """订阅列表变化事件（需在事件循环中调用）"""
+        loop = asyncio.get_running_loop()
+        self._change_events = asyncio.Queue()
+
+        def on_change(change_type):
+            loop.call_soon_threadsafe(self._change_events.put_nowait, change_type)
+
+        self.event_source = event_source or UIAutomationEventSource(self.wechat_window.NativeWindowHandle)
+        self.event_source.start(on_change)
+
+    def stop_event_source(self):
+        """取消列表变化事件订阅"""
+        if self.event_source:
+            self.event_source.stop()
+            self.event_source = None
+        self._change_events = None
+
+    async def wait_for_change(self):
+        """等待下一次扫描时机
+
+        已订阅事件时，收到列表变化事件立即返回（合并积压的事件），最长等待兜底轮询间隔；
+        否则按 check_interval 固定间隔轮询。
+        """
+        if self._change_events is None:
+            await asyncio.sleep(self.check_interval)
+            return
+
+        try:
+            await asyncio.wait_for(self._change_events.get(), self.safety_check_interval)
+        except asyncio.TimeoutError:
+            return
+        while not self._change_events.empty():
+            self._change_events.get_nowait()
+
+    def iter_control_nodes(self, control: automation.Control) -> Iterator[Tuple[str, Optional[str]]]:
+        """按前序深度优先迭代遍历控件树，每个节点产出一次 (控件类型, 名称)
+
+        每个节点只读取一次 ControlTypeName，只有文本控件才读取 Name（其他节点名称为 None）。
+        调用方停止迭代时即停止遍历。
+        """
+        stack = [control]
+        while stack:
+            node = stack.pop()
+            control_type = node.ControlTypeName
+            yield control_type, node.Name if control_type == 'TextControl' else None
+            children = node.GetChildren()
+            # 控件类型、子控件列表及逐个子控件各计一次，文本控件另读一次名称
+            self.extract_calls += 2 + len(children) + (control_type == 'TextControl')
+            children.reverse()
+            stack.extend(children)
+
     def extract_payment_info(self, list_item: automation.Control) -> Optional[Dict[str, str]]:
         """提取支付信息"""
         try:
-            text_controls = self.get_all_text_controls(list_item)
-            controls_dict = {}
-            
-            key_mapping = {
-                "收款金额": "amount",
-                "来自": "sender",
-                "付款方留言": "message",
-                "到账时间": "timestamp",
-                "备注": "remark"
-            }
-            
-            for i, control in enumerate(text_controls):
-                name = control.Name
-                if name in key_mapping:
-                    if i + 1 < len(text_controls):
-                        next_control = text_controls[i + 1]
-                        if next_control.ControlTypeName == 'TextControl':
-                            value = next_control.Name
-                            if key_mapping[name] == "amount":
-                                value = value.replace("￥", "")
-                            controls_dict[key_mapping[name]] = value
-
-            if all(key in controls_dict for key in ["amount", "sender", "timestamp"]):
-                return controls_dict
-            return None
-            
+            return parse_payment_texts(self.iter_control_nodes(list_item))
         except Exception as e:
             logger.error(f"提取支付信息时出错: {str(e)}")
             return None
@@ -425,6 +2644,10 @@ class WeChatPaymentMonitor:
         no_change_count = 0
         
         try:
+            if win32api is None:
+                logger.warning("当前环境不支持滚动加载")
+                return
+
             # 确保微信窗口处于活动状态
             if not self.wechat_window.Exists():
                 logger.error("微信窗口不存在")
@@ -496,307 +2719,1264 @@ class WeChatPaymentMonitor:
         finally:
             # 恢复鼠标位置
             try:
-                win32api.SetCursorPos(original_pos)
-            except:
+                win32api.SetCursorPos(original_pos)
+            except:
+                pass
+        
+    def get_all_payment_records(self, is_first_run: bool = False) -> List[Dict[str, str]]:
+        """获取所有支付记录（增量扫描，只提取新出现的列表项）"""
+        start_time = time.time()
+        new_payments = []
+        
+        try:
+            if is_first_run:
+                self.scroll_to_load_more(self.payment_list)
+                self.scanner.reset()
+                limit = self.first_run_limit
+            else:
+                # 一直向前遍历到已处理的列表项：新列表项超过 NORMAL_RUN_LIMIT 时不能只取最新的几条，
+                # 否则更早的新列表项会排在已处理的列表项之后，再也不会被扫描到
+                limit = max(self.normal_run_limit, self.first_run_limit)
+
+            scan_started = time.perf_counter()
+            self.extract_calls = 0
+            items = self.scanner.scan(self.payment_list, limit)
+            if not is_first_run and len(items) > self.normal_run_limit:
+                logger.warning(f"单次扫描新列表项 {len(items)} 条，超过 NORMAL_RUN_LIMIT={self.normal_run_limit}")
+            for item in items:
+                info = self.extract_payment_info(item)
+                if info:
+                    # 端到端追踪的起点
+                    info['detected_at'] = time.time()
+                    info['source'] = self.source_id
+                    if is_first_run:
+                        # 首次扫描读到的是窗口中已有的历史记录
+                        info['backfill'] = True
+                    new_payments.append(info)
+                else:
+                    EXTRACT_FAILURES.inc()
+            scan_seconds = time.perf_counter() - scan_started
+            SCAN_SECONDS.observe(scan_seconds)
+            SCAN_ITEMS.observe(self.scanner.last_items_walked)
+            SCAN_COM_CALLS.observe(self.scanner.last_calls + self.extract_calls)
+            HEALTH.record_scan(scan_seconds, self.scanner.last_items_walked, source=self.source_id)
+            if self.scanner.last_truncated and not is_first_run:
+                logger.warning(f"新列表项超过单次扫描上限 {limit}（FIRST_RUN_LIMIT），更早的新列表项未处理")
+                    
+            return new_payments
+            
+        except Exception as e:
+            logger.error(f"获取支付记录时出错: {str(e)}")
+            HEALTH.record_scan_error(str(e), source=self.source_id)
+            return []
+        finally:
+            end_time = time.time()
+            elapsed_time = end_time - start_time
+            if len(new_payments) > 0:
+                logger.info(f"获取支付记录耗时: {elapsed_time:.2f} 秒，获取到 {len(new_payments)} 条新记录")
+
+class WindowSource(ABC):
+    """一个微信支付窗口（来源）
+
+    open() 在扫描线程中调用，返回 (窗口控件, 支付消息列表控件)；COM 对象需在使用它的线程中获取。
+    """
+
+    def __init__(self, source_id: str):
+        self.source_id = source_id
+
+    @abstractmethod
+    def open(self):
+        """定位窗口，返回 (窗口控件, 支付消息列表控件)"""
+
+    def event_source(self) -> Optional[ListChangeEventSource]:
+        """列表变化事件源，不支持事件订阅时返回 None"""
+        return None
+
+
+class UIAutomationWindowSource(WindowSource):
+    """按窗口句柄在扫描线程中重新定位的微信窗口"""
+
+    def __init__(self, source_id: str, window_handle: int):
+        super().__init__(source_id)
+        self.window_handle = window_handle
+
+    def open(self):
+        window = automation.ControlFromHandle(self.window_handle)
+        if not window or not window.Exists(0):
+            raise RuntimeError("微信窗口不存在")
+        list_control = window.ListControl(searchDepth=10, Name="消息")
+        if not list_control.Exists(0):
+            raise RuntimeError("支付消息列表不存在")
+        return window, list_control
+
+    def event_source(self) -> Optional[ListChangeEventSource]:
+        return UIAutomationEventSource(self.window_handle)
+
+
+class MemoryWindowSource(WindowSource):
+    """内存控件树来源，用于在非Windows环境下模拟多个微信窗口"""
+
+    def __init__(self, source_id: str, window, payment_list, events: ListChangeEventSource = None):
+        super().__init__(source_id)
+        self.window = window
+        self.payment_list = payment_list
+        self.events = events
+
+    def open(self):
+        return self.window, self.payment_list
+
+    def event_source(self) -> Optional[ListChangeEventSource]:
+        return self.events
+
+
+def parse_source_names(value: str) -> Dict[str, str]:
+    """解析 SOURCE_NAMES（逗号分隔的 来源名称=窗口标题），返回 {窗口标题: 来源名称}"""
+    names = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        name, separator, title = entry.partition('=')
+        if not separator or not name.strip() or not title.strip():
+            raise ValueError(f"SOURCE_NAMES 格式错误（应为 来源名称=窗口标题）: {entry.strip()}")
+        names[title.strip()] = name.strip()
+    return names
+
+
+def name_window_sources(windows: List[Tuple[str, int, int]], names: Dict[str, str]) -> List[Tuple[str, int]]:
+    """为窗口分配来源名称，windows 为 [(窗口标题, 进程ID, 窗口句柄)]，返回 [(来源名称, 窗口句柄)]
+
+    来源名称是去重键的一部分，必须在微信重启后保持不变：按 names 中窗口标题对应的名称命名，
+    未配置时只有一个窗口则为 default（与单窗口模式一致），否则使用窗口标题；
+    标题相同且未配置名称的窗口无法稳定区分，只能按进程ID顺序加序号，并给出警告。
+    """
+    if len(windows) == 1 and windows[0][0] not in names:
+        return [(DEFAULT_SOURCE, windows[0][2])]
+    by_title: Dict[str, List[Tuple[str, int, int]]] = {}
+    for window in sorted(windows, key=lambda window: window[1]):
+        by_title.setdefault(window[0], []).append(window)
+    sources = []
+    for title, group in by_title.items():
+        name = names.get(title, title)
+        if len(group) == 1:
+            sources.append((name, group[0][2]))
+            continue
+        logger.warning(f"有 {len(group)} 个微信窗口标题相同（{title}），来源名称按进程启动顺序编号，"
+                       f"微信重启后可能互换")
+        sources.extend((f"{name}#{index}", window[2]) for index, window in enumerate(group, 1))
+    return sources
+
+
+def discover_wechat_windows(names: Dict[str, str] = None) -> List[WindowSource]:
+    """查找所有顶层微信聊天窗口（ChatWnd），按窗口标题命名来源（见 name_window_sources）
+
+    names 为 {窗口标题: 来源名称}（默认取 SOURCE_NAMES）；设置 SOURCE_WINDOW_NAME 时只保留标题一致的窗口。
+    """
+    if automation is None:
+        logger.error("当前环境不支持查找微信窗口")
+        return []
+    if names is None:
+        names = parse_source_names(os.getenv('SOURCE_NAMES', ''))
+    title = os.getenv('SOURCE_WINDOW_NAME', '')
+    windows = [(control.Name, control.ProcessId, control.NativeWindowHandle)
+               for control in automation.GetRootControl().GetChildren()
+               if control.ClassName == 'ChatWnd' and (not title or control.Name == title)]
+    return [UIAutomationWindowSource(source_id, window_handle)
+            for source_id, window_handle in name_window_sources(windows, names)]
+
+
+class SourceScanner(threading.Thread):
+    """单个来源的扫描线程
+
+    线程内初始化COM并打开窗口，按轮询间隔（或列表变化事件）增量扫描，
+    新支付记录交给事件循环中的共享入库队列，由通知服务统一入库和通知。
+    """
+
+    # 首次运行的滚动加载需要激活窗口并移动鼠标，多个窗口之间不能同时进行
+    foreground_lock = threading.Lock()
+
+    def __init__(self, source: WindowSource, loop: asyncio.AbstractEventLoop, ingest_queue: asyncio.Queue,
+                 db_name: str = None):
+        super().__init__(name=f'scanner-{source.source_id}', daemon=True)
+        self.source = source
+        self.loop = loop
+        self.ingest_queue = ingest_queue
+        self.db_name = db_name
+        self.monitor = None
+        self._wake = threading.Event()
+        self._stopping = False
+
+    def stop(self):
+        """停止扫描（当前扫描结束后退出）"""
+        self._stopping = True
+        self._wake.set()
+        if self.monitor:
+            self.monitor.running = False
+
+    def run(self):
+        initializer = automation.UIAutomationInitializerInThread() if automation is not None else nullcontext()
+        with initializer:
+            try:
+                window, payment_list = self.source.open()
+            except Exception as e:
+                logger.error(f"[{self.source.source_id}] 打开微信窗口失败: {str(e)}")
+                HEALTH.record_windows(False, str(e), source=self.source.source_id)
+                return
+            self.monitor = WeChatPaymentMonitor(self.db_name, window, payment_list,
+                                                source_id=self.source.source_id, install_handlers=False)
+            event_source = None
+            if self.monitor.monitor_mode == 'event':
+                event_source = self.source.event_source()
+                if event_source is not None:
+                    event_source.start(lambda change_type: self._wake.set())
+            interval = self.monitor.safety_check_interval if event_source else self.monitor.check_interval
+            logger.info(f"[{self.source.source_id}] 开始监控")
+            try:
+                is_first_run = True
+                while not self._stopping and self.monitor.running:
+                    if not self.monitor.check_windows():
+                        break
+                    with self.foreground_lock if is_first_run else nullcontext():
+                        payments = self.monitor.get_all_payment_records(is_first_run)
+                    is_first_run = False
+                    if payments:
+                        # 入库队列属于事件循环，等待放入完成以保持背压
+                        asyncio.run_coroutine_threadsafe(self._publish(payments), self.loop).result()
+                    self._wake.wait(interval)
+                    self._wake.clear()
+            except Exception as e:
+                logger.error(f"[{self.source.source_id}] 扫描线程异常退出: {str(e)}")
+                HEALTH.record_scan_error(str(e), source=self.source.source_id)
+            finally:
+                if event_source is not None:
+                    event_source.stop()
+                logger.info(f"[{self.source.source_id}] 停止监控")
+
+    async def _publish(self, payments: List[Dict[str, str]]):
+        for payment in payments:
+            await self.ingest_queue.put(payment)
+
+
+class MultiSourceMonitor:
+    """多窗口监控：每个来源一个扫描线程，共用入库队列、数据库、通知服务和API"""
+
+    def __init__(self, discover=None, db_name: str = None, install_handlers: bool = True):
+        # discover() 返回 WindowSource 列表，测试时可传入内存窗口
+        self.discover = discover or discover_wechat_windows
+        self.db_name = db_name
+        self.scanners: List[SourceScanner] = []
+        self.running = True
+        if install_handlers:
+            WeChatPaymentMonitor._setup_logger()
+            self._setup_signal_handlers()
+
+    def _setup_signal_handlers(self):
+        """设置信号处理器（与单窗口模式一致，收到退出信号时直接结束进程）"""
+        def handler(*args):
+            logger.info("正在退出，请稍候...")
+            self.running = False
+            os._exit(0)
+            return True
+
+        if sys.platform == 'win32':
+            win32api.SetConsoleCtrlHandler(handler, True)
+        else:
+            signal.signal(signal.SIGINT, handler)
+            signal.signal(signal.SIGTERM, handler)
+
+    def start(self, loop: asyncio.AbstractEventLoop, ingest_queue: asyncio.Queue) -> int:
+        """查找窗口并启动扫描线程，返回来源数"""
+        sources = self.discover()
+        seen = set()
+        for source in sources:
+            if source.source_id in seen:
+                logger.error(f"来源名称重复，已忽略: {source.source_id}")
+                continue
+            seen.add(source.source_id)
+            scanner = SourceScanner(source, loop, ingest_queue, self.db_name)
+            scanner.start()
+            self.scanners.append(scanner)
+        logger.info(f"多窗口模式: {len(self.scanners)} 个来源 {', '.join(sorted(seen))}")
+        return len(self.scanners)
+
+    def alive(self) -> int:
+        """仍在运行的扫描线程数"""
+        return sum(1 for scanner in self.scanners if scanner.is_alive())
+
+    async def wait(self, interval: float = 1):
+        """等待到停止或全部扫描线程退出（单个窗口关闭时其余来源继续运行）"""
+        while self.running:
+            if not self.alive():
+                logger.error("所有来源的扫描线程均已退出，程序将退出")
+                break
+            await asyncio.sleep(interval)
+
+    def stop(self, timeout: float = 5):
+        """停止全部扫描线程"""
+        self.running = False
+        for scanner in self.scanners:
+            scanner.stop()
+        deadline = time.monotonic() + timeout
+        for scanner in self.scanners:
+            scanner.join(max(deadline - time.monotonic(), 0))
+
+
+class RetryScheduler:
+    """通知任务调度器
+
+    按到期时间（时间戳）维护最小堆，等待时精确休眠到最早到期的任务，新任务加入时立即唤醒。
+    同一支付记录在等待或处理中只会存在一份：处理中的记录不会被重复调度，
+    处理完成后通过 complete() 释放并按需安排下次重试。
+    """
+
+    def __init__(self, max_batch: int = 500):
+        self.max_batch = max_batch
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+        self._in_flight = set()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._due)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def schedule(self, payment_id: int, due: float) -> bool:
+        """安排任务在 due 时刻执行，已在处理中或已有更早的安排时忽略"""
+        if payment_id in self._in_flight:
+            return False
+        current = self._due.get(payment_id)
+        if current is not None and current <= due:
+            return False
+        self._due[payment_id] = due
+        heapq.heappush(self._heap, (due, payment_id))
+        self._wakeup.set()
+        return True
+
+    def claim(self, payment_id: int) -> bool:
+        """不经过任务堆直接标记为处理中（新任务直接放入通知队列时使用），已在等待或处理中时返回 False"""
+        if payment_id in self._in_flight or payment_id in self._due:
+            return False
+        self._in_flight.add(payment_id)
+        return True
+
+    def complete(self, payment_id: int, next_due: float = None):
+        """任务处理完成，next_due 不为空时安排下次重试"""
+        self._in_flight.discard(payment_id)
+        if next_due is not None:
+            self.schedule(payment_id, next_due)
+
+    def _peek(self) -> Optional[float]:
+        # 丢弃已被更早安排覆盖的过期堆项
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    async def wait_due(self) -> List[int]:
+        """等待至少一个任务到期，返回已到期的支付记录id并标记为处理中"""
+        while True:
+            self._wakeup.clear()
+            due = self._peek()
+            now = time.time()
+            if due is not None and due <= now:
+                payment_ids = []
+                while len(payment_ids) < self.max_batch and due is not None and due <= now:
+                    _, payment_id = heapq.heappop(self._heap)
+                    del self._due[payment_id]
+                    self._in_flight.add(payment_id)
+                    payment_ids.append(payment_id)
+                    due = self._peek()
+                return payment_ids
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), None if due is None else due - now)
+            except asyncio.TimeoutError:
                 pass
+
+
+class CircuitBreaker:
+    """通知接口熔断器
+
+    连续失败达到 failure_threshold 次后打开，打开期间不发送请求；经过 reset_timeout 秒后进入半开状态，
+    只放行一个探测请求，探测成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        """是否允许发送请求（半开状态下只放行一个探测请求）"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def retry_after(self) -> float:
+        """距离下次允许探测的秒数"""
+        if self.state == self.OPEN:
+            return max(1.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        return 1.0
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("通知接口已恢复，熔断关闭")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+            logger.warning(f"通知接口连续失败 {self.failures} 次，熔断打开，{self.reset_timeout:.0f}秒后尝试恢复")
+
+
+class AdaptiveConcurrency:
+    """通知并发数自适应（AIMD）
+
+    请求成功且耗时低于 latency_target 时缓慢增加并发上限（每轮加一），
+    失败或超过目标耗时时减半，减半之间至少间隔 latency_target 秒。
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, latency_target: float = 2.0):
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.latency_target = latency_target
+        self.limit = float(maximum)
+        self.in_use = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_use < int(self.limit))
+            self.in_use += 1
+
+    async def cancel(self):
+        """归还未使用的并发名额（未发出请求，不调整并发上限）"""
+        async with self._condition:
+            self.in_use -= 1
+            self._condition.notify_all()
+
+    async def release(self, latency: float, ok: bool):
+        async with self._condition:
+            self.in_use -= 1
+            if ok and latency <= self.latency_target:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.latency_target:
+                    self._last_decrease = now
+                    self.limit = max(self.minimum, self.limit / 2)
+            self._condition.notify_all()
+
+
+NOTIFY_TARGET_FIELDS = ('name', 'url', 'key', 'concurrency', 'batch', 'limit_per_host')
+
+
+def load_notify_targets() -> List[Dict]:
+    """读取通知目标配置
+    
+    NOTIFY_TARGETS 为JSON数组，每项包含 name、url、key，可选 concurrency、batch、limit_per_host；
+    未配置时使用 NOTIFY_URL/NOTIFY_KEY 作为名为 default 的单个目标，都未配置时返回空列表。
+    """
+    raw = os.getenv('NOTIFY_TARGETS', '').strip()
+    if raw:
+        targets = json.loads(raw)
+        if not isinstance(targets, list):
+            raise ValueError("NOTIFY_TARGETS 必须是JSON数组")
+        names = set()
+        for target in targets:
+            if not isinstance(target, dict):
+                raise ValueError(f"NOTIFY_TARGETS 中的目标必须是JSON对象: {target!r}")
+            unknown = sorted(set(target) - set(NOTIFY_TARGET_FIELDS))
+            if unknown:
+                raise ValueError(f"NOTIFY_TARGETS 中的目标包含未知字段: {', '.join(unknown)}"
+                                 f"（可用字段: {', '.join(NOTIFY_TARGET_FIELDS)}）")
+            if not target.get('name') or not target.get('url') or not target.get('key'):
+                raise ValueError("NOTIFY_TARGETS 中每个目标都必须配置 name、url 和 key")
+            if target['name'] in names:
+                raise ValueError(f"NOTIFY_TARGETS 中目标名称重复: {target['name']}")
+            names.add(target['name'])
+        return targets
         
-    def get_all_payment_records(self, is_first_run: bool = False) -> List[Dict[str, str]]:
-        """获取所有支付记录"""
-        start_time = time.time()
-        payments = []
-        new_payments = []
+    notify_url = os.getenv('NOTIFY_URL')
+    notify_key = os.getenv('NOTIFY_KEY')
+    if not notify_url or not notify_key:
+        return []
+    return [{'name': 'default', 'url': notify_url, 'key': notify_key,
+             'concurrency': int(os.getenv('NOTIFY_CONCURRENCY', 10))}]
         
-        if not hasattr(self, 'previous_records'):
-            self.previous_records = []
+
+class NotifyTarget:
+    """通知目标
+
+    每个目标有独立的通知队列、重试调度器、熔断器、并发限制和HTTP连接池，一个目标变慢或故障不会影响其他目标。
+    """
+
+    def __init__(self, name: str, url: str, key: str, concurrency: int = 10, batch: bool = None,
+                 limit_per_host: int = None):
+        self.name = name
+        self.url = url
+        self.key = key
+        # 并发上限
+        self.concurrency = concurrency
+
+        # 独立的HTTP会话（在 PaymentNotifier.start() 中创建），同一主机上的多个目标不共用连接数上限
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.limit_per_host = limit_per_host or int(os.getenv('NOTIFY_LIMIT_PER_HOST', concurrency))
+
+        # 通知队列（有界，队列满时调度器等待工作协程消费）
+        self.notify_queue = asyncio.Queue(maxsize=int(os.getenv('NOTIFY_QUEUE_SIZE', concurrency * 4)))
         
-        try:
-            list_items = [item for item in self.payment_list.GetChildren() 
-                         if item.ControlTypeName == 'ListItemControl']
-            
-            if is_first_run:
-                self.scroll_to_load_more(self.payment_list)
-                list_items = [item for item in self.payment_list.GetChildren() 
-                             if item.ControlTypeName == 'ListItemControl']
-                list_items = list_items[-self.first_run_limit:]
-            else:
-                list_items = list_items[-self.normal_run_limit:]
+        # 按下次通知时间调度的任务堆，每批最多取出一个队列容量的到期任务
+        self.retry_scheduler = RetryScheduler(max_batch=self.notify_queue.maxsize)
+        
+        # 最近的入队到发起通知请求的等待时间（秒）
+        self.dispatch_latencies = deque(maxlen=1000)
+
+        # 交给调度器的首次通知的追踪时间 {投递记录id: 追踪}，出队时取回
+        self.pending_traces: Dict[int, Dict[str, float]] = {}
+
+        # 连续写入通知状态失败的次数，用于计算重新调度的退避时间
+        self.status_write_failures = 0
+
+        # 熔断与自适应并发
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv('NOTIFY_BREAKER_THRESHOLD', 5)),
+            reset_timeout=float(os.getenv('NOTIFY_BREAKER_RESET', 30))
+        )
+        self.concurrency_limiter = AdaptiveConcurrency(
+            concurrency,
+            minimum=int(os.getenv('NOTIFY_MIN_CONCURRENCY', 1)),
+            latency_target=int(os.getenv('NOTIFY_LATENCY_TARGET_MS', 2000)) / 1000
+        )
+        
+        # 批量通知模式：在窗口期内收集最多 batch_max_items 条通知，合并为一次JSON请求
+        if batch is None:
+            batch = os.getenv('NOTIFY_BATCH_MODE', 'false').lower() == 'true'
+        self.batch_mode = batch
+        self.batch_max_items = int(os.getenv('NOTIFY_BATCH_MAX_ITEMS', 50))
+        self.batch_window = int(os.getenv('NOTIFY_BATCH_WINDOW_MS', 100)) / 1000
         
-            for item in list_items:
-                info = self.extract_payment_info(item)
-                if info:
-                    payments.append(info)
-            
-            # 只返回新的记录
-            if not is_first_run:
-                new_payments = [p for p in payments if p not in self.previous_records]
-            else:
-                new_payments = payments
-                
-            self.previous_records = payments
-                    
-            return new_payments
-            
-        except Exception as e:
-            logger.error(f"获取支付记录时出错: {str(e)}")
-            return []
-        finally:
-            end_time = time.time()
-            elapsed_time = end_time - start_time
-            if len(new_payments) > 0:
-                logger.info(f"获取支付记录耗时: {elapsed_time:.2f} 秒，获取到 {len(new_payments)} 条新记录")
 
 class PaymentNotifier:
     """支付通知类"""
-    
-    def __init__(self, notify_url: str, notify_key: str, db_name: str = None, max_retry: int = 7, concurrency: int = 10):
-        self.notify_url = notify_url
-        self.notify_key = notify_key
-        self.db_name = db_name or os.getenv('DB_NAME', 'wxpayments.db')
+
+    def __init__(self, notify_url: str, notify_key: str, db_name: str = None, max_retry: int = 7, concurrency: int = 10,
+                 targets: List[Dict] = None):
+        self.db_name = resolve_db_path(db_name)
+        self.db = SQLitePool.get(self.db_name)
+        # 单写线程执行器，数据库I/O不在事件循环中执行
+        self.db_executor = DatabaseExecutor(self.db_name)
         self.max_retry = max_retry
-        self.concurrency = concurrency  # 增加并发数
         self.running = True
         self.task_counter = 0
-        self.loader_interval = 1  # 加载器检查间隔（秒）
-        
+
         # 重试时间间隔配置（单位：秒）
         self.retry_intervals = [0, 10, 60, 120, 3600, 7200, 21600, 54000]
+
+        # 通知目标，未指定时使用 notify_url/notify_key 作为单个 default 目标
+        if targets is None:
+            targets = [{'name': 'default', 'url': notify_url, 'key': notify_key, 'concurrency': concurrency}]
+        self.targets: Dict[str, NotifyTarget] = {target['name']: NotifyTarget(**target) for target in targets}
+        # payments 表中的 notify_* 字段保留第一个目标的通知状态（兼容查询接口）
+        self.primary_target = targets[0]['name'] if targets else None
+
+        # HTTP连接配置（每个目标一个会话，在 start() 中创建）
+        self.dns_cache_ttl = int(os.getenv('NOTIFY_DNS_CACHE_TTL', 300))
+        self.keepalive_timeout = float(os.getenv('NOTIFY_KEEPALIVE_TIMEOUT', 30))
+        self.connect_timeout = float(os.getenv('NOTIFY_CONNECT_TIMEOUT', 5))
+        self.read_timeout = float(os.getenv('NOTIFY_READ_TIMEOUT', 10))
+        # 连接统计：新建连接数（含TLS握手）、复用连接数、建连总耗时
+        self._connection_stats = {
+            'requests': 0,
+            'new_connections': 0,
+            'reused_connections': 0,
+            'connect_seconds': 0.0,
+            'dns_lookups': 0,
+            'dns_cache_hits': 0
+        }
+        
+        # 待入库的支付记录队列（由监控循环写入）
+        self.ingest_queue = asyncio.Queue()
         
-        # 创建通知队列
-        self.notify_queue = asyncio.Queue()
+        # 新支付入库回调
+        self.payment_listeners = []
         
         # 初始化数据库
         self._init_database()
         
     def _init_database(self):
-        """初始化数据库"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        # 创建完整的表结构
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            amount TEXT NOT NULL,
-            sender TEXT NOT NULL,
-            message TEXT,
-            timestamp TEXT NOT NULL,
-            remark TEXT,
-            created_at TEXT NOT NULL,
-            notify_status INTEGER DEFAULT 0,
-            notify_retry_count INTEGER DEFAULT 0,
-            notify_url TEXT,
-            notify_response TEXT,
-            notify_time TEXT,
-            next_retry_time TEXT,
-            UNIQUE(amount, sender, timestamp)
-        )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """初始化数据库（执行未完成的结构迁移）并补齐当前通知目标的投递记录"""
+        with self.db.connection() as conn:
+            migrate_database(conn)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._sync_deliveries(conn)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _sync_deliveries(self, conn: sqlite3.Connection):
+        """按当前配置的通知目标补齐投递记录
+
+        旧版数据迁移时投递记录都归到 default 目标，未配置该目标时改归第一个目标（保留原通知状态）；
+        此后对没有任何投递记录的支付（未配置目标时入库）为每个目标补建待通知记录。
+        新增目标只通知此后入库的支付，不向新目标补发历史支付。
+        """
+        if not self.targets:
+            return
+        if 'default' not in self.targets:
+            remapped = conn.execute('''
+            UPDATE OR IGNORE deliveries SET target = ? WHERE target = 'default'
+            ''', (self.primary_target,)).rowcount
+            if remapped:
+                logger.info(f"旧版投递记录已归入通知目标 {self.primary_target}: {remapped} 条")
+        payment_ids = [row[0] for row in conn.execute('''
+        SELECT p.id FROM payments p WHERE NOT EXISTS (SELECT 1 FROM deliveries d WHERE d.payment_id = p.id)
+        ''')]
+        if not payment_ids:
+            return
+        now_epoch = int(time.time())
+        for target_name in self.targets:
+            conn.executemany('''
+            INSERT OR IGNORE INTO deliveries (payment_id, target, status, retry_count, next_retry_epoch, created_epoch)
+            VALUES (?, ?, 0, 0, 0, ?)
+            ''', [(payment_id, target_name, now_epoch) for payment_id in payment_ids])
+        logger.info(f"未通知的支付补建投递记录: {len(payment_ids)} 条 x {len(self.targets)} 个目标")
         
+    def queue_depths(self) -> List[Tuple[Dict[str, str], int]]:
+        """各队列当前长度（队列长度指标在输出时读取）"""
+        depths = [({'queue': 'ingest', 'target': ''}, self.ingest_queue.qsize())]
+        for target in self.targets.values():
+            depths.append(({'queue': 'notify', 'target': target.name}, target.notify_queue.qsize()))
+            depths.append(({'queue': 'scheduled', 'target': target.name}, len(target.retry_scheduler)))
+        return depths
+
+    def add_payment_listener(self, callback):
+        """注册新支付入库回调，callback(payment_data)"""
+        self.payment_listeners.append(callback)
+
+    def _emit_new_payment(self, payment_data: Dict[str, str]):
+        """通知所有新支付回调"""
+        for callback in self.payment_listeners:
+            try:
+                callback(payment_data)
+            except Exception as e:
+                logger.error(f"执行新支付回调时出错: {str(e)}")
+
     async def task_loader(self):
-        """定期加载待处理通知的任务加载器"""
+        """通知任务调度器：每个通知目标一个调度协程"""
+        await asyncio.gather(*(self._target_loader(target) for target in self.targets.values()))
+
+    async def _target_loader(self, target: NotifyTarget):
+        """单个目标的通知任务调度
+
+        启动时从数据库加载一次待通知记录，之后按重试时间休眠到下一条到期，不再定期查询数据库。
+        """
+        await self.load_pending_notifications(target)
         while self.running:
+            delivery_ids = await target.retry_scheduler.wait_due()
             try:
-                await self.load_pending_notifications()
-                await asyncio.sleep(self.loader_interval)
+                await self._dispatch_due(target, delivery_ids)
             except Exception as e:
-                logger.error(f"任务加载器异常: {str(e)}")
-                await asyncio.sleep(self.loader_interval)
+                logger.error(f"任务加载器异常: {target.name} => {str(e)}")
+                # 读取失败的任务稍后重新调度
+                for delivery_id in delivery_ids:
+                    target.retry_scheduler.complete(delivery_id, time.time() + self.retry_intervals[1])
 
-    async def load_pending_notifications(self):
-        """加载待处理的通知记录到队列"""
+    async def load_pending_notifications(self, target: NotifyTarget):
+        """加载目标所有待处理的通知记录到调度器"""
         try:
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            
-            current_time = datetime.now()
-            # 获取所有未通知或通知失败的记录，并且重试时间已到
-            cursor.execute('''
-            SELECT amount, sender, message, timestamp, remark, notify_retry_count, notify_time
-            FROM payments
-            WHERE (notify_status = 0 OR notify_status = 2)
-            AND notify_retry_count < ?
-            AND (
-                next_retry_time IS NULL 
-                OR datetime(next_retry_time) <= datetime(?)
+            # 获取所有未通知或通知失败且未超过重试次数的记录（使用待通知部分索引）
+            pending_deliveries = await self.db_executor.read(
+                lambda conn: conn.execute('''
+                SELECT id, next_retry_epoch
+                FROM deliveries
+                WHERE target = ?
+                AND status IN (0, 2)
+                AND retry_count < ?
+                ''', (target.name, self.max_retry)).fetchall()
             )
-            ORDER BY created_at ASC
-            LIMIT ?
-            ''', (self.max_retry, current_time.strftime('%Y-%m-%d %H:%M:%S'), self.concurrency * 2))
             
-            pending_payments = cursor.fetchall()
-            count = 0
-            
-            for payment in pending_payments:
-                payment_dict = {
-                    'amount': payment[0],
-                    'sender': payment[1],
-                    'message': payment[2],
-                    'timestamp': payment[3],
-                    'remark': payment[4]
-                }
-                # 添加到通知队列
-                await self.schedule_task(payment_dict, payment[5])
-                count += 1
+            for delivery in pending_deliveries:
+                target.retry_scheduler.schedule(delivery['id'], delivery['next_retry_epoch'] or 0)
                 
-            if count > 0:
-                logger.info(f"已加载 {count} 条待处理的通知记录")
+            if pending_deliveries:
+                logger.info(f"已加载 {len(pending_deliveries)} 条待处理的通知记录: {target.name}")
                     
         except Exception as e:
             logger.error(f"加载待处理通知时出错: {str(e)}")
-        finally:
-            conn.close()
 
-    async def process_new_payment(self, payment_data: Dict[str, str]):
-        """处理新的支付记录"""
+    async def _dispatch_due(self, target: NotifyTarget, delivery_ids: List[int]):
+        """读取到期的投递记录及其支付记录并放入目标的通知队列"""
+        def fetch(conn):
+            rows = []
+            for i in range(0, len(delivery_ids), 500):
+                chunk = delivery_ids[i:i + 500]
+                rows.extend(conn.execute(f'''
+                SELECT d.id AS delivery_id, d.status, d.retry_count, d.trace,
+                       p.id, p.amount, p.sender, p.message, p.timestamp, p.remark, p.source
+                FROM deliveries d JOIN payments p ON p.id = d.payment_id
+                WHERE d.id IN ({','.join('?' * len(chunk))})
+                ''', chunk).fetchall())
+            return rows
+
+        rows = {row['delivery_id']: row for row in await self.db_executor.read(fetch)}
+        for delivery_id in delivery_ids:
+            delivery = rows.get(delivery_id)
+            if (delivery is None or delivery['status'] not in (0, 2)
+                    or delivery['retry_count'] >= self.max_retry):
+                target.retry_scheduler.complete(delivery_id)
+                target.pending_traces.pop(delivery_id, None)
+                continue
+            payment_dict = {
+                'id': delivery['id'],
+                'delivery_id': delivery_id,
+                'amount': delivery['amount'],
+                'sender': delivery['sender'],
+                'message': delivery['message'],
+                'timestamp': delivery['timestamp'],
+                'remark': delivery['remark'],
+                'source': delivery['source']
+            }
+            # 首次通知的追踪在内存中；重试（含重启后）从投递记录还原，本次发送和确认时间覆盖上次尝试的记录
+            trace = target.pending_traces.pop(delivery_id, None)
+            if trace is None and delivery['trace']:
+                trace = decode_trace(delivery['trace'])
+                for stage in ('dequeued', 'sent', 'acked'):
+                    trace.pop(stage, None)
+            if trace:
+                payment_dict['trace'] = trace
+            # 添加到通知队列
+            await self.schedule_task(target, payment_dict, delivery['retry_count'])
+
+    @staticmethod
+    def _insert_payments(conn: sqlite3.Connection, payments: List[Dict[str, str]],
+                         target_names: List[str]) -> Tuple[List[Dict[str, str]], List[Tuple[str, int, int]]]:
+        """批量插入支付记录（已存在的记录由唯一约束忽略）及每个通知目标的投递记录
+
+        支付记录与投递记录（发件箱）在同一事务中写入，只有本事务新插入的支付才会产生投递记录。
+        首次扫描补录的记录（backfill）如果已以其他来源入库，说明来源名称发生了变化（如单窗口切换为多窗口），
+        按重复记录忽略，不会再次通知。
+        返回 (新插入的支付记录, [(目标名称, 投递记录id, 支付记录id)])。
+        """
+        payments = [payment_data for payment_data in payments
+                    if not (payment_data.get('backfill') and PaymentNotifier._stored_under_other_source(conn, payment_data))]
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM payments').fetchone()[0]
+        current_time = datetime.now()
+        now = current_time.strftime('%Y-%m-%d %H:%M:%S')
+        now_epoch = int(current_time.timestamp())
+        conn.executemany('''
+        INSERT OR IGNORE INTO payments (
+            amount, sender, message, timestamp, remark, 
+            created_at, notify_status, notify_retry_count, next_retry_time,
+            amount_cents, ts_epoch, created_epoch, next_retry_epoch, source
+        ) VALUES (?, ?, ?, ?, ?, ?, 0, 0, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            payment_data['amount'],
+            payment_data['sender'],
+            payment_data.get('message', ''),
+            payment_data['timestamp'],
+            payment_data.get('remark', ''),
+            now,
+            now,
+            parse_amount_cents(payment_data['amount']),
+            parse_timestamp_epoch(payment_data['timestamp']),
+            now_epoch,
+            now_epoch,
+            payment_data.get('source', DEFAULT_SOURCE)
+        ) for payment_data in payments])
+        # 单写线程执行，本事务之后的新id即为本批次插入的记录
+        rows = conn.execute('''
+        SELECT id, amount, sender, message, timestamp, remark, source FROM payments WHERE id > ? ORDER BY id
+        ''', (last_id,)).fetchall()
+        # 同步维护留言精确匹配词索引
+        conn.executemany(
+            'INSERT OR IGNORE INTO payment_tokens (token, payment_id) VALUES (?, ?)',
+            [(token, row['id']) for row in rows for token in extract_message_tokens(row['message'])]
+        )
+        # 每个通知目标一条投递记录
+        conn.executemany(
+            'INSERT OR IGNORE INTO deliveries (payment_id, target, created_epoch) VALUES (?, ?, ?)',
+            [(row['id'], name, now_epoch) for row in rows for name in target_names]
+        )
+        deliveries = [(row['target'], row['id'], row['payment_id']) for row in conn.execute(
+            'SELECT id, target, payment_id FROM deliveries WHERE payment_id > ? ORDER BY id', (last_id,))]
+        inserted = [{key: row[key] for key in ('id', 'amount', 'sender', 'message', 'timestamp', 'remark', 'source')}
+                    for row in rows]
+        return inserted, deliveries
+
+    @staticmethod
+    def _stored_under_other_source(conn: sqlite3.Connection, payment_data: Dict[str, str]) -> bool:
+        """相同 (金额, 付款人, 到账时间) 的支付是否已以其他来源入库"""
+        return conn.execute('''
+        SELECT 1 FROM payments WHERE ts_epoch = ? AND sender = ? AND amount = ? AND source != ? LIMIT 1
+        ''', (
+            parse_timestamp_epoch(payment_data['timestamp']),
+            payment_data['sender'],
+            payment_data['amount'],
+            payment_data.get('source', DEFAULT_SOURCE)
+        )).fetchone() is not None
+
+    async def process_new_payments(self, payments: List[Dict[str, str]]) -> Tuple[int, int]:
+        """批量处理新的支付记录，在一个事务中入库，返回 (新增数, 重复数)"""
+        if not payments:
+            return 0, 0
         try:
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            
-            # 检查是否已存在该支付记录
-            cursor.execute('''
-            SELECT id FROM payments 
-            WHERE amount = ? AND sender = ? AND timestamp = ?
-            ''', (payment_data['amount'], payment_data['sender'], payment_data['timestamp']))
-            
-            if not cursor.fetchone():
-                # 如果不存在，插入新记录
-                cursor.execute('''
-                INSERT INTO payments (
-                    amount, sender, message, timestamp, remark, 
-                    created_at, notify_status, notify_retry_count, next_retry_time
-                ) VALUES (?, ?, ?, ?, ?, ?, 0, 0, ?)
-                ''', (
-                    payment_data['amount'],
-                    payment_data['sender'],
-                    payment_data.get('message', ''),
-                    payment_data['timestamp'],
-                    payment_data.get('remark', ''),
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                ))
-                conn.commit() 
-                logger.info(f"新支付记录已添加到数据库: {payment_data['amount']} - {payment_data['sender']} - {payment_data['timestamp']}")
-                
+            with INGEST_SECONDS.time():
+                inserted, deliveries = await self.db_executor.write_now(self._insert_payments, payments, list(self.targets))
         except Exception as e:
             logger.error(f"处理新支付记录时出错: {str(e)}")
-        finally:
-            conn.close()
+            return 0, 0
+        PAYMENTS_INGESTED.inc(len(inserted), result='new')
+        PAYMENTS_INGESTED.inc(len(payments) - len(inserted), result='duplicate')
+        stored_at = time.time()
+        detected = {payment_key(payment_data): payment_data['detected_at']
+                    for payment_data in payments if payment_data.get('detected_at')}
+        backfill = {payment_key(payment_data) for payment_data in payments if payment_data.get('backfill')}
+
+        # 新投递记录直接放入目标的通知队列，首次通知不经过调度器读库；队列已满时交给调度器
+        now = time.time()
+        enqueued_at = time.perf_counter()
+        inserted_by_id = {payment_data['id']: payment_data for payment_data in inserted}
+        for target_name, delivery_id, payment_id in deliveries:
+            target = self.targets[target_name]
+            payment_dict = dict(inserted_by_id[payment_id], delivery_id=delivery_id)
+            detected_at = detected.get(payment_key(payment_dict))
+            trace = {'detected': detected_at, 'stored': stored_at} if detected_at else None
+            if target.notify_queue.full() or not target.retry_scheduler.claim(delivery_id):
+                if trace:
+                    target.pending_traces[delivery_id] = trace
+                target.retry_scheduler.schedule(delivery_id, now)
+                continue
+            if trace:
+                payment_dict['trace'] = trace
+            target.notify_queue.put_nowait((payment_dict, 0, enqueued_at))
+        for payment_data in inserted:
+            logger.info(f"新支付记录已添加到数据库: {payment_data['amount']} - {payment_data['sender']} - {payment_data['timestamp']}")
+            if payment_key(payment_data) in backfill:
+                payment_data = dict(payment_data, backfill=True)
+            self._emit_new_payment(payment_data)
+        return len(inserted), len(payments) - len(inserted)
+
+    async def process_new_payment(self, payment_data: Dict[str, str]):
+        """处理新的支付记录"""
+        await self.process_new_payments([payment_data])
+
+    async def ingest_worker(self):
+        """从入库队列中取出支付记录并入库，队列中积压的记录合并为一批"""
+        while self.running:
+            payments = [await self.ingest_queue.get()]
+            while not self.ingest_queue.empty():
+                payments.append(self.ingest_queue.get_nowait())
+            try:
+                await self.process_new_payments(payments)
+            finally:
+                for _ in payments:
+                    self.ingest_queue.task_done()
 
-    async def schedule_task(self, payment_data: Dict[str, str], retry_count: int = 0):
+    async def schedule_task(self, target: NotifyTarget, payment_data: Dict[str, str], retry_count: int = 0):
         """调度通知任务"""
         if retry_count >= self.max_retry:
+            target.retry_scheduler.complete(payment_data['delivery_id'])
             return
 
-        # 直接添加到队列
-        await self.notify_queue.put((payment_data, retry_count))
-        logger.info(f"任务已调度: {payment_data['amount']} - {payment_data['sender']} - {payment_data['timestamp']} - 第{retry_count + 1}次支付通知")
+        # 添加到目标的通知队列，队列满时在此等待
+        await target.notify_queue.put((payment_data, retry_count, time.perf_counter()))
+        logger.info(f"任务已调度: {target.name} => {payment_data['amount']} - {payment_data['sender']} - {payment_data['timestamp']} - 第{retry_count + 1}次支付通知")
+
+    def _create_session(self, limit_per_host: int) -> aiohttp.ClientSession:
+        """创建通知目标的HTTP会话：按主机限制连接数、保持长连接，并统计连接建立与复用（各目标合计）"""
+        stats = self._connection_stats
+
+        async def on_request_start(session, ctx, params):
+            stats['requests'] += 1
+
+        async def on_connection_create_start(session, ctx, params):
+            ctx.connect_started = time.perf_counter()
+
+        async def on_connection_create_end(session, ctx, params):
+            stats['new_connections'] += 1
+            stats['connect_seconds'] += time.perf_counter() - ctx.connect_started
+
+        async def on_connection_reuseconn(session, ctx, params):
+            stats['reused_connections'] += 1
+
+        async def on_dns_resolvehost_end(session, ctx, params):
+            stats['dns_lookups'] += 1
+
+        async def on_dns_cache_hit(session, ctx, params):
+            stats['dns_cache_hits'] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
 
-    async def notify_worker(self):
-        """通知工作协程"""
-        async with aiohttp.ClientSession() as session:
-            while self.running:
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        # 每次请求分别限制建连与读取超时
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[trace_config])
+
+    def connection_stats(self) -> Dict[str, float]:
+        """通知HTTP连接统计"""
+        stats = dict(self._connection_stats)
+        new_connections = stats['new_connections']
+        stats['avg_connect_ms'] = stats.pop('connect_seconds') * 1000 / new_connections if new_connections else 0.0
+        total = new_connections + stats['reused_connections']
+        stats['reuse_ratio'] = stats['reused_connections'] / total if total else 0.0
+        return stats
+
+    @staticmethod
+    def _notify_payload(target: NotifyTarget, payment_data: Dict[str, str]) -> Dict[str, str]:
+        """构造单条通知数据（含签名）"""
+        sign_str = f"{payment_data['amount']}{payment_data['sender']}{payment_data['timestamp']}{target.key}"
+        sign = hashlib.md5(sign_str.encode()).hexdigest()
+        
+        return {
+            'amount': payment_data['amount'],
+            'sender': payment_data['sender'],
+            'timestamp': payment_data['timestamp'],
+            'message': payment_data.get('message', ''),
+            'remark': payment_data.get('remark', ''),
+            'source': payment_data.get('source', DEFAULT_SOURCE),
+            'sign': sign
+        }
+
+    def _complete_notify(self, target: NotifyTarget, payment_data: Dict[str, str], retry_count: int,
+                         next_retry_epoch: Optional[int]):
+        """释放处理中标记，失败且未超过重试次数时安排下次重试"""
+        if retry_count + 1 >= self.max_retry:
+            next_retry_epoch = None
+        target.retry_scheduler.complete(payment_data['delivery_id'], next_retry_epoch)
+
+    @staticmethod
+    def _park_notify(target: NotifyTarget, payment_data: Dict[str, str]):
+        """熔断期间暂缓通知：不发送请求、不消耗重试次数，熔断可探测时重新调度（追踪时间随之保留）"""
+        delivery_id = payment_data['delivery_id']
+        if payment_data.get('trace') is not None:
+            target.pending_traces[delivery_id] = payment_data['trace']
+        target.retry_scheduler.complete(delivery_id, time.time() + target.circuit_breaker.retry_after())
+
+    @staticmethod
+    async def _release_endpoint(target: NotifyTarget, started: float, responded_at: Optional[float], endpoint_ok: bool):
+        """记录一次通知请求的结果：更新熔断状态并按耗时调整并发上限"""
+        if endpoint_ok:
+            target.circuit_breaker.record_success()
+        else:
+            target.circuit_breaker.record_failure()
+        await target.concurrency_limiter.release((responded_at or time.perf_counter()) - started, endpoint_ok)
+
+    async def notify_worker(self, target: NotifyTarget):
+        """通知工作协程（阻塞等待队列，停止时通过取消退出）"""
+        session = target.session
+        while self.running:
+            try:
+                payment_data, retry_count, enqueued_at = await target.notify_queue.get()
+                target.notify_queue.task_done()
+                target.dispatch_latencies.append(time.perf_counter() - enqueued_at)
+                trace = payment_data.get('trace')
+                if trace is not None:
+                    trace['dequeued'] = time.time()
+                
+                next_retry_epoch = None
+                await target.concurrency_limiter.acquire()
+                # 取得并发名额后、发送前检查熔断：等待名额期间熔断可能已经打开
+                if not target.circuit_breaker.allow_request():
+                    await target.concurrency_limiter.cancel()
+                    self._park_notify(target, payment_data)
+                    continue
+                NOTIFY_ATTEMPTS.inc(target=target.name, attempt=retry_count + 1)
+                started = time.perf_counter()
+                responded_at = None
+                # 接口可用（收到非5xx响应），与业务返回是否为 success 无关
+                endpoint_ok = False
+                succeeded = False
+                
                 try:
-                    if self.notify_queue.empty():
-                        await asyncio.sleep(1)
-                        continue
+                    notify_data = self._notify_payload(target, payment_data)
                     
-                    payment_data, retry_count = await self.notify_queue.get()
+                    headers = {
+                        'Content-Type': 'application/x-www-form-urlencoded'
+                    }
                     
-                    try:
-                        sign_str = f"{payment_data['amount']}{payment_data['sender']}{payment_data['timestamp']}{self.notify_key}"
-                        sign = hashlib.md5(sign_str.encode()).hexdigest()
-                        
-                        notify_data = {
-                            'amount': payment_data['amount'],
-                            'sender': payment_data['sender'],
-                            'timestamp': payment_data['timestamp'],
-                            'message': payment_data.get('message', ''),
-                            'remark': payment_data.get('remark', ''),
-                            'sign': sign
-                        }
-                        
-                        headers = {
-                            'Content-Type': 'application/x-www-form-urlencoded'
-                        }
-                        
-                        async with session.post(self.notify_url, data=notify_data, headers=headers, timeout=10) as response:
-                            response_text = await response.text()
-                            if response.status == 200 and response_text == "success":
-                                await self.update_notify_status(
-                                    payment_data,
-                                    notify_status=1,
-                                    retry_count=retry_count,
-                                    response_text=response_text
-                                )
-                                logger.success(f"通知成功: {self.notify_url} => {payment_data['amount']} - {payment_data['sender']} - {payment_data['timestamp']}")
-                            else:
-                                raise Exception(f"HTTP {response.status}")
-                                
-                    except Exception as e:
-                        # 更新通知状态
-                        await self.update_notify_status(
-                            payment_data,
-                            notify_status=2,
-                            retry_count=retry_count+1,
-                            response_text=f"第{retry_count + 1 }次尝试失败: {str(e)}"
-                        )
-                        
-                        logger.error(f"通知处理异常: {str(e)}")
+                    if trace is not None:
+                        trace['sent'] = time.time()
+                    async with session.post(target.url, data=notify_data, headers=headers) as response:
+                        response_text = await response.text()
+                        responded_at = time.perf_counter()
+                        endpoint_ok = response.status < 500
+                        if response.status == 200 and response_text == "success":
+                            if trace is not None:
+                                trace['acked'] = time.time()
+                            await self.update_notify_status(
+                                target,
+                                payment_data,
+                                notify_status=1,
+                                retry_count=retry_count,
+                                response_text=response_text
+                            )
+                            succeeded = True
+                            logger.success(f"通知成功: {target.url} => {payment_data['amount']} - {payment_data['sender']} - {payment_data['timestamp']}")
+                        else:
+                            raise Exception(f"HTTP {response.status}")
+                            
                 except Exception as e:
-                    logger.error(f"通知工作协程异常: {str(e)}")
-                    await asyncio.sleep(0.1)
+                    # 更新通知状态
+                    next_retry_epoch = await self.update_notify_status(
+                        target,
+                        payment_data,
+                        notify_status=2,
+                        retry_count=retry_count+1,
+                        response_text=f"第{retry_count + 1 }次尝试失败: {str(e)}"
+                    )
                     
-    async def update_notify_status(self, payment_data: Dict[str, str], notify_status: int, retry_count: int, response_text: str = ""):
-        """更新通知状态"""
+                    logger.error(f"通知处理异常: {target.name} => {str(e)}")
+                finally:
+                    NOTIFY_SECONDS.observe((responded_at or time.perf_counter()) - started, target=target.name,
+                                           status='success' if succeeded else 'failure')
+                    await self._release_endpoint(target, started, responded_at, endpoint_ok)
+                    self._complete_notify(target, payment_data, retry_count, next_retry_epoch)
+            except Exception as e:
+                logger.error(f"通知工作协程异常: {str(e)}")
+                await asyncio.sleep(0.1)
+
+    async def notify_batch_worker(self, target: NotifyTarget):
+        """批量通知工作协程
+
+        取到第一条通知后，在 batch_window 内继续收集，最多 batch_max_items 条，合并为一次请求。
+        """
+        while self.running:
+            try:
+                batch = [await target.notify_queue.get()]
+                target.notify_queue.task_done()
+                deadline = time.perf_counter() + target.batch_window
+                while len(batch) < target.batch_max_items:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(target.notify_queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                    target.notify_queue.task_done()
+                
+                now = time.perf_counter()
+                target.dispatch_latencies.extend(now - enqueued_at for _, _, enqueued_at in batch)
+                dequeued_at = time.time()
+                for payment_data, _, _ in batch:
+                    if 'trace' in payment_data:
+                        payment_data['trace']['dequeued'] = dequeued_at
+                await self._deliver_batch(target, [(payment_data, retry_count) for payment_data, retry_count, _ in batch])
+            except Exception as e:
+                logger.error(f"通知工作协程异常: {str(e)}")
+                await asyncio.sleep(0.1)
+
+    async def _deliver_batch(self, target: NotifyTarget, batch: List[Tuple[Dict[str, str], int]]):
+        """发送一批通知并在一个事务中更新全部通知状态
+
+        请求体为JSON数组，每项包含与单条通知相同的字段和签名；请求头 X-Batch-Sign 为
+        md5(各项签名按顺序拼接 + 通知密钥)。接收端返回与请求等长的JSON数组，
+        对应项为 "success" 表示该条通知成功。
+        """
+        items = [self._notify_payload(target, payment_data) for payment_data, _ in batch]
+        batch_sign = hashlib.md5((''.join(item['sign'] for item in items) + target.key).encode()).hexdigest()
+        
+        await target.concurrency_limiter.acquire()
+        # 取得并发名额后、发送前检查熔断：等待名额期间熔断可能已经打开
+        if not target.circuit_breaker.allow_request():
+            await target.concurrency_limiter.cancel()
+            for payment_data, _ in batch:
+                self._park_notify(target, payment_data)
+            return
+        for _, retry_count in batch:
+            NOTIFY_ATTEMPTS.inc(target=target.name, attempt=retry_count + 1)
+        started = time.perf_counter()
+        responded_at = None
+        endpoint_ok = False
+        acks = None
+        sent_at = time.time()
+        for payment_data, _ in batch:
+            if 'trace' in payment_data:
+                payment_data['trace']['sent'] = sent_at
         try:
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
+            async with target.session.post(target.url, json=items, headers={'X-Batch-Sign': batch_sign}) as response:
+                responded_at = time.perf_counter()
+                endpoint_ok = response.status < 500
+                if response.status != 200:
+                    raise Exception(f"HTTP {response.status}")
+                acks = await response.json(content_type=None)
+            if not isinstance(acks, list) or len(acks) != len(items):
+                raise Exception("批量通知响应格式错误")
             
-            # 计算下次重试时间
-            next_retry_time = None
-            if self.retry_intervals[retry_count]:
-                next_retry_time = datetime.now() + timedelta(seconds=self.retry_intervals[retry_count])
-            
-            cursor.execute('''
-            UPDATE payments 
-            SET notify_status = ?,
-                notify_url = ?,
-                notify_response = ?,
-                notify_time = ?,
-                notify_retry_count = ?,
-                next_retry_time = ?
-            WHERE amount = ? AND sender = ? AND timestamp = ?
-            ''', (
-                notify_status,
-                self.notify_url,
-                response_text,
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                retry_count,
-                next_retry_time.strftime('%Y-%m-%d %H:%M:%S') if next_retry_time else None,
-                payment_data['amount'],
-                payment_data['sender'],
-                payment_data['timestamp']
-            ))
+            outcomes = []
+            acked_at = time.time()
+            for (payment_data, retry_count), ack in zip(batch, acks):
+                if ack == "success":
+                    if 'trace' in payment_data:
+                        payment_data['trace']['acked'] = acked_at
+                    outcomes.append((payment_data, 1, retry_count, ack))
+                else:
+                    outcomes.append((payment_data, 2, retry_count + 1, f"第{retry_count + 1}次尝试失败: {ack}"))
+            succeeded = sum(1 for outcome in outcomes if outcome[1] == 1)
+            logger.success(f"批量通知完成: {target.url} => 成功 {succeeded} 条，失败 {len(outcomes) - succeeded} 条")
+        except Exception as e:
+            outcomes = [(payment_data, 2, retry_count + 1, f"第{retry_count + 1}次尝试失败: {str(e)}")
+                        for payment_data, retry_count in batch]
+            logger.error(f"批量通知异常: {target.name} => {str(e)}")
+        finally:
+            NOTIFY_SECONDS.observe((responded_at or time.perf_counter()) - started, target=target.name,
+                                   status='success' if isinstance(acks, list) and len(acks) == len(items) else 'failure')
+            await self._release_endpoint(target, started, responded_at, endpoint_ok)
+        
+        next_retry_epochs = await self.update_notify_statuses(target, outcomes)
+        for (payment_data, retry_count), next_retry_epoch in zip(batch, next_retry_epochs):
+            self._complete_notify(target, payment_data, retry_count, next_retry_epoch)
+
+    def dispatch_latency_stats(self, target_name: str = None) -> Dict[str, float]:
+        """最近通知的入队到发起请求等待时间统计（毫秒），未指定目标时统计全部目标"""
+        targets = [self.targets[target_name]] if target_name else self.targets.values()
+        samples = sorted(latency for target in targets for latency in target.dispatch_latencies)
+        if not samples:
+            return {'count': 0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        return {
+            'count': len(samples),
+            'p50': samples[len(samples) // 2] * 1000,
+            'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+            'max': samples[-1] * 1000
+        }
+
+    async def update_notify_status(self, target: NotifyTarget, payment_data: Dict[str, str], notify_status: int,
+                                   retry_count: int, response_text: str = "") -> Optional[int]:
+        """更新通知状态，返回下次重试时间戳（无需重试时为 None）"""
+        next_retry_epochs = await self.update_notify_statuses(
+            target, [(payment_data, notify_status, retry_count, response_text)])
+        return next_retry_epochs[0]
+
+    async def update_notify_statuses(self, target: NotifyTarget,
+                                     outcomes: List[Tuple[Dict[str, str], int, int, str]]) -> List[Optional[int]]:
+        """在一个事务中更新多条投递记录的通知状态
+
+        outcomes 每项为 (payment_data, notify_status, retry_count, response_text)，
+        返回与之对应的下次重试时间戳列表（无需重试时为 None）。
+        第一个通知目标的状态同步写入 payments 表的 notify_* 字段。
+        写库失败时这些投递按退避时间重新调度（本次结果未落库，不计入重试次数），返回值全部为 None。
+        """
+        next_retry_epochs = []
+        try:
+            notify_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            params = []
+            for payment_data, notify_status, retry_count, response_text in outcomes:
+                # 计算下次重试时间
+                next_retry_time = None
+                if self.retry_intervals[retry_count]:
+                    next_retry_time = datetime.now() + timedelta(seconds=self.retry_intervals[retry_count])
+                params.append((
+                    notify_status,
+                    response_text,
+                    notify_time,
+                    retry_count,
+                    next_retry_time.strftime('%Y-%m-%d %H:%M:%S') if next_retry_time else None,
+                    int(next_retry_time.timestamp()) if next_retry_time else 0,
+                    payment_data['id'],
+                    payment_data['delivery_id'],
+                    encode_trace(payment_data.get('trace'))
+                ))
+                next_retry_epochs.append(
+                    int(next_retry_time.timestamp()) if notify_status == 2 and next_retry_time else None)
             
-            conn.commit()
+            def update(conn):
+                conn.executemany('''
+                UPDATE deliveries
+                SET status = ?,
+                    response = ?,
+                    notify_time = ?,
+                    retry_count = ?,
+                    next_retry_epoch = ?,
+                    trace = COALESCE(?, trace)
+                WHERE id = ?
+                ''', [(status, response, time_str, retries, epoch, trace, delivery_id)
+                      for status, response, time_str, retries, _, epoch, _, delivery_id, trace in params])
+                if target.name == self.primary_target:
+                    conn.executemany('''
+                    UPDATE payments
+                    SET notify_status = ?,
+                        notify_url = ?,
+                        notify_response = ?,
+                        notify_time = ?,
+                        notify_retry_count = ?,
+                        next_retry_time = ?,
+                        next_retry_epoch = ?
+                    WHERE id = ?
+                    ''', [(status, target.url, response, time_str, retries, retry_time, epoch, payment_id)
+                          for status, response, time_str, retries, retry_time, epoch, payment_id, _, _ in params])
+
+            await self.db_executor.write(update)
+            target.status_write_failures = 0
+            if any(outcome[1] == 1 for outcome in outcomes):
+                HEALTH.record_delivery(target.name)
+            return next_retry_epochs
         except Exception as e:
             logger.error(f"更新通知状态失败: {str(e)}")
-        finally:
-            conn.close()
+            self._reschedule_unsaved(target, [outcome[0] for outcome in outcomes])
+            return [None] * len(outcomes)
+
+    @staticmethod
+    def _reschedule_unsaved(target: NotifyTarget, payments: List[Dict[str, str]]):
+        """通知状态未能写入数据库：按连续失败次数指数退避后重新调度这些投递"""
+        target.status_write_failures += 1
+        due = time.time() + min(2 ** target.status_write_failures, 60)
+        for payment_data in payments:
+            delivery_id = payment_data['delivery_id']
+            if payment_data.get('trace') is not None:
+                target.pending_traces[delivery_id] = payment_data['trace']
+            target.retry_scheduler.complete(delivery_id, due)
             
     async def start(self):
         """启动通知系统"""
+        for target in self.targets.values():
+            target.session = self._create_session(target.limit_per_host)
+        
         # 启动任务加载器
         loader_task = asyncio.create_task(self.task_loader())
         
-        # 启动通知工作协程
-        workers = []
-        for _ in range(self.concurrency):
-            worker = asyncio.create_task(self.notify_worker())
-            workers.append(worker)
+        # 启动入库协程和每个目标的通知工作协程
+        workers = [asyncio.create_task(self.ingest_worker())]
+        for target in self.targets.values():
+            notify_worker = self.notify_batch_worker if target.batch_mode else self.notify_worker
+            for _ in range(target.concurrency):
+                worker = asyncio.create_task(notify_worker(target))
+                workers.append(worker)
             
         return loader_task, workers
         
@@ -811,30 +3991,37 @@ class PaymentNotifier:
             for worker in workers:
                 worker.cancel()
             await asyncio.gather(loader_task, *workers, return_exceptions=True)
+            for target in self.targets.values():
+                if target.session:
+                    await target.session.close()
+            await asyncio.to_thread(self.db_executor.stop)
         except Exception as e:
             logger.error(f"停止通知系统时出错: {str(e)}")
 
 async def main():
     """主函数"""
-    # 创建支付监控实例
-    monitor = WeChatPaymentMonitor()
+    # 创建支付监控实例：single 监控第一个微信窗口，multi 同时监控所有微信窗口
+    multi_source = os.getenv('SOURCE_MODE', 'single').lower() == 'multi'
+    monitor = MultiSourceMonitor() if multi_source else WeChatPaymentMonitor()
     
     # 创建支付通知实例
-    notify_url = os.getenv('NOTIFY_URL')
-    notify_key = os.getenv('NOTIFY_KEY')
+    targets = load_notify_targets()
     
-    if not notify_url or not notify_key:
+    if not targets:
         logger.warning("未配置通知URL或密钥，通知功能将被禁用")
-        notify_url = ""
-        notify_key = ""
+    else:
+        logger.info(f"通知目标: {', '.join(target['name'] for target in targets)}")
         
-    notifier = PaymentNotifier(notify_url, notify_key)
+    notifier = PaymentNotifier("", "", targets=targets)
+    QUEUE_DEPTH.set_function(notifier.queue_depths)
+    HEALTH.set_queue_source(notifier.queue_depths)
     
     # 创建API实例
     api = WeChatPaymentAPI()
+    # 新支付入库时唤醒长轮询请求、清空列表计数缓存
+    notifier.add_payment_listener(api.on_new_payment)
     
     # 启动API服务（在新线程中运行）
-    import threading
     api_thread = threading.Thread(target=api.run, daemon=True)
     api_thread.start()
     
@@ -846,30 +4033,45 @@ async def main():
         # 启动通知服务
         loader_task, worker_tasks = await notifier.start()
         
-        # 主循环
-        is_first_run = True
-        while monitor.running:
-            try:
-                if not monitor.check_windows():
-                    logger.error("窗口检查失败，程序将退出")
-                    break
+        if multi_source:
+            # 多窗口模式：每个来源一个扫描线程，直接写入共享入库队列
+            if not monitor.start(asyncio.get_running_loop(), notifier.ingest_queue):
+                logger.error("未找到微信窗口，程序将退出")
+            else:
+                await monitor.wait()
+        else:
+            # 事件驱动模式：订阅列表变化事件
+            if monitor.monitor_mode == 'event':
+                monitor.start_event_source()
+            
+            # 主循环
+            is_first_run = True
+            while monitor.running:
+                try:
+                    if not monitor.check_windows():
+                        logger.error("窗口检查失败，程序将退出")
+                        break
+                        
+                    payments = monitor.get_all_payment_records(is_first_run)
+                    if is_first_run:
+                        # 首次运行的历史记录批量入库
+                        new_count, duplicate_count = await notifier.process_new_payments(payments)
+                        logger.info(f"历史支付记录入库完成: 新增 {new_count} 条，已存在 {duplicate_count} 条")
+                    else:
+                        for payment in payments:
+                            await notifier.ingest_queue.put(payment)
+                    is_first_run = False
                     
-                payments = monitor.get_all_payment_records(is_first_run)
-                if payments:
-                    for payment in payments:
-                        await notifier.process_new_payment(payment)
-                is_first_run = False
-                
-                await asyncio.sleep(monitor.check_interval)
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.error(f"主循环发生错误: {str(e)}")
-                if "窗口" in str(e) or "不存在" in str(e):
-                    logger.error("检测到窗口异常，程序将退出")
+                    await monitor.wait_for_change()
+                except asyncio.CancelledError:
                     break
-                await asyncio.sleep(1)
-                
+                except Exception as e:
+                    logger.error(f"主循环发生错误: {str(e)}")
+                    if "窗口" in str(e) or "不存在" in str(e):
+                        logger.error("检测到窗口异常，程序将退出")
+                        break
+                    await asyncio.sleep(1)
+                    
     except KeyboardInterrupt:
         logger.info("正在停止服务...")
     except Exception as e:
@@ -877,9 +4079,13 @@ async def main():
     finally:
         # 设置运行标志为False
         monitor.running = False
+        if multi_source:
+            monitor.stop()
+        else:
+            monitor.stop_event_source()
         
-        # 关闭API服务
-        api.shutdown()
+        # 关闭API服务（等待处理中的请求完成，不阻塞事件循环）
+        await asyncio.to_thread(api.shutdown)
         
         # 停止通知服务
         if loader_task and worker_tasks:
@@ -898,7 +4104,52 @@ async def main():
         # 强制退出程序
         os._exit(0)
 
+def trace_report_cli(argv: List[str]) -> int:
+    """命令行输出端到端延迟报告：python main.py trace-report [--minutes 60] [--target 名称]"""
+    parser = argparse.ArgumentParser(prog='main.py trace-report', description="支付从检测到收到通知确认的各阶段耗时")
+    parser.add_argument('--minutes', type=int, default=60, help="统计最近多少分钟入库的支付")
+    parser.add_argument('--target', help="只统计指定通知目标")
+    parser.add_argument('--db', help="数据库文件，默认取 DB_NAME")
+    args = parser.parse_args(argv)
+
+    with SQLitePool.get(resolve_db_path(args.db)).connection() as conn:
+        migrate_database(conn)
+        report = load_trace_report(conn, int(time.time()) - args.minutes * 60, args.target)
+
+    print(f"{'segment':<10} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in report.items():
+        print(f"{name:<10} {stats['count']:>7} {stats['p50']:>9.1f} {stats['p90']:>9.1f} "
+              f"{stats['p99']:>9.1f} {stats['max']:>9.1f}")
+    return 0
+
+
+def record_list_cli(argv: List[str]) -> int:
+    """录制微信"消息"列表子树：python main.py record-list --output 文件 [--scroll]"""
+    parser = argparse.ArgumentParser(prog='main.py record-list',
+                                     description="录制微信支付消息列表的控件树，供基准测试回放")
+    parser.add_argument('--output', required=True, help="输出文件，.gz 结尾时压缩")
+    parser.add_argument('--scroll', action='store_true', help="录制前先滚动加载更多记录")
+    args = parser.parse_args(argv)
+
+    if automation is None:
+        logger.error("当前环境不支持读取微信窗口")
+        return 1
+    monitor = WeChatPaymentMonitor(install_handlers=False)
+    if args.scroll:
+        monitor.scroll_to_load_more(monitor.payment_list)
+    started = time.perf_counter()
+    size = save_control_tree(monitor.payment_list, args.output)
+    logger.info(f"已录制 {len(monitor.payment_list.GetChildren())} 个列表项到 {args.output}，"
+                f"{size / 1024:.1f} KB，耗时 {time.perf_counter() - started:.2f} 秒")
+    return 0
+
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'trace-report':
+        sys.exit(trace_report_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'record-list':
+        sys.exit(record_list_cli(sys.argv[2:]))
+
     try:
         # # 设置事件循环策略
         # if sys.platform == 'win32':
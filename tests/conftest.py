@@ -0,0 +1,54 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import MemoryControl, MemoryRect, SQLitePool, migrate_database, open_db_connection  # noqa: E402
+
+
+def build_payment_item(index: int, runtime_id: tuple = None, amount: str = None, sender: str = None,
+                       message: str = None, timestamp: str = None) -> MemoryControl:
+    """构造一条与微信收款消息结构一致的列表项"""
+    fields = [
+        ("收款金额", f"￥{amount or f'{index % 100 + 1}.00'}"),
+        ("来自", sender or f"用户{index}"),
+        ("付款方留言", message if message is not None else f"ORDER{index:08d}"),
+        ("到账时间", timestamp or f"2024-01-01 {index // 3600 % 24:02d}:{index // 60 % 60:02d}:{index % 60:02d}"),
+        ("备注", "收款成功"),
+    ]
+    pane = MemoryControl('PaneControl')
+    pane.append(MemoryControl('TextControl', '微信支付'))
+    for label, value in fields:
+        row = pane.append(MemoryControl('PaneControl'))
+        row.append(MemoryControl('TextControl', label))
+        row.append(MemoryControl('TextControl', value))
+    return MemoryControl('ListItemControl', f"收款 {index}", [pane],
+                         rect=MemoryRect(0, index * 100, 400, index * 100 + 100), runtime_id=runtime_id)
+
+
+def build_payment_window(count: int, start: int = 0):
+    """构造包含 count 条收款消息（编号从 start 开始）的内存窗口"""
+    payment_list = MemoryControl('ListControl', '消息', [build_payment_item(i) for i in range(start, start + count)])
+    window = MemoryControl('WindowControl', '微信支付', [payment_list])
+    return window, payment_list
+
+
+def now_text(offset: float = 0) -> str:
+    """当前时间（加 offset 秒）的本地时间文本"""
+    return datetime.fromtimestamp(datetime.now().timestamp() + offset).strftime('%Y-%m-%d %H:%M:%S')
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    """已迁移到最新结构的临时数据库"""
+    path = str(tmp_path / 'payments.db')
+    conn = open_db_connection(path)
+    try:
+        migrate_database(conn)
+    finally:
+        conn.close()
+    yield path
+    SQLitePool.get(path).close()
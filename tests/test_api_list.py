@@ -0,0 +1,75 @@
+import pytest
+
+from main import PaymentNotifier, WeChatPaymentAPI, open_db_connection
+
+
+def seed_payments(db_name: str, count: int):
+    """写入 count 条支付记录，每两条到账时间相同"""
+    payments = [{'amount': f"{i % 10 + 1}.00", 'sender': f"用户{i}", 'message': f"ORDER{i:04d}",
+                 'timestamp': f"2024-01-01 10:{i // 2 // 60:02d}:{i // 2 % 60:02d}", 'remark': '收款成功',
+                 'source': 'shop-2' if i % 5 == 0 else 'default'}
+                for i in range(count)]
+    conn = open_db_connection(db_name)
+    try:
+        PaymentNotifier._insert_payments(conn, payments, [])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def client(db_name):
+    seed_payments(db_name, 45)
+    return WeChatPaymentAPI(db_name).app.test_client()
+
+
+@pytest.mark.parametrize('query, name', [
+    ('page_size=0', 'page_size'),
+    ('page_size=-1', 'page_size'),
+    ('page_size=1001', 'page_size'),
+    ('page_size=ten', 'page_size'),
+    ('page=0', 'page'),
+    ('page=two', 'page'),
+    ('after=abc', 'after'),
+    ('start_time=yesterday', 'start_time'),
+])
+def test_invalid_paging_parameters_are_rejected(client, query, name):
+    response = client.get(f'/api/payment/list?{query}')
+    assert response.status_code == 400
+    assert name in response.get_json()['message']
+
+
+def test_page_size_bounds_are_accepted(client):
+    for page_size, expected in ((1, 1), (1000, 45)):
+        data = client.get(f'/api/payment/list?page_size={page_size}').get_json()['data']
+        assert data['page_size'] == page_size
+        assert len(data['list']) == expected
+
+
+def test_page_numbers(client):
+    first = client.get('/api/payment/list?page=1&page_size=20').get_json()['data']
+    last = client.get('/api/payment/list?page=3&page_size=20').get_json()['data']
+    assert first['total'] == 45
+    assert first['list'][0]['sender'] == '用户44'
+    assert len(last['list']) == 5
+    assert last['next_cursor'] is None
+
+
+def test_cursor_pages_cover_every_row_once(client):
+    senders = []
+    after = None
+    while True:
+        query = 'page_size=10' + (f'&after={after}' if after else '')
+        data = client.get(f'/api/payment/list?{query}').get_json()['data']
+        senders.extend(item['sender'] for item in data['list'])
+        after = data['next_cursor']
+        if not after:
+            break
+    assert sorted(senders) == sorted(f"用户{i}" for i in range(45))
+    assert len(senders) == 45
+
+
+def test_source_filter(client):
+    data = client.get('/api/payment/list?source=shop-2&page_size=100').get_json()['data']
+    assert data['total'] == 9
+    assert {item['source'] for item in data['list']} == {'shop-2'}
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+import pytest
+
+import main
+from main import AdaptiveConcurrency, CircuitBreaker, PaymentNotifier
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """替换熔断器使用的单调时钟"""
+    now = [1000.0]
+    monkeypatch.setattr(main.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_threshold_and_recovers(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.retry_after() == 30
+
+    clock[0] += 29
+    assert not breaker.allow_request()
+    clock[0] += 1
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_half_open_allows_a_single_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    assert breaker.retry_after() == 1.0
+
+    # 探测失败：重新打开并重新计时
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    clock[0] += 10
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_parked_notification_does_not_use_a_retry(db_name):
+    notifier = PaymentNotifier('', '', db_name=db_name, targets=[{'name': 'a', 'url': 'http://a', 'key': 'k'}])
+    target = notifier.targets['a']
+    target.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    target.circuit_breaker.record_failure()
+
+    class NoSession:
+        def post(self, *args, **kwargs):
+            raise AssertionError('熔断期间不应发送请求')
+
+    async def unexpected_status(*args, **kwargs):
+        raise AssertionError('熔断期间不应更新通知状态')
+
+    target.session = NoSession()
+    notifier.update_notify_status = unexpected_status
+    payment_data = {'id': 1, 'delivery_id': 10, 'amount': '5.00', 'sender': '张三',
+                    'timestamp': '2024-01-01 10:00:00', 'trace': {'detected': 1000.0}}
+
+    async def run():
+        target.retry_scheduler.claim(10)
+        await notifier.schedule_task(target, payment_data, retry_count=2)
+        worker = asyncio.create_task(notifier.notify_worker(target))
+        deadline = time.monotonic() + 1
+        while 10 not in target.retry_scheduler._due and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+    started = time.time()
+    try:
+        asyncio.run(run())
+    finally:
+        notifier.db_executor.stop()
+
+    # 按熔断恢复时间重新调度，并发名额归还，追踪时间保留到下次出队
+    assert target.retry_scheduler._due[10] >= started + 29
+    assert target.retry_scheduler.in_flight == 0
+    assert target.concurrency_limiter.in_use == 0
+    assert target.pending_traces[10]['detected'] == 1000.0
+
+
+def test_aimd_increases_slowly_up_to_maximum():
+    limiter = AdaptiveConcurrency(4, minimum=1, latency_target=1.0)
+    limiter.limit = 2.0
+
+    async def cycle(latency: float, ok: bool):
+        await limiter.acquire()
+        await limiter.release(latency, ok)
+
+    async def run():
+        await cycle(0.1, True)
+        assert limiter.limit == pytest.approx(2.5)
+        for _ in range(20):
+            await cycle(0.1, True)
+
+    asyncio.run(run())
+    assert limiter.limit == 4
+    assert limiter.in_use == 0
+
+
+def test_aimd_halves_at_most_once_per_latency_target():
+    limiter = AdaptiveConcurrency(8, minimum=3, latency_target=60)
+
+    async def cycle(latency: float, ok: bool):
+        await limiter.acquire()
+        await limiter.release(latency, ok)
+
+    async def run():
+        await cycle(0.1, False)
+        assert limiter.limit == 4
+        # 同一个 latency_target 周期内的其他失败不再减半
+        await cycle(90, True)
+        assert limiter.limit == 4
+        limiter._last_decrease -= 60
+        await cycle(90, True)
+        assert limiter.limit == 3
+        limiter._last_decrease -= 60
+        await cycle(0.1, False)
+
+    asyncio.run(run())
+    # 不低于最小并发
+    assert limiter.limit == 3
+
+
+def test_aimd_limits_concurrent_acquires():
+    limiter = AdaptiveConcurrency(2)
+
+    async def run():
+        await limiter.acquire()
+        await limiter.acquire()
+        blocked = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        await limiter.cancel()
+        await asyncio.wait_for(blocked, 1)
+        return limiter.in_use
+
+    assert asyncio.run(run()) == 2
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conftest import build_payment_item, build_payment_window
+from main import ListChangeEventSource, SyntheticEventSource, WeChatPaymentMonitor
+
+
+def create_monitor(tmp_path, count: int = 3) -> WeChatPaymentMonitor:
+    window, payment_list = build_payment_window(count)
+    monitor = WeChatPaymentMonitor(db_name=str(tmp_path / 'payments.db'), wechat_window=window,
+                                   payment_list=payment_list, install_handlers=False)
+    monitor.safety_check_interval = 5
+    return monitor
+
+
+def test_event_source_base_is_abstract():
+    with pytest.raises(TypeError):
+        ListChangeEventSource()
+
+
+def test_change_event_triggers_rescan(tmp_path):
+    monitor = create_monitor(tmp_path)
+    events = SyntheticEventSource()
+
+    async def run():
+        monitor.start_event_source(events)
+        monitor.get_all_payment_records(is_first_run=True)
+
+        waiting = asyncio.create_task(monitor.wait_for_change())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        monitor.payment_list.append(build_payment_item(3))
+        # 事件可能在 UI Automation 的回调线程中触发
+        threading.Thread(target=events.fire).start()
+        started = time.perf_counter()
+        await asyncio.wait_for(waiting, 1)
+        assert time.perf_counter() - started < monitor.safety_check_interval
+
+        payments = monitor.get_all_payment_records()
+        monitor.stop_event_source()
+        return payments
+
+    payments = asyncio.run(run())
+    assert [payment['sender'] for payment in payments] == ['用户3']
+
+
+def test_burst_of_events_is_coalesced(tmp_path):
+    monitor = create_monitor(tmp_path)
+    events = SyntheticEventSource()
+
+    async def run():
+        monitor.start_event_source(events)
+        for _ in range(10):
+            events.fire()
+        await asyncio.sleep(0)
+        await asyncio.wait_for(monitor.wait_for_change(), 1)
+        backlog = monitor._change_events.qsize()
+        monitor.stop_event_source()
+        return backlog
+
+    assert asyncio.run(run()) == 0
+
+
+def test_safety_poll_without_events(tmp_path):
+    monitor = create_monitor(tmp_path)
+    monitor.safety_check_interval = 0.05
+
+    async def run():
+        monitor.start_event_source(SyntheticEventSource())
+        started = time.perf_counter()
+        await monitor.wait_for_change()
+        monitor.stop_event_source()
+        return time.perf_counter() - started
+
+    assert 0.04 <= asyncio.run(run()) < 1
@@ -0,0 +1,150 @@
+import asyncio
+import time
+
+import pytest
+
+from conftest import build_payment_item, build_payment_window
+from main import (MemoryWindowSource, MultiSourceMonitor, PaymentNotifier, SyntheticEventSource, name_window_sources,
+                  open_db_connection, parse_source_names)
+
+
+def payment(index: int, source: str = 'default', **extra) -> dict:
+    return dict({'amount': '5.00', 'sender': f"用户{index}", 'message': f"ORDER{index:04d}",
+                 'timestamp': f"2024-01-01 10:00:{index:02d}", 'remark': '收款成功', 'source': source}, **extra)
+
+
+@pytest.fixture
+def notifier(db_name):
+    notifier = PaymentNotifier('', '', db_name=db_name, targets=[])
+    yield notifier
+    notifier.db_executor.stop()
+
+
+def stored_rows(notifier: PaymentNotifier) -> list:
+    with notifier.db.connection() as conn:
+        return [tuple(row) for row in conn.execute('SELECT source, sender FROM payments ORDER BY id')]
+
+
+def test_duplicate_payments_are_ignored(notifier):
+    emitted = []
+    notifier.add_payment_listener(emitted.append)
+
+    batch = [payment(1), payment(2), payment(1)]
+    assert asyncio.run(notifier.process_new_payments(batch)) == (2, 1)
+    assert asyncio.run(notifier.process_new_payments([payment(2), payment(3)])) == (1, 1)
+
+    assert stored_rows(notifier) == [('default', '用户1'), ('default', '用户2'), ('default', '用户3')]
+    assert [payment_data['sender'] for payment_data in emitted] == ['用户1', '用户2', '用户3']
+
+
+def test_same_payment_from_different_sources_is_kept(notifier):
+    batch = [payment(1, 'wx0'), payment(1, 'wx1')]
+    assert asyncio.run(notifier.process_new_payments(batch)) == (2, 0)
+    assert stored_rows(notifier) == [('wx0', '用户1'), ('wx1', '用户1')]
+
+
+def test_backfill_flag_reaches_listeners(notifier):
+    emitted = []
+    notifier.add_payment_listener(emitted.append)
+    asyncio.run(notifier.process_new_payments([payment(1, backfill=True), payment(2)]))
+    assert [payment_data.get('backfill', False) for payment_data in emitted] == [True, False]
+
+
+def test_backfill_under_renamed_source_is_not_stored_again(notifier):
+    assert asyncio.run(notifier.process_new_payments([payment(1)])) == (1, 0)
+    # 单窗口切换为多窗口后，同一窗口的历史记录以新的来源名称补录
+    assert asyncio.run(notifier.process_new_payments([payment(1, 'wechat1', backfill=True)])) == (0, 1)
+    assert stored_rows(notifier) == [('default', '用户1')]
+    # 不是补录的新支付仍按来源区分
+    assert asyncio.run(notifier.process_new_payments([payment(1, 'wechat1')])) == (1, 0)
+
+
+def test_single_window_keeps_default_source():
+    assert name_window_sources([('微信支付', 300, 11)], {}) == [('default', 11)]
+    assert name_window_sources([('微信支付', 300, 11)], {'微信支付': 'shop'}) == [('shop', 11)]
+
+
+def test_sources_are_named_by_window_title_not_process_order():
+    windows = [('收款-门店B', 100, 21), ('收款-门店A', 200, 22)]
+    names = {'收款-门店A': 'shop-a'}
+    assert sorted(name_window_sources(windows, names)) == [('shop-a', 22), ('收款-门店B', 21)]
+    # 进程ID顺序变化（微信重启）不影响命名
+    restarted = [('收款-门店B', 500, 31), ('收款-门店A', 400, 32)]
+    assert sorted(name_window_sources(restarted, names)) == [('shop-a', 32), ('收款-门店B', 31)]
+
+
+def test_windows_with_same_title_are_numbered():
+    windows = [('微信支付', 200, 41), ('微信支付', 100, 42)]
+    assert name_window_sources(windows, {}) == [('微信支付#1', 42), ('微信支付#2', 41)]
+
+
+def test_parse_source_names():
+    assert parse_source_names(' shop-a=收款-门店A, shop-b=收款-门店B ') == {'收款-门店A': 'shop-a', '收款-门店B': 'shop-b'}
+    assert parse_source_names('') == {}
+    with pytest.raises(ValueError):
+        parse_source_names('wechat1,wechat2')
+
+
+def test_multi_source_ingest(notifier, monkeypatch):
+    monkeypatch.setenv('MONITOR_MODE', 'event')
+    # 两个账号各自的历史记录不同，之后同时收到一笔相同的收款
+    windows = [build_payment_window(5, start=index * 100) for index in range(2)]
+    events = [SyntheticEventSource() for _ in range(2)]
+    monitor = MultiSourceMonitor(
+        lambda: [MemoryWindowSource(f"wx{index}", window, payment_list, event_source)
+                 for index, ((window, payment_list), event_source) in enumerate(zip(windows, events))],
+        db_name=notifier.db_name, install_handlers=False)
+    emitted = []
+    notifier.add_payment_listener(emitted.append)
+
+    async def wait_for_rows(count: int):
+        deadline = time.monotonic() + 5
+        while len(emitted) < count and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    async def run():
+        ingest_task = asyncio.create_task(notifier.ingest_worker())
+        assert monitor.start(asyncio.get_running_loop(), notifier.ingest_queue) == 2
+        try:
+            await wait_for_rows(10)
+            for (_, payment_list), event_source in zip(windows, events):
+                payment_list.append(build_payment_item(5))
+                event_source.fire()
+            await wait_for_rows(12)
+        finally:
+            await asyncio.to_thread(monitor.stop)
+            ingest_task.cancel()
+            await asyncio.gather(ingest_task, return_exceptions=True)
+
+    asyncio.run(run())
+
+    rows = stored_rows(notifier)
+    assert len(rows) == 12
+    assert sorted(rows[-2:]) == [('wx0', '用户5'), ('wx1', '用户5')]
+    assert [bool(payment_data.get('backfill')) for payment_data in emitted] == [True] * 10 + [False] * 2
+
+
+def delivery_targets(db_name: str) -> dict:
+    conn = open_db_connection(db_name)
+    try:
+        rows = conn.execute('SELECT p.sender, d.target FROM deliveries d JOIN payments p ON p.id = d.payment_id')
+        targets = {}
+        for sender, target in rows:
+            targets.setdefault(sender, set()).add(target)
+        return targets
+    finally:
+        conn.close()
+
+
+def test_new_target_does_not_receive_history(notifier):
+    asyncio.run(notifier.process_new_payments([payment(1), payment(2)]))
+    # 未配置通知目标期间入库的支付在配置目标后补发
+    first = PaymentNotifier('', '', db_name=notifier.db_name, targets=[{'name': 'a', 'url': 'http://a', 'key': 'k'}])
+    first.db_executor.stop()
+    assert delivery_targets(notifier.db_name) == {'用户1': {'a'}, '用户2': {'a'}}
+
+    # 新增的目标不补发已有投递记录的历史支付
+    second = PaymentNotifier('', '', db_name=notifier.db_name, targets=[{'name': 'a', 'url': 'http://a', 'key': 'k'},
+                                                                        {'name': 'b', 'url': 'http://b', 'key': 'k'}])
+    second.db_executor.stop()
+    assert delivery_targets(notifier.db_name) == {'用户1': {'a'}, '用户2': {'a'}}
@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+from main import SCHEMA_MIGRATIONS, migrate_database, open_db_connection, parse_timestamp_epoch
+
+
+def create_legacy_database(path: str):
+    """未记录版本号的旧版数据库（只有初始的 payments 表）"""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+    CREATE TABLE payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        amount TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        message TEXT,
+        timestamp TEXT NOT NULL,
+        remark TEXT,
+        created_at TEXT NOT NULL,
+        notify_status INTEGER DEFAULT 0,
+        notify_retry_count INTEGER DEFAULT 0,
+        notify_url TEXT,
+        notify_response TEXT,
+        notify_time TEXT,
+        next_retry_time TEXT,
+        UNIQUE(amount, sender, timestamp)
+    )
+    ''')
+    conn.executemany('''
+    INSERT INTO payments (id, amount, sender, message, timestamp, remark, created_at,
+                          notify_status, notify_retry_count, notify_response)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (3, '1,200.50', '张三', '订单 A1001 谢谢', '2024-01-01 10:00:00', '收款成功', '2024-01-01 10:00:05',
+         1, 0, 'success'),
+        (7, '8.00', '李四', '', '2024-01-01 11:30:00', '收款成功', '2024-01-01 11:30:02',
+         2, 3, 'HTTP 500'),
+    ])
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    create_legacy_database(path)
+    conn = open_db_connection(path)
+    migrate_database(conn)
+    yield conn
+    conn.close()
+
+
+def test_legacy_database_is_migrated_to_latest_version(legacy_db):
+    assert legacy_db.execute('PRAGMA user_version').fetchone()[0] == len(SCHEMA_MIGRATIONS) == 7
+
+    rows = {row['id']: row for row in legacy_db.execute('SELECT * FROM payments')}
+    assert sorted(rows) == [3, 7]
+    assert rows[3]['amount_cents'] == 120050
+    assert rows[3]['ts_epoch'] == parse_timestamp_epoch('2024-01-01 10:00:00')
+    assert rows[7]['next_retry_epoch'] == 0
+    assert {row['source'] for row in rows.values()} == {'default'}
+
+
+def test_legacy_message_tokens_are_indexed(legacy_db):
+    tokens = {row['token'] for row in legacy_db.execute('SELECT token FROM payment_tokens WHERE payment_id = 3')}
+    assert {'订单', 'a1001', '谢谢'} <= tokens
+
+
+def test_legacy_notify_state_becomes_default_deliveries(legacy_db):
+    deliveries = {row['payment_id']: row for row in legacy_db.execute('SELECT * FROM deliveries')}
+    assert {row['target'] for row in deliveries.values()} == {'default'}
+    assert (deliveries[3]['status'], deliveries[3]['retry_count']) == (1, 0)
+    assert (deliveries[7]['status'], deliveries[7]['retry_count'], deliveries[7]['response']) == (2, 3, 'HTTP 500')
+
+
+def test_indexes_survive_table_rebuild(legacy_db):
+    indexes = {row['name'] for row in legacy_db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_payments_ts', 'idx_payments_pending', 'idx_payments_created', 'idx_payments_ts_id',
+            'idx_deliveries_pending', 'idx_deliveries_created'} <= indexes
+
+
+def test_unique_key_includes_source(legacy_db):
+    insert = '''
+    INSERT OR IGNORE INTO payments (amount, sender, timestamp, created_at, source)
+    VALUES ('8.00', '李四', '2024-01-01 11:30:00', '2024-01-01 11:30:02', ?)
+    '''
+    assert legacy_db.execute(insert, ('default',)).rowcount == 0
+    assert legacy_db.execute(insert, ('shop-2',)).rowcount == 1
+
+
+def test_migration_is_idempotent(legacy_db):
+    migrate_database(legacy_db)
+    assert legacy_db.execute('SELECT COUNT(*) FROM payments').fetchone()[0] == 2
+    assert legacy_db.execute('SELECT COUNT(*) FROM deliveries').fetchone()[0] == 2
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from main import PaymentNotifier, decode_trace, encode_trace, load_notify_targets, open_db_connection
+
+
+@pytest.fixture
+def notifier(db_name):
+    notifier = PaymentNotifier('', '', db_name=db_name, targets=[{'name': 'a', 'url': 'http://a', 'key': 'k'}])
+    yield notifier
+    notifier.db_executor.stop()
+
+
+def stored_delivery(notifier: PaymentNotifier, status: int = 0, retry_count: int = 0, trace: str = None) -> int:
+    conn = open_db_connection(notifier.db_name)
+    try:
+        PaymentNotifier._insert_payments(conn, [{'amount': '5.00', 'sender': '张三', 'message': 'A1',
+                                                 'timestamp': '2024-01-01 10:00:00', 'remark': '收款成功'}], ['a'])
+        conn.execute('UPDATE deliveries SET status = ?, retry_count = ?, trace = ?', (status, retry_count, trace))
+        conn.commit()
+        return conn.execute('SELECT id FROM deliveries').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_retry_restores_trace_from_delivery(notifier):
+    first_attempt = {'detected': 1000.0, 'stored': 1000.01, 'dequeued': 1000.02, 'sent': 1000.03}
+    delivery_id = stored_delivery(notifier, status=2, retry_count=1, trace=encode_trace(first_attempt))
+    target = notifier.targets['a']
+
+    asyncio.run(notifier._dispatch_due(target, [delivery_id]))
+    payment_data, retry_count, _ = target.notify_queue.get_nowait()
+    assert retry_count == 1
+    # 上次尝试的出队和发送时间不保留，由本次尝试重新记录
+    assert payment_data['trace'] == {'detected': 1000.0, 'stored': 1000.01}
+    payment_data['trace'].update(dequeued=1100.0, sent=1100.01, acked=1100.05)
+    assert decode_trace(encode_trace(payment_data['trace']))['acked'] == pytest.approx(1100.05)
+
+
+def test_skipped_delivery_drops_pending_trace(notifier):
+    delivery_id = stored_delivery(notifier, status=1)
+    target = notifier.targets['a']
+    target.pending_traces[delivery_id] = {'detected': 1000.0}
+    assert target.retry_scheduler.claim(delivery_id)
+
+    asyncio.run(notifier._dispatch_due(target, [delivery_id]))
+    assert target.notify_queue.empty()
+    assert delivery_id not in target.pending_traces
+    assert target.retry_scheduler.in_flight == 0
+
+
+def test_load_notify_targets(monkeypatch):
+    monkeypatch.setenv('NOTIFY_TARGETS', '[{"name": "a", "url": "http://a", "key": "k", "limit_per_host": 4}]')
+    assert load_notify_targets() == [{'name': 'a', 'url': 'http://a', 'key': 'k', 'limit_per_host': 4}]
+
+
+@pytest.mark.parametrize('raw', [
+    '[{"name": "a", "url": "http://a"}]',
+    '[{"name": "a", "url": "http://a", "key": "k", "retries": 3}]',
+    '[{"name": "a", "url": "http://a", "key": "k"}, {"name": "a", "url": "http://b", "key": "k"}]',
+    '["http://a"]',
+    '{"name": "a", "url": "http://a", "key": "k"}',
+])
+def test_invalid_notify_targets_are_rejected(monkeypatch, raw):
+    monkeypatch.setenv('NOTIFY_TARGETS', raw)
+    with pytest.raises(ValueError):
+        load_notify_targets()
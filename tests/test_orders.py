@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+from conftest import now_text
+from main import OrderRegistry, WeChatPaymentAPI
+
+
+def payment(amount: str, message: str = '', timestamp: str = None, source: str = 'default') -> dict:
+    return {'amount': amount, 'sender': '张三', 'message': message, 'timestamp': timestamp or now_text(),
+            'remark': '收款成功', 'source': source}
+
+
+def test_match_by_amount_and_token():
+    registry = OrderRegistry(match_slack=60)
+    order = registry.create('12.34', 'A1001')
+    other = registry.create('12.34', 'A1002')
+
+    assert registry.match(payment('12.34', '订单 a1001 谢谢')) is order
+    assert order.status == 'paid'
+    assert other.status == 'pending'
+    assert registry.match(payment('12.35', 'A1002')) is None
+    assert len(registry) == 1
+
+
+def test_amount_only_order_matches_any_message():
+    registry = OrderRegistry(match_slack=60)
+    order = registry.create('0.99')
+    assert registry.match(payment('0.99', '随便写的留言')) is order
+
+
+def test_payment_before_order_creation_does_not_match():
+    registry = OrderRegistry(match_slack=60)
+    order = registry.create('5.00', 'A1')
+
+    assert registry.match(payment('5.00', 'A1', now_text(-3600))) is None
+    assert order.status == 'pending'
+    # 支付时间在允许误差内（界面时间只精确到秒，且与本机时钟可能有偏差）
+    assert registry.match(payment('5.00', 'A1', now_text(-30))) is order
+
+
+def test_unparseable_payment_time_does_not_match():
+    registry = OrderRegistry(match_slack=60)
+    registry.create('5.00')
+    assert registry.match(payment('5.00', timestamp='昨天 10:00')) is None
+
+
+def test_token_orders_win_over_amount_only_orders():
+    registry = OrderRegistry(match_slack=60)
+    amount_only = registry.create('5.00')
+    by_token = registry.create('5.00', 'A1')
+    second_token = registry.create('5.00', 'B2')
+
+    # 留言词匹配的订单中先登记的先匹配，只按金额匹配的订单最后
+    assert registry.match(payment('5.00', 'B2 A1')) is by_token
+    assert registry.match(payment('5.00', 'B2 A1')) is second_token
+    assert registry.match(payment('5.00', 'B2 A1')) is amount_only
+
+
+def test_amount_only_order_does_not_take_token_payment():
+    registry = OrderRegistry(match_slack=60)
+    amount_only = registry.create('5.00')
+    by_token = registry.create('5.00', 'A1')
+
+    assert registry.match(payment('5.00', 'A1')) is by_token
+    assert amount_only.status == 'pending'
+    assert registry.match(payment('5.00', '没有留言词')) is amount_only
+
+
+def test_matched_payment_records_source():
+    registry = OrderRegistry(match_slack=60)
+    order = registry.create('5.00', 'A1')
+    registry.match(payment('5.00', 'A1', source='shop-2'))
+    assert order.to_dict()['payment']['source'] == 'shop-2'
+    assert order.event.is_set()
+
+
+def test_expired_orders_do_not_match():
+    registry = OrderRegistry(match_slack=60)
+    order = registry.create('5.00', 'A1', ttl=0)
+    time.sleep(0.01)
+    assert registry.match(payment('5.00', 'A1')) is None
+    assert order.status == 'expired'
+
+
+def test_create_rejects_invalid_amount_and_duplicate_id():
+    registry = OrderRegistry(match_slack=60)
+    registry.create('1.00', order_id='o1')
+    with pytest.raises(ValueError):
+        registry.create('abc')
+    with pytest.raises(ValueError):
+        registry.create('1.00', order_id='o1')
+
+
+def test_backfilled_payments_are_not_matched(db_name):
+    api = WeChatPaymentAPI(db_name)
+    order = api.orders.create('5.00', 'A1')
+
+    api.on_new_payment(dict(payment('5.00', 'A1'), backfill=True))
+    assert order.status == 'pending'
+    # 补录记录仍然进入最近支付缓存，但不带 backfill 标记
+    covered, cached = api.recent_cache.lookup(int(time.time()) - 60, int(time.time()) + 60, 'A1')
+    assert covered and cached is not None and 'backfill' not in cached
+
+    api.on_new_payment(payment('5.00', 'A1'))
+    assert order.status == 'paid'
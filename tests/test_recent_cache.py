@@ -0,0 +1,44 @@
+import time
+
+from main import RecentPaymentCache
+
+
+def cached(sender: str, ts_epoch: int, message: str = '') -> dict:
+    return {'amount': '5.00', 'sender': sender, 'message': message,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts_epoch)), 'remark': '收款成功',
+            'source': 'default'}
+
+
+def warmed_cache() -> RecentPaymentCache:
+    cache = RecentPaymentCache(horizon=3600, max_items=1000)
+    cache.complete_since = int(time.time()) - 3600
+    return cache
+
+
+def test_sender_lookup_matches_substring_like_database():
+    cache = warmed_cache()
+    now = int(time.time())
+    cache.add(cached('张三', now - 1800))
+    cache.add(cached('张三丰', now - 30))
+
+    # 与数据库的 LIKE '%张三%' 一致：窗口外的 张三 不影响窗口内的 张三丰
+    covered, payment_data = cache.lookup(now - 60, now + 60, wechat_id='张三')
+    assert covered and payment_data['sender'] == '张三丰'
+    covered, payment_data = cache.lookup(now - 60, now + 60, wechat_id='李四')
+    assert covered and payment_data is None
+
+
+def test_window_before_warm_range_is_not_covered():
+    cache = warmed_cache()
+    now = int(time.time())
+    assert cache.lookup(now - 7200, now, wechat_id='张三') == (False, None)
+
+
+def test_token_and_like_lookups():
+    cache = warmed_cache()
+    now = int(time.time())
+    cache.add(cached('张三', now - 10, '订单 A1001 谢谢'))
+
+    assert cache.lookup(now - 60, now + 60, 'a1001', match='token')[1]['sender'] == '张三'
+    assert cache.lookup(now - 60, now + 60, 'A100', match='token')[1] is None
+    assert cache.lookup(now - 60, now + 60, 'A100')[1]['sender'] == '张三'
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import pytest
+
+from main import NotifyTarget, PaymentNotifier, RetryScheduler
+
+
+def test_in_flight_delivery_is_not_dispatched_again():
+    scheduler = RetryScheduler()
+    assert scheduler.claim(1)
+    assert not scheduler.claim(1)
+    assert not scheduler.schedule(1, 0)
+    assert len(scheduler) == 0
+
+    # 处理完成后按 next_due 重新调度
+    scheduler.complete(1, 0)
+    assert len(scheduler) == 1 and scheduler.in_flight == 0
+    assert not scheduler.claim(1)
+
+
+def test_earlier_due_time_wins():
+    scheduler = RetryScheduler()
+    now = time.time()
+    assert scheduler.schedule(1, now + 60)
+    assert not scheduler.schedule(1, now + 120)
+    assert scheduler.schedule(1, now - 1)
+    assert len(scheduler) == 1
+
+    assert asyncio.run(asyncio.wait_for(scheduler.wait_due(), 1)) == [1]
+    # 被覆盖的较晚安排不会再次出堆
+    assert scheduler._peek() is None
+    assert scheduler.in_flight == 1
+
+
+def test_wait_due_returns_due_items_in_order_and_respects_max_batch():
+    scheduler = RetryScheduler(max_batch=2)
+    now = time.time()
+    for payment_id, offset in ((1, -1), (2, -3), (3, -2), (4, 60)):
+        scheduler.schedule(payment_id, now + offset)
+
+    async def run():
+        return [await asyncio.wait_for(scheduler.wait_due(), 1), await asyncio.wait_for(scheduler.wait_due(), 1)]
+
+    assert asyncio.run(run()) == [[2, 3], [1]]
+    assert len(scheduler) == 1 and scheduler.in_flight == 3
+
+
+def test_wait_due_wakes_for_new_schedule():
+    scheduler = RetryScheduler()
+
+    async def run():
+        waiting = asyncio.create_task(scheduler.wait_due())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        scheduler.schedule(7, time.time() + 0.02)
+        return await asyncio.wait_for(waiting, 1)
+
+    assert asyncio.run(run()) == [7]
+
+
+@pytest.fixture
+def notifier(db_name):
+    notifier = PaymentNotifier('', '', db_name=db_name, targets=[{'name': 'a', 'url': 'http://a', 'key': 'k'}])
+    yield notifier
+    notifier.db_executor.stop()
+
+
+def test_failed_status_write_reschedules_delivery(notifier, monkeypatch):
+    target: NotifyTarget = notifier.targets['a']
+    payment_data = {'id': 1, 'delivery_id': 10, 'trace': {'detected': 1000.0}}
+    assert target.retry_scheduler.claim(10)
+
+    async def failing_write(fn):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(notifier.db_executor, 'write', failing_write)
+    started = time.time()
+    assert asyncio.run(notifier.update_notify_statuses(target, [(payment_data, 2, 1, 'HTTP 500')])) == [None]
+
+    # 本次结果未落库：按退避时间重新调度，追踪时间保留
+    scheduler = target.retry_scheduler
+    assert scheduler.in_flight == 0
+    assert started + 2 <= scheduler._due[10] <= time.time() + 2
+    assert target.pending_traces[10] == {'detected': 1000.0}
+    assert target.status_write_failures == 1
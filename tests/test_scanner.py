@@ -0,0 +1,87 @@
+from conftest import build_payment_item, build_payment_window
+from main import IncrementalListScanner, MemoryControl, WeChatPaymentMonitor
+
+
+def test_scan_returns_only_new_items_in_list_order():
+    _, payment_list = build_payment_window(50)
+    scanner = IncrementalListScanner()
+    assert len(scanner.scan(payment_list, 1000)) == 50
+
+    assert scanner.scan(payment_list, 1000) == []
+    assert scanner.last_items_walked == 1
+
+    added = [payment_list.append(build_payment_item(i)) for i in range(50, 53)]
+    assert scanner.scan(payment_list, 1000) == added
+    assert scanner.last_items_walked == 4
+
+
+def test_scan_skips_non_list_items():
+    _, payment_list = build_payment_window(3)
+    scanner = IncrementalListScanner()
+    scanner.scan(payment_list, 1000)
+
+    payment_list.append(MemoryControl('PaneControl', '分隔'))
+    item = payment_list.append(build_payment_item(3))
+    payment_list.append(MemoryControl('PaneControl', '分隔'))
+    assert scanner.scan(payment_list, 1000) == [item]
+
+
+def test_items_without_runtime_id_are_told_apart_by_position():
+    payment_list = MemoryControl('ListControl', '消息')
+    for _ in range(3):
+        payment_list.append(MemoryControl('ListItemControl', '收款 1.00元', runtime_id=()))
+    scanner = IncrementalListScanner()
+    assert len(scanner.scan(payment_list, 1000)) == 3
+    assert scanner.scan(payment_list, 1000) == []
+
+    # 与已处理列表项同名的新列表项
+    item = payment_list.append(MemoryControl('ListItemControl', '收款 1.00元', runtime_id=()))
+    assert scanner.scan(payment_list, 1000) == [item]
+
+
+def test_scan_reports_truncation_beyond_limit():
+    _, payment_list = build_payment_window(5)
+    scanner = IncrementalListScanner()
+    scanner.scan(payment_list, 1000)
+
+    added = [payment_list.append(build_payment_item(i)) for i in range(5, 10)]
+    assert scanner.scan(payment_list, 3) == added[-3:]
+    assert scanner.last_truncated
+
+    # 截断后更早的新列表项排在已处理的列表项之后，不会再被扫描到（监控器因此不在正常扫描中截断）
+    payment_list.append(build_payment_item(10))
+    assert len(scanner.scan(payment_list, 3)) == 1
+    assert not scanner.last_truncated
+
+
+def test_monitor_keeps_burst_beyond_normal_run_limit(tmp_path, monkeypatch):
+    monkeypatch.setenv('NORMAL_RUN_LIMIT', '3')
+    window, payment_list = build_payment_window(5)
+    monitor = WeChatPaymentMonitor(db_name=str(tmp_path / 'payments.db'), wechat_window=window,
+                                   payment_list=payment_list, install_handlers=False)
+    monitor.get_all_payment_records(is_first_run=True)
+
+    for i in range(5, 12):
+        payment_list.append(build_payment_item(i))
+    new_payments = monitor.get_all_payment_records()
+    assert [payment['sender'] for payment in new_payments] == [f"用户{i}" for i in range(5, 12)]
+    assert not monitor.scanner.last_truncated
+    assert monitor.get_all_payment_records() == []
+
+
+def test_monitor_marks_first_run_rows_as_backfill(tmp_path):
+    window, payment_list = build_payment_window(3)
+    monitor = WeChatPaymentMonitor(db_name=str(tmp_path / 'payments.db'), wechat_window=window,
+                                   payment_list=payment_list, install_handlers=False)
+
+    history = monitor.get_all_payment_records(is_first_run=True)
+    assert [payment['sender'] for payment in history] == ['用户0', '用户1', '用户2']
+    assert all(payment['backfill'] for payment in history)
+
+    payment_list.append(build_payment_item(3))
+    new_payments = monitor.get_all_payment_records()
+    assert len(new_payments) == 1
+    assert new_payments[0]['amount'] == '4.00'
+    assert new_payments[0]['message'] == 'ORDER00000003'
+    assert new_payments[0]['source'] == 'default'
+    assert 'backfill' not in new_payments[0]
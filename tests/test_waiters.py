@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+from main import PaymentWaiters
+
+START = datetime(2024, 1, 1, 10, 0, 0)
+END = START + timedelta(minutes=5)
+
+
+def payment(message: str = '', sender: str = '张三丰', timestamp: str = '2024-01-01 10:01:00') -> dict:
+    return {'amount': '5.00', 'sender': sender, 'message': message, 'timestamp': timestamp, 'remark': '收款成功',
+            'source': 'default'}
+
+
+def test_publish_wakes_only_matching_waiters():
+    waiters = PaymentWaiters()
+    like = waiters.register(START, END, message='A100')
+    token = waiters.register(START, END, message='a1001', match='token')
+    partial_token = waiters.register(START, END, message='A100', match='token')
+    sender = waiters.register(START, END, wechat_id='张三')
+    other_sender = waiters.register(START, END, wechat_id='李四')
+    unfiltered = waiters.register(START, END)
+
+    waiters.publish(payment('订单 A1001 谢谢'))
+    assert like.event.is_set() and like.payment['sender'] == '张三丰'
+    assert token.event.is_set()
+    assert sender.event.is_set()
+    assert unfiltered.event.is_set()
+    # 留言词按完整词匹配，付款人按子串匹配
+    assert not partial_token.event.is_set()
+    assert not other_sender.event.is_set()
+
+
+def test_message_and_sender_must_both_match():
+    waiters = PaymentWaiters()
+    waiter = waiters.register(START, END, message='A1', wechat_id='李四')
+
+    waiters.publish(payment('A1'))
+    assert not waiter.event.is_set()
+    waiters.publish(payment('A1', sender='李四'))
+    assert waiter.event.is_set()
+
+
+def test_waiters_outside_time_window_stay_parked():
+    waiters = PaymentWaiters()
+    waiter = waiters.register(START, END, message='A1')
+
+    waiters.publish(payment('A1', timestamp='2024-01-01 09:59:59'))
+    waiters.publish(payment('A1', timestamp='2024-01-01 10:05:01'))
+    assert not waiter.event.is_set()
+    assert len(waiters) == 1
+
+    waiters.publish(payment('A1', timestamp='2024-01-01 10:05:00'))
+    assert waiter.event.is_set()
+
+
+def test_unregister_keeps_key_lengths_consistent():
+    waiters = PaymentWaiters()
+    short = waiters.register(START, END, message='A1')
+    same_key = waiters.register(START, END, message='A1')
+    long = waiters.register(START, END, message='LONGORDER')
+    sender = waiters.register(START, END, wechat_id='张三')
+    assert waiters._key_lengths == {'message': {2: 1, 9: 1}, 'sender': {2: 1}}
+
+    waiters.unregister(long)
+    assert waiters._key_lengths['message'] == {2: 1}
+    waiters.unregister(short)
+    assert waiters._key_lengths['message'] == {2: 1}
+    waiters.unregister(same_key)
+    waiters.unregister(same_key)
+    waiters.unregister(sender)
+    assert waiters._key_lengths == {'message': {}, 'sender': {}}
+    assert len(waiters) == 0
+
+    # 索引清空后仍能正常登记和唤醒
+    again = waiters.register(START, END, message='A1')
+    waiters.publish(payment('订单A1'))
+    assert again.event.is_set()
+
+
+def test_release_all_wakes_every_waiter():
+    waiters = PaymentWaiters()
+    registered = [waiters.register(START, END, message='A1'), waiters.register(START, END, wechat_id='张三'),
+                  waiters.register(START, END)]
+    waiters.release_all()
+    assert all(waiter.event.is_set() and waiter.payment is None for waiter in registered)